@@ -0,0 +1,273 @@
+import asyncio
+from contextvars import ContextVar
+import heapq
+import itertools
+import time
+from typing import AsyncIterator, Callable
+
+from helpers.tracing import ADMISSION_WAIT, trace_span
+
+# Priorities of upstream calls, most urgent first
+PRIORITIES = ("first_sentence", "interactive", "background")
+
+# The priority of the request being served. Announcements, renders and pre-warming are "background",
+# the TTS pipeline raises the first sentence of an interactive turn to "first_sentence".
+current_priority = ContextVar("current_priority", default="interactive")
+
+# Called with True when a TTS call of the current task starts waiting for admission and with False once it is admitted,
+# so TTS failover times the engine from its admission, not from the time it waited in line
+on_tts_admission = ContextVar("on_tts_admission", default=None)
+
+class Overloaded(Exception):
+    """Background work was shed because an upstream is overloaded."""
+
+class Ticket:
+    """
+    An admitted call. It holds a concurrency slot of its lane until it is released.
+    """
+    def __init__(self, lane=None):
+        self.lane = lane
+        self.released = False
+
+    def charge(self, units: int):
+        """Takes more of the rate budget, for costs only known as the call goes (LLM tokens)."""
+        if self.lane:
+            self.lane.charge(units)
+
+    def release(self):
+        if self.lane and not self.released:
+            self.released = True
+            self.lane.release()
+
+class Lane:
+    """
+    Admission control for one upstream: the LLM or a TTS engine.
+
+    At most `max_concurrent` calls run at once. With `rate_per_minute`, calls also take units (LLM tokens or TTS characters)
+    from a budget that refills at that rate and holds one minute of it. Calls that do not fit wait in priority order,
+    first come first served within a priority. Nothing overtakes the head of the line, so background work
+    cannot use up the budget an interactive turn is waiting for.
+    Background calls are shed when `shed_queue_depth` of them are already waiting, or after waiting `shed_wait_seconds`.
+    """
+    def __init__(self, name: str, lane_cfg: dict, shed_queue_depth: int, shed_wait_seconds: float, logger):
+        self.name = name
+        self.max_concurrent = lane_cfg["max_concurrent"]
+        self.rate_per_minute = lane_cfg.get("rate_per_minute")
+        self.shed_queue_depth = shed_queue_depth
+        self.shed_wait_seconds = shed_wait_seconds
+        self.logger = logger
+        self.in_flight = 0
+        self.budget = self.rate_per_minute or 0
+        self.refilled_at = time.monotonic()
+        self.waiters = []  # Heap of (priority rank, arrival, cost, future, enqueued at)
+        self.arrivals = itertools.count()
+        self.timer = None
+        self.counters = {priority: {"admitted": 0, "waited": 0, "shed": 0} for priority in PRIORITIES}
+
+    def _refill(self):
+        if self.rate_per_minute:
+            now = time.monotonic()
+            self.budget = min(self.rate_per_minute, self.budget + (now - self.refilled_at) * self.rate_per_minute / 60)
+            self.refilled_at = now
+
+    def _fits(self, cost: int):
+        # A call that costs more than the whole budget goes once the budget is full
+        return self.in_flight < self.max_concurrent and (not self.rate_per_minute or self.budget >= min(cost, self.rate_per_minute))
+
+    def _take(self, cost: int):
+        self.in_flight += 1
+        if self.rate_per_minute:
+            self.budget -= cost
+
+    def _dispatch(self):
+        """Admits the waiting calls that fit, in order. When only the rate budget holds them back, tries again once it has refilled."""
+        if self.timer:
+            self.timer.cancel()
+            self.timer = None
+        self._refill()
+        while self.waiters:
+            _, _, cost, future, _ = self.waiters[0]
+            if future.done():  # Gave up waiting
+                heapq.heappop(self.waiters)
+                continue
+            if not self._fits(cost):
+                break
+            heapq.heappop(self.waiters)
+            self._take(cost)
+            future.set_result(None)
+        if self.waiters and self.in_flight < self.max_concurrent and self.rate_per_minute:
+            missing = min(self.waiters[0][2], self.rate_per_minute) - self.budget
+            self.timer = asyncio.get_running_loop().call_later(max(missing, 1) * 60 / self.rate_per_minute, self._dispatch)
+
+    def queued(self, priority: str = None):
+        """Returns the number of waiting calls, of one priority or all."""
+        rank = PRIORITIES.index(priority) if priority else None
+        return sum(1 for waiter in self.waiters if not waiter[3].done() and (rank is None or waiter[0] == rank))
+
+    def longest_wait(self):
+        """Returns how long the oldest waiting call has been waiting."""
+        return max((time.monotonic() - waiter[4] for waiter in self.waiters if not waiter[3].done()), default=0.0)
+
+    def overloaded(self):
+        """Returns True when new background work would be shed."""
+        return self.queued("background") >= self.shed_queue_depth or self.longest_wait() >= self.shed_wait_seconds
+
+    def _shed(self, priority: str, reason: str):
+        self.counters[priority]["shed"] += 1
+        self.logger.warning(f"ADMISSION {self.name.upper()}: {priority} call shed, {reason}")
+        raise Overloaded(f"{self.name} is overloaded: {reason}")
+
+    async def admit(self, priority: str, cost: int):
+        """Waits for a slot (and `cost` units of the rate budget) and returns a Ticket. Raises Overloaded for shed calls."""
+        self._refill()
+        if not self.queued() and self._fits(cost):
+            self._take(cost)
+            self.counters[priority]["admitted"] += 1
+            ADMISSION_WAIT.observe(0.0, lane=self.name, priority=priority)
+            return Ticket(self)
+        if priority == "background" and self.queued("background") >= self.shed_queue_depth:
+            self._shed(priority, f"{self.shed_queue_depth} background calls waiting")
+
+        start = time.monotonic()
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.waiters, (PRIORITIES.index(priority), next(self.arrivals), cost, future, start))
+        span = trace_span("admission_wait", lane=self.name, priority=priority, queued=self.queued())
+        try:
+            await asyncio.wait([future], timeout=self.shed_wait_seconds if priority == "background" else None)
+        except asyncio.CancelledError:
+            if future.done():
+                self.release()  # Admitted just before we were cancelled
+            else:
+                future.cancel()
+                self._dispatch()
+            span.end(status="cancelled")
+            raise
+        waited = time.monotonic() - start
+        if not future.done():
+            future.cancel()
+            self._dispatch()
+            span.end(status="shed")
+            self._shed(priority, f"waited {waited:.1f}s")
+        span.end(status="admitted")
+        self.counters[priority]["admitted"] += 1
+        self.counters[priority]["waited"] += 1
+        ADMISSION_WAIT.observe(waited, lane=self.name, priority=priority)
+        return Ticket(self)
+
+    def charge(self, units: int):
+        if self.rate_per_minute:
+            self._refill()
+            self.budget -= units
+
+    def release(self):
+        self.in_flight -= 1
+        self._dispatch()
+
+    def stats(self):
+        self._refill()
+        return {
+            "in_flight": self.in_flight,
+            "max_concurrent": self.max_concurrent,
+            "queued": {priority: self.queued(priority) for priority in PRIORITIES},
+            "longest_wait_seconds": round(self.longest_wait(), 3),
+            "rate_per_minute": self.rate_per_minute,
+            "budget_left": round(self.budget) if self.rate_per_minute else None,
+            "by_priority": self.counters,
+        }
+
+class Admission:
+    """
+    Admission control for all upstream calls: one lane for the LLM ("llm") and one per TTS engine.
+    Lanes are set up in the "lanes" settings, by name, on top of the "default" lane, and created on their first call.
+    """
+    def __init__(self, admission_cfg: dict, logger):
+        self.enabled = admission_cfg["enabled"]
+        self.lanes_cfg = admission_cfg["lanes"]
+        self.shed_queue_depth = admission_cfg["shed_queue_depth"]
+        self.shed_wait_seconds = admission_cfg["shed_wait_seconds"]
+        self.logger = logger
+        self.lanes = {}
+
+    def lane(self, name: str):
+        if name not in self.lanes:
+            lane_cfg = {**self.lanes_cfg["default"], **self.lanes_cfg.get(name, {})}
+            self.lanes[name] = Lane(name, lane_cfg, self.shed_queue_depth, self.shed_wait_seconds, self.logger)
+        return self.lanes[name]
+
+    async def admit(self, lane: str, cost: int = 0, priority: str = None):
+        """Admits a call to an upstream at the priority of the current request, see `Lane.admit`."""
+        if not self.enabled:
+            return Ticket()
+        return await self.lane(lane).admit(priority or current_priority.get(), cost)
+
+    def overloaded(self, *lanes: str):
+        """Returns True when new background work on any of these upstreams would be shed."""
+        return self.enabled and any(self.lane(lane).overloaded() for lane in lanes)
+
+    def stats(self):
+        """Returns the calls in flight, the queue depth and wait, the rate budget and the counters of each lane."""
+        return {name: lane.stats() for name, lane in self.lanes.items()}
+
+def first_sentence_priority():
+    """
+    Raises the priority of the current task when it synthesizes the first sentence of an interactive turn,
+    which is what the user is waiting for. Call it in the task of that sentence only.
+    """
+    if current_priority.get() == "interactive":
+        current_priority.set("first_sentence")
+
+def admitted_tts(tts_function: Callable):
+    """
+    Wraps a TTS function so each sentence is admitted on the lane of its engine and charged its characters.
+    """
+    async def stream(sentence: str, cfg: dict, logger):
+        on_admission = on_tts_admission.get()
+        if on_admission:
+            on_admission(True)
+        ticket = await admission.admit(cfg["main"]["tts_engine"], len(sentence))
+        if on_admission:
+            on_admission(False)
+        try:
+            async for audio_chunk in tts_function(sentence, cfg, logger):
+                yield audio_chunk
+        finally:
+            ticket.release()
+    return stream
+
+def admitted_tts_text(tts_text_function: Callable):
+    """
+    Wraps a text streaming TTS function: the session holds one slot of the lane of its engine
+    and is charged the characters as they are sent. It starts the audio of the turn, so it goes as a first sentence.
+    """
+    async def stream(text_chunks: AsyncIterator[str], cfg: dict, logger):
+        priority = current_priority.get()
+        ticket = await admission.admit(cfg["main"]["tts_engine"], priority="first_sentence" if priority == "interactive" else priority)
+
+        async def charged():
+            async for text in text_chunks:
+                ticket.charge(len(text))
+                yield text
+
+        try:
+            async for audio_chunk in tts_text_function(charged(), cfg, logger):
+                yield audio_chunk
+        finally:
+            ticket.release()
+    return stream
+
+# The shared admission control, see `start_admission`
+admission = None
+
+def start_admission(cfg: dict, logger):
+    """
+    Creates the shared admission control.
+    """
+    global admission
+    admission = Admission(cfg["admission"], logger)
+    return admission
+
+def admission_get():
+    """
+    Returns the shared admission control
+    """
+    return admission
@@ -1,61 +1,411 @@
 import asyncio
-from typing import Callable
+from contextlib import aclosing
+import json
+import time
+from typing import AsyncIterator, Callable
 
-async def create_persistent_flac_encoder():
+import numpy as np
+
+from helpers.pcm_encoding import PCMEncoder, Resampler
+from helpers.tracing import trace_event
+from helpers.tts_streaming import tts_output_format
+
+# Formats /play and /tts_say can stream
+OUTPUT_FORMATS = {"flac", "mp3", "wav", "pcm", "opus"}
+
+# Formats we can encode raw PCM to without ffmpeg
+IN_PROCESS_FORMATS = {"flac", "wav"}
+
+def media_type(output_format: str, input_format: dict):
+    """
+    Returns the Content-Type of a stream in one of the OUTPUT_FORMATS.
+    """
+    if output_format == "pcm":
+        return f"audio/L16;rate={input_format['rate']};channels={input_format['channels']}"
+    return {"mp3": "audio/mpeg", "opus": "audio/ogg"}.get(output_format, "audio/" + output_format)
+
+def encodes_in_process(input_format: dict, output_format: str):
+    """
+    Checks if audio in input_format can be encoded to output_format in-process, without ffmpeg.
+    """
+    return input_format["codec"] == "pcm" and output_format in IN_PROCESS_FORMATS
+
+def ffmpeg_input_args(input_format: dict):
+    """
+    Returns ffmpeg arguments describing the input audio.
+    Compressed formats are detected by ffmpeg, raw PCM has to be described explicitly.
+    """
+    if input_format["codec"] == "pcm":
+        return ['-f', 's16le', '-ar', str(input_format["rate"]), '-ac', str(input_format["channels"])]
+    return []
+
+def ffmpeg_output_args(output_format: dict):
+    """
+    Returns ffmpeg arguments for writing audio in a TTS output format (see `tts_output_format`).
+    """
+    if output_format["codec"] == "pcm":
+        return ['-f', 's16le', '-ar', str(output_format["rate"]), '-ac', str(output_format["channels"])]
+    return ['-f', output_format["codec"]]
+
+async def resample_pcm_stream(source: AsyncIterator[bytes], input_format: dict, output_format: dict):
+    """
+    Converts a stream of raw PCM to another sample rate and channel count in-process,
+    e.g. when a sentence is synthesized by a fallback engine with a different sample rate.
+    """
+    resampler = Resampler(input_format["rate"], output_format["rate"])
+    frame_bytes = 2 * input_format["channels"]
+    remainder = b""  # Bytes of an incomplete input frame
+    async with aclosing(source):
+        async for audio_data in source:
+            data = remainder + audio_data
+            usable = len(data) - len(data) % frame_bytes
+            remainder = data[usable:]
+            frames = np.frombuffer(data[:usable], dtype="<i2").reshape(-1, input_format["channels"])
+            if output_format["channels"] != input_format["channels"]:
+                # Up-mix by repeating the first channel, down-mix by keeping the first ones
+                frames = np.repeat(frames[:, :1], output_format["channels"], axis=1) if input_format["channels"] == 1 else frames[:, :output_format["channels"]]
+            frames = resampler.process(frames)
+            if len(frames):
+                yield frames.astype("<i2").tobytes()
+
+async def convert_audio_stream(source: AsyncIterator[bytes], input_format: dict, output_format: dict):
+    """
+    Converts a stream of audio from one TTS output format to another with a one-off ffmpeg process,
+    e.g. when a sentence is synthesized by a fallback engine with a different format.
+    """
+    process = await asyncio.create_subprocess_exec(
+        'ffmpeg',
+        '-hide_banner',
+        '-loglevel', 'error',
+        *ffmpeg_input_args(input_format),
+        '-i', 'pipe:0',
+        *ffmpeg_output_args(output_format),
+        'pipe:1',
+        stdin=asyncio.subprocess.PIPE,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.DEVNULL
+    )
+
+    async def feed():
+        try:
+            async with aclosing(source):
+                async for audio_data in source:
+                    process.stdin.write(audio_data)
+                    await process.stdin.drain()
+        finally:
+            process.stdin.close()
+
+    feed_task = asyncio.create_task(feed())
+    try:
+        while audio_data := await process.stdout.read(4096):
+            yield audio_data
+        await feed_task
+    finally:
+        feed_task.cancel()
+        await asyncio.gather(feed_task, return_exceptions=True)
+        if process.returncode is None:
+            process.kill()
+        await process.wait()
+
+async def create_encoder(input_format: dict, output_format: str = "flac"):
     """
-    Creates a persistent ffmpeg subprocess that reads MP3 from stdin, outputs FLAC on stdout.
-    This is a format that HAVPE can natively paly.
+    Creates an ffmpeg subprocess that reads audio from stdin and outputs FLAC (or MP3, Opus in Ogg) on stdout.
+    FLAC is a format that HAVPE can natively paly.
     """
     process = await asyncio.create_subprocess_exec(
         'ffmpeg',
         '-hide_banner',
         '-loglevel', 'error',
-        '-i', 'pipe:0',         # input is MP3 from stdin
+        *ffmpeg_input_args(input_format),
+        '-i', 'pipe:0',         # input audio from stdin
         '-ar', '24000',         # sample rate
         '-ac', '2',             # stereo
-        '-sample_fmt', 's16',  # force 16 bits-per-sample:
-        '-f', 'flac',           # output format
-        'pipe:1',               # send FLAC to stdout
+        *(['-sample_fmt', 's16'] if output_format == "flac" else []),  # force 16 bits-per-sample for FLAC
+        '-f', output_format,    # output format
+        'pipe:1',               # send the encoded audio to stdout
         stdin=asyncio.subprocess.PIPE,
         stdout=asyncio.subprocess.PIPE,
         stderr=asyncio.subprocess.PIPE
     )
     return process
 
-async def feed_encoder(encoder: asyncio.subprocess.Process, audio_source_function: Callable, cfg: dict, client_id: str, prompt =None, llm_config=None):
+class EncoderPool:
+    """
+    Keeps warm ffmpeg encoders ready, so no process is spawned on the request path in steady state.
+
+    An ffmpeg encoder finishes its container when its input ends, so each process serves exactly one stream:
+    `take` hands out a warm process and `release` replaces it with a fresh one in the background.
+    Idle processes are health-checked and recycled after `max_idle_seconds`.
+    The number of encoders in use is capped at `max_processes`, requests over the cap wait for a free one.
+    """
+    def __init__(self, warm_size: int, max_processes: int, max_idle_seconds: float, health_check_interval: float, logger):
+        self.warm_size = warm_size
+        self.max_processes = max_processes
+        self.max_idle_seconds = max_idle_seconds
+        self.health_check_interval = health_check_interval
+        self.logger = logger
+
+        self.idle = {}  # (input_format, output_format) -> [(process, spawned_at)]
+        self.formats = {}  # Same keys -> (input_format dict, output_format)
+        self.busy = 0
+        self.released = asyncio.Condition()
+        self.tasks = set()
+        self.refilling = {}  # Keys -> their running refill task
+        self.health_task = None
+        self.counters = {
+            "spawned": 0,
+            "spawned_on_request": 0,
+            "taken": 0,
+            "unhealthy": 0,
+            "recycled_idle": 0,
+            "waited": 0,
+            "wait_seconds_total": 0.0,
+            "wait_seconds_max": 0.0,
+        }
+
+    def stats(self):
+        """Returns the pool counters and sizes."""
+        return {
+            **self.counters,
+            "busy": self.busy,
+            "idle": sum(len(processes) for processes in self.idle.values()),
+        }
+
+    def _key(self, input_format: dict, output_format: str):
+        key = (json.dumps(input_format, sort_keys=True), output_format)
+        if key not in self.formats:
+            self.formats[key] = (input_format, output_format)
+            self.idle[key] = []
+        return key
+
+    async def _spawn(self, key):
+        process = await create_encoder(*self.formats[key])
+        self.counters["spawned"] += 1
+        return process
+
+    async def _refill(self, key):
+        """Spawns encoders until there are `warm_size` idle ones for this format."""
+        try:
+            while len(self.idle[key]) < self.warm_size:
+                self.idle[key].append((await self._spawn(key), time.monotonic()))
+        except OSError as e:
+            self.logger.error(f"Could not start ffmpeg: {e}")
+
+    def _schedule_refill(self, key):
+        if key not in self.refilling:
+            task = asyncio.create_task(self._refill(key))
+            task.add_done_callback(lambda _: self.refilling.pop(key, None))
+            self.refilling[key] = task
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+        return self.refilling[key]
+
+    async def _kill(self, process: asyncio.subprocess.Process):
+        if process.returncode is None:
+            process.kill()
+        await process.wait()
+
+    async def _health_check(self):
+        """Replaces idle encoders that have died or have been idle for too long."""
+        while True:
+            await asyncio.sleep(self.health_check_interval)
+            now = time.monotonic()
+            for key, processes in list(self.idle.items()):
+                for entry in list(processes):
+                    process, spawned_at = entry
+                    if process.returncode is not None:
+                        self.counters["unhealthy"] += 1
+                        processes.remove(entry)
+                    elif now - spawned_at > self.max_idle_seconds:
+                        self.counters["recycled_idle"] += 1
+                        processes.remove(entry)
+                        await self._kill(process)
+                if len(processes) < self.warm_size:
+                    self._schedule_refill(key)
+
+    def warm(self, input_format: dict, output_format: str = "flac"):
+        """
+        Starts keeping warm encoders for a format and the health checks.
+        Returns the refill task, which is done once `warm_size` encoders are idle.
+        """
+        refill = self._schedule_refill(self._key(input_format, output_format))
+        if self.health_task is None:
+            self.health_task = asyncio.create_task(self._health_check())
+        return refill
+
+    async def take(self, input_format: dict, output_format: str = "flac"):
+        """Returns a ready encoder for the format, waiting if `max_processes` encoders are in use."""
+        key = self._key(input_format, output_format)
+        start = time.monotonic()
+        async with self.released:
+            await self.released.wait_for(lambda: self.busy < self.max_processes)
+            self.busy += 1
+        waited = time.monotonic() - start
+        if waited > 0.001:
+            self.counters["waited"] += 1
+        self.counters["wait_seconds_total"] += waited
+        self.counters["wait_seconds_max"] = max(self.counters["wait_seconds_max"], waited)
+        self.counters["taken"] += 1
+
+        try:
+            while self.idle[key]:
+                process, _ = self.idle[key].pop(0)
+                if process.returncode is None:
+                    return process
+                self.counters["unhealthy"] += 1
+
+            # No warm encoder for this format (yet), so we have to start one now
+            self.counters["spawned_on_request"] += 1
+            return await self._spawn(key)
+        except BaseException:
+            await self._release_slot()
+            raise
+        finally:
+            self._schedule_refill(key)
+
+    async def _release_slot(self):
+        async with self.released:
+            self.busy -= 1
+            self.released.notify()
+
+    async def release(self, process: asyncio.subprocess.Process):
+        """Gives an encoder back after its stream is done. It is killed if it is still running."""
+        try:
+            await self._kill(process)
+        finally:
+            await self._release_slot()
+
+    async def close(self):
+        """Stops the health checks and kills all idle encoders."""
+        for task in [self.health_task, *self.tasks]:
+            if task:
+                task.cancel()
+        for processes in self.idle.values():
+            for process, _ in processes:
+                await self._kill(process)
+            processes.clear()
+
+# The shared encoder pool, see `start_encoder_pool`
+encoder_pool = None
+
+def start_encoder_pool(cfg: dict, logger):
+    """
+    Creates the shared encoder pool and starts warming encoders for the configured TTS engine.
+    """
+    global encoder_pool
+    pool_cfg = cfg["encoder_pool"]
+    encoder_pool = EncoderPool(pool_cfg["warm_size"], pool_cfg["max_processes"], pool_cfg["max_idle_seconds"], pool_cfg["health_check_interval"], logger)
+    if not encodes_in_process(tts_output_format(cfg), "flac"):
+        encoder_pool.warm(tts_output_format(cfg), "flac")
+    return encoder_pool
+
+def encoder_pool_get():
+    """
+    Returns the shared encoder pool
+    """
+    return encoder_pool
+
+async def stop_encoder_pool():
+    """
+    Closes the shared encoder pool.
+    """
+    global encoder_pool
+    if encoder_pool:
+        await encoder_pool.close()
+        encoder_pool = None
+
+async def feed_encoder(encoder: asyncio.subprocess.Process, audio_source_function: Callable, prompt: str, cfg: dict, client_id: str, llm_config=None):
     """
     Feeds audio data from the provided audio source function to the encoder's stdin.
     This function streams audio data generated by the prompt_audio_streamer
     and writes it to the stdin of the encoder process. It ensures that the
     encoder receives the audio data in chunks and processes it accordingly.
+    If the audio source fails (e.g. shed by admission control), stdin is closed all the same,
+    so the encoder's output ends, and the error is raised to whoever awaits the feed.
     """
-    
-    async for audio_data in audio_source_function(cfg, client_id, prompt, llm_config):
-        encoder.stdin.write(audio_data)
-        await encoder.stdin.drain()
-        
-    encoder.stdin.close()
+    try:
+        async with aclosing(audio_source_function(prompt, cfg, client_id, llm_config)) as audio_source:
+            async for audio_data in audio_source:
+                encoder.stdin.write(audio_data)
+                await encoder.stdin.drain()
+    finally:
+        encoder.stdin.close()
+
+async def stream_pcm_encoded_from_audio_source(audio_source_function: Callable, prompt: str, cfg: dict, client_id: str, llm_config=None, output_format: str = "flac"):
+    """
+    Encodes raw PCM from the audio source to FLAC or WAV in-process and streams it to the caller.
+    FLAC frames are encoded in a worker thread, so the event loop keeps serving the other streams meanwhile.
+    """
+    input_format = tts_output_format(cfg)
+    encoder = PCMEncoder(input_format["rate"], input_format["channels"], output_format)
+    yield encoder.header()
+    first = True
+    async with aclosing(audio_source_function(prompt, cfg, client_id, llm_config)) as audio_source:
+        async for audio_data in audio_source:
+            if output_format == "flac":
+                encoded_chunk = await asyncio.to_thread(encoder.encode, audio_data)
+            else:
+                encoded_chunk = encoder.encode(audio_data)
+            if encoded_chunk:
+                if first:
+                    first = False
+                    trace_event("encoder_first_byte", encoder="in_process", format=output_format)
+                yield encoded_chunk
+    encoded_chunk = await asyncio.to_thread(encoder.flush) if output_format == "flac" else encoder.flush()
+    if encoded_chunk:
+        yield encoded_chunk
 
-async def stream_flac_from_audio_source(audio_source_function: Callable, cfg: dict, client_id: str,  prompt=None, llm_config=None):
+async def stream_encoded_from_audio_source(audio_source_function: Callable, prompt: str, cfg: dict, client_id: str, llm_config=None, output_format: str = "flac"):
     """
-    - Calls a function that generates mp3 stream
-    - Launches ffmpeg (Audio -> FLAC).
+    - Calls a function that generates an audio stream
+    - Raw PCM that HAVPE can play as FLAC/WAV is encoded in-process, without ffmpeg.
+    - Otherwise takes a warm ffmpeg encoder from the pool (Audio -> FLAC, WAV, MP3 or Opus).
     - Feeds each sentence's audio data from TTS -> ffmpeg stdin.
-    - Streams ffmpeg's FLAC output to the caller.
+    - Streams ffmpeg's output to the caller.
+    - If the caller stops early, stops feeding (which stops the TTS and LLM stages) and kills the encoder.
+    - If the audio source fails, streams what the encoder made of the audio so far, then raises its error.
     """
-    encoder = await create_persistent_flac_encoder()
-    
-    feed_task = asyncio.create_task(feed_encoder(encoder, audio_source_function, cfg, client_id, prompt, llm_config))
+    if encodes_in_process(tts_output_format(cfg), output_format):
+        async with aclosing(stream_pcm_encoded_from_audio_source(audio_source_function, prompt, cfg, client_id, llm_config, output_format)) as encoded_stream:
+            async for encoded_chunk in encoded_stream:
+                yield encoded_chunk
+        return
+
+    pool = encoder_pool
+    if pool:
+        encoder = await pool.take(tts_output_format(cfg), output_format)
+    else:
+        encoder = await create_encoder(tts_output_format(cfg), output_format)
 
+    feed_task = asyncio.create_task(feed_encoder(encoder, audio_source_function, prompt, cfg, client_id, llm_config))
+
+    completed = False
+    first = True
     try:
       while True:
-          flac_chunk = await encoder.stdout.read(4096)
-          if not flac_chunk:
+          encoded_chunk = await encoder.stdout.read(4096)
+          if not encoded_chunk:
               break
-          yield flac_chunk
+          if first:
+              first = False
+              trace_event("encoder_first_byte", encoder="ffmpeg", format=output_format)
+          yield encoded_chunk
+      completed = True
     finally:
-        await feed_task
-        await encoder.wait()
+        try:
+            if completed:
+                await feed_task
+                await encoder.wait()
 
-        # Capture and log ffmpeg stderr output
-        stderr_output = await encoder.stderr.read()
+                # Capture and log ffmpeg stderr output
+                stderr_output = await encoder.stderr.read()
+            else:
+                # Nobody reads ffmpeg's output anymore, so waiting for the feed would never end
+                feed_task.cancel()
+                await asyncio.gather(feed_task, return_exceptions=True)
+        finally:
+            if pool:
+                await pool.release(encoder)
+            elif encoder.returncode is None:
+                encoder.kill()
+                await encoder.wait()
@@ -0,0 +1,116 @@
+import asyncio
+from contextlib import aclosing
+import time
+from typing import AsyncIterator
+
+class Broadcast:
+    """
+    Runs one audio stream (an announcement in one output format) in the background and lets any number of listeners play it.
+
+    The audio is kept in an append-only buffer and every listener reads it with its own cursor from the start,
+    so a device that joins late still hears the whole announcement. Listeners that go away do not stop the source,
+    the others still need it. The source is stopped when the buffer would grow over `max_bytes`.
+    Once the source is done, the buffer is kept for `keep_seconds` for late joiners and then dropped.
+    """
+    def __init__(self, key: tuple, source: AsyncIterator[bytes], max_bytes: int, keep_seconds: float, logger):
+        self.key = key
+        self.max_bytes = max_bytes
+        self.keep_seconds = keep_seconds
+        self.logger = logger
+        self.chunks = []
+        self.size = 0
+        self.done = False
+        self.listeners = 0
+        self.total_listeners = 0
+        self.started_at = time.monotonic()
+        self.changed = asyncio.Condition()
+        self.expiry = None
+        self.task = asyncio.create_task(self._run(source))
+
+    async def _run(self, source: AsyncIterator[bytes]):
+        """Pulls the source into the buffer."""
+        try:
+            async with aclosing(source):
+                async for chunk in source:
+                    if self.size + len(chunk) > self.max_bytes:
+                        self.logger.error(f"BROADCAST {self.key[0]} STOPPED: longer than {self.max_bytes} bytes")
+                        break
+                    async with self.changed:
+                        self.chunks.append(chunk)
+                        self.size += len(chunk)
+                        self.changed.notify_all()
+        except Exception as e:
+            self.logger.error(f"Broadcast stream error: {e}")
+        finally:
+            self.done = True
+            async with self.changed:
+                self.changed.notify_all()
+            self.logger.info(f"BROADCAST {self.key[0]}.{self.key[1]} DONE after {time.monotonic() - self.started_at:.2f}s: {self.size} bytes to {self.total_listeners} listeners")
+            self.expiry = asyncio.get_running_loop().call_later(self.keep_seconds, self.cancel)
+
+    def cancel(self):
+        """Stops the source and drops the broadcast. Listeners that are still playing finish what is buffered."""
+        if self.expiry:
+            self.expiry.cancel()
+        self.task.cancel()
+        if broadcasts.get(self.key) is self:
+            del broadcasts[self.key]
+
+    async def listen(self):
+        """Yields the audio from the start, then the rest as it is produced."""
+        self.listeners += 1
+        self.total_listeners += 1
+        cursor = 0
+        try:
+            while True:
+                async with self.changed:
+                    await self.changed.wait_for(lambda: cursor < len(self.chunks) or self.done)
+                    if cursor == len(self.chunks):
+                        break
+                    # Everything that is buffered goes out at once, a late joiner catches up right away
+                    chunks = self.chunks[cursor:]
+                cursor += len(chunks)
+                for chunk in chunks:
+                    yield chunk
+        finally:
+            self.listeners -= 1
+
+    def stats(self):
+        return {
+            "id": self.key[0],
+            "format": self.key[1],
+            "bytes": self.size,
+            "done": self.done,
+            "listeners": self.listeners,
+            "total_listeners": self.total_listeners,
+            "age_seconds": round(time.monotonic() - self.started_at, 2),
+        }
+
+# Running and recently finished broadcasts, by (broadcast_id, audio_format, text)
+broadcasts = {}
+
+def get_broadcast(broadcast_id: str, text: str, audio_format: str, start_source, broadcast_cfg: dict, logger):
+    """
+    Returns the broadcast of an announcement in a format. The first listener starts it with `start_source()`,
+    the next ones attach to it. A new text under the same id is a new announcement. Returns (broadcast, started).
+    """
+    key = (broadcast_id, audio_format, text)
+    if key in broadcasts:
+        return broadcasts[key], False
+    logger.info(f"BROADCAST {broadcast_id}.{audio_format} STARTED")
+    broadcasts[key] = Broadcast(key, start_source(), broadcast_cfg["max_bytes"], broadcast_cfg["keep_seconds"], logger)
+    return broadcasts[key], True
+
+def cancel_broadcasts(broadcast_id: str = None):
+    """
+    Drops the broadcasts of an announcement in all formats, or all broadcasts.
+    """
+    for broadcast in list(broadcasts.values()):
+        if broadcast_id is None or broadcast.key[0] == broadcast_id:
+            broadcast.cancel()
+
+def broadcast_stats():
+    """
+    Returns the size and listener counts of each broadcast.
+    """
+    return [broadcast.stats() for broadcast in broadcasts.values()]
@@ -0,0 +1,46 @@
+import asyncio
+from contextlib import aclosing
+from typing import AsyncIterator
+
+from helpers.admission import Overloaded
+
+async def stream_until_disconnect(stream: AsyncIterator[bytes], client_id: str, logger):
+    """
+    Streams `stream` to a StreamingResponse and tears the whole pipeline down as soon as the client goes away.
+
+    Starlette cancels the response when the client disconnects, and keeps cancelling every await until it is done,
+    so the cleanup of our stages (closing the LLM stream, TTS requests and encoders) could never finish there.
+    Instead, the stream is pulled in its own task, one chunk ahead, and that task is cancelled once
+    when the response ends early. This runs the `finally` blocks of every stage of the pipeline.
+    A stream shed by admission control just ends, the device plays what it got.
+    """
+    chunks = asyncio.Queue(maxsize=1)
+
+    async def pull():
+        """Puts the chunks into the queue, followed by None, or the error that ended the stream."""
+        try:
+            async with aclosing(stream):
+                async for chunk in stream:
+                    await chunks.put(chunk)
+            await chunks.put(None)
+        except Exception as e:
+            await chunks.put(e)
+
+    puller = asyncio.create_task(pull())
+    finished = False
+    try:
+        while True:
+            chunk = await chunks.get()
+            if chunk is None or isinstance(chunk, Exception):
+                finished = True
+                if chunk is None:
+                    break
+                if isinstance(chunk, Overloaded):
+                    logger.warning(f"CLIENT {client_id}: STREAM CUT SHORT, {chunk}")
+                    break
+                raise chunk
+            yield chunk
+    finally:
+        if not finished:
+            logger.info(f"CLIENT {client_id} DISCONNECTED, STOPPING THE PIPELINE")
+            puller.cancel()
@@ -0,0 +1,135 @@
+from contextlib import aclosing
+from contextvars import ContextVar
+import time
+from typing import AsyncIterator
+
+from helpers.tracing import AUDIO_AHEAD, TTS_UNIT_CHARS
+
+# The pacing of the stream being produced. TTS engines read their responses in chunks of its size.
+current_pacing = ContextVar("current_pacing", default=None)
+
+# Read size of TTS responses without pacing
+DEFAULT_READ_SIZE = 1024
+
+class Pacing:
+    """
+    Tracks how many seconds of audio a stream has produced against the wall clock since its first audio,
+    which tells how far it is ahead of the device, assuming the device plays from the first byte in real time
+    (a device that starts later only has more buffered).
+
+    Below `buffer_low_seconds` ahead, units of speech and audio chunks stay small, so the next audio comes as soon as possible.
+    From there to `buffer_high_seconds`, sentences are grouped into TTS requests of up to `max_unit_chars`,
+    and audio is passed on in chunks growing from `min_chunk_bytes` to `max_chunk_bytes`, to cut the overhead per request and per chunk.
+    A chunk never holds more than a quarter of the audio that is ahead.
+    """
+    def __init__(self, pacing_cfg: dict, audio_format: dict):
+        self.low = pacing_cfg["buffer_low_seconds"]
+        self.high = pacing_cfg["buffer_high_seconds"]
+        self.min_chunk_bytes = pacing_cfg["min_chunk_bytes"]
+        self.max_chunk_bytes = pacing_cfg["max_chunk_bytes"]
+        self.max_unit_chars = pacing_cfg["max_unit_chars"]
+        self.frame_bytes = audio_format["channels"] * 2
+        self.bytes_per_second = audio_format["rate"] * self.frame_bytes
+        self.started_at = None
+        self.audio_seconds = 0.0
+        self.counters = {"units": 0, "unit_chars": 0, "chunks": 0, "max_chunk_bytes": 0, "min_ahead_seconds": None}
+
+    def produced(self, audio_bytes: int):
+        """Counts audio that was passed on to the device."""
+        if self.started_at is None:
+            self.started_at = time.monotonic()
+        self.audio_seconds += audio_bytes / self.bytes_per_second
+
+    def ahead(self):
+        """Returns the seconds of audio produced that the device has not played yet."""
+        if self.started_at is None:
+            return 0.0
+        return max(0.0, self.audio_seconds - (time.monotonic() - self.started_at))
+
+    def real_time_factor(self):
+        """Returns the wall-clock seconds it took per second of audio, since the first audio. Below 1 is faster than real time."""
+        if not self.audio_seconds:
+            return None
+        return (time.monotonic() - self.started_at) / self.audio_seconds
+
+    def level(self):
+        """Returns 0 at or below `buffer_low_seconds` ahead, 1 at or above `buffer_high_seconds`, and in between linearly."""
+        return min(1.0, max(0.0, (self.ahead() - self.low) / (self.high - self.low)))
+
+    def unit_chars(self):
+        """Returns how many characters of sentences to group into one TTS request, 0 to keep them as they are."""
+        return int(self.level() * self.max_unit_chars)
+
+    def chunk_bytes(self):
+        """Returns the size of the audio chunks to pass on, in whole frames."""
+        size = self.min_chunk_bytes * (self.max_chunk_bytes / self.min_chunk_bytes) ** self.level()
+        size = min(size, max(self.min_chunk_bytes, self.ahead() / 4 * self.bytes_per_second))
+        return int(size) // self.frame_bytes * self.frame_bytes
+
+    def unit(self, chars: int):
+        """Counts a unit of speech sent to TTS."""
+        ahead = self.ahead()
+        self.counters["units"] += 1
+        self.counters["unit_chars"] += chars
+        if self.started_at is not None and (self.counters["min_ahead_seconds"] is None or ahead < self.counters["min_ahead_seconds"]):
+            self.counters["min_ahead_seconds"] = ahead
+        AUDIO_AHEAD.observe(ahead)
+        TTS_UNIT_CHARS.observe(chars)
+
+    async def rechunk(self, audio: AsyncIterator[bytes]):
+        """
+        Passes the audio on in chunks of `chunk_bytes()`, counting it as produced.
+        If we are closed early, the audio source is closed too (which stops the TTS pipeline and the LLM).
+        """
+        pending = b""
+        async with aclosing(audio):
+            async for audio_chunk in audio:
+                pending += audio_chunk
+                if len(pending) >= self.chunk_bytes():
+                    self.counters["chunks"] += 1
+                    self.counters["max_chunk_bytes"] = max(self.counters["max_chunk_bytes"], len(pending))
+                    self.produced(len(pending))
+                    yield pending
+                    pending = b""
+        if pending:
+            self.counters["chunks"] += 1
+            self.produced(len(pending))
+            yield pending
+
+    def summary(self):
+        """Returns the chosen parameters and the measurements of the stream, for the logs."""
+        return {
+            **self.counters,
+            "audio_seconds": round(self.audio_seconds, 2),
+            "real_time_factor": round(self.real_time_factor(), 3) if self.audio_seconds else None,
+            "mean_unit_chars": round(self.counters["unit_chars"] / self.counters["units"]) if self.counters["units"] else None,
+        }
+
+def group_units(sentences: list, unit_chars: int):
+    """
+    Groups consecutive sentences into units of up to `unit_chars` characters, one TTS request each.
+    A sentence longer than that stays a unit of its own.
+    """
+    units = []
+    for sentence in sentences:
+        if units and len(units[-1]) + 1 + len(sentence) <= unit_chars:
+            units[-1] = units[-1] + " " + sentence
+        else:
+            units.append(sentence)
+    return units
+
+def start_pacing(pacing_cfg: dict, audio_format: dict):
+    """
+    Creates the pacing of the stream being produced, for the TTS engines too. Returns None when pacing is off.
+    Call it in the audio source, before the TTS tasks of the stream are created.
+    """
+    if not pacing_cfg["enabled"]:
+        return None
+    pacing = Pacing(pacing_cfg, audio_format)
+    current_pacing.set(pacing)
+    return pacing
+
+def read_size():
+    """Returns the size to read TTS responses in, for the stream being produced."""
+    pacing = current_pacing.get()
+    return pacing.chunk_bytes() if pacing else DEFAULT_READ_SIZE
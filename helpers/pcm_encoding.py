@@ -0,0 +1,225 @@
+import struct
+
+import numpy as np
+
+# HAVPE plays 24 kHz, stereo, 16 bits per sample
+OUTPUT_RATE = 24000
+OUTPUT_CHANNELS = 2
+BLOCK_SIZE = 4096
+
+# FLAC frame header codes
+FLAC_BLOCK_SIZE_CODES = {256: 0b1000, 512: 0b1001, 1024: 0b1010, 2048: 0b1011, 4096: 0b1100}
+FLAC_SAMPLE_RATE_CODES = {8000: 0b0100, 16000: 0b0101, 22050: 0b0110, 24000: 0b0111, 32000: 0b1000, 44100: 0b1001, 48000: 0b1010}
+FLAC_LEFT_SIDE = 0b1000  # Channel assignment: left + (left - right)
+FLAC_16_BITS = 0b100
+
+# x^(j + 16) mod P(x) for the FLAC CRC-16 (polynomial 0x8005), grown on demand, see `crc16`
+crc16_powers = np.zeros(0, dtype=np.uint16)
+
+def crc8(data: bytes):
+    """
+    CRC-8 (polynomial 0x07) of a FLAC frame header.
+    """
+    crc = 0
+    for byte in data:
+        crc ^= byte
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x07) & 0xFF if crc & 0x80 else (crc << 1) & 0xFF
+    return crc
+
+def crc16(data: bytes):
+    """
+    CRC-16 (polynomial 0x8005) of a FLAC frame, vectorized.
+    The CRC is linear, so it is the XOR of x^(j + 16) mod P(x) over all set bits j (counted from the end).
+    """
+    global crc16_powers
+    bits = np.unpackbits(np.frombuffer(data, dtype=np.uint8))
+    if len(bits) > len(crc16_powers):
+        powers = np.empty(max(len(bits), 2 * len(crc16_powers)), dtype=np.uint16)
+        value = 0x8005  # x^16 mod P(x)
+        for j in range(len(powers)):
+            powers[j] = value
+            value = ((value << 1) ^ 0x8005) & 0xFFFF if value & 0x8000 else (value << 1) & 0xFFFF
+        crc16_powers = powers
+    set_bits = len(bits) - 1 - np.flatnonzero(bits)
+    return int(np.bitwise_xor.reduce(crc16_powers[set_bits])) if len(set_bits) else 0
+
+def utf8_number(n: int):
+    """
+    Encodes a frame number the way FLAC does: like UTF-8, extended to 36 bits.
+    """
+    if n < 0x80:
+        return bytes([n])
+    for length, limit in ((2, 0x800), (3, 0x10000), (4, 0x200000), (5, 0x4000000), (6, 0x80000000), (7, 1 << 36)):
+        if n < limit:
+            break
+    tail = []
+    for _ in range(length - 1):
+        tail.insert(0, 0x80 | (n & 0x3F))
+        n >>= 6
+    return bytes([((0xFF << (8 - length)) & 0xFF) | n] + tail)
+
+def pack_bits(values: np.ndarray, widths: np.ndarray):
+    """
+    Packs fields (value, width in bits) MSB-first into bytes, padded with zeros to a whole byte.
+    Values must be non-negative. A field can be wider than its value (e.g. unary codes), the extra high bits are zeros.
+    """
+    offsets = np.cumsum(widths) - widths
+    total = int(widths.sum())
+    value_bits = max(int(values.max(initial=0)).bit_length(), 1)
+    # One column per bit of the value, from the highest to the lowest
+    shifts = np.arange(value_bits - 1, -1, -1)
+    valid = shifts[None, :] < np.minimum(widths, value_bits)[:, None]
+    positions = (offsets + widths - 1)[:, None] - shifts[None, :]
+    bits = np.zeros((total + 7) // 8 * 8, dtype=np.uint8)
+    bits[positions[valid]] = ((values[:, None] >> shifts[None, :]) & 1)[valid]
+    return np.packbits(bits).tobytes()
+
+def subframe_fields(samples: np.ndarray, bps: int):
+    """
+    Returns the fields of the smallest of the CONSTANT, FIXED (orders 0-2, Rice coded) and VERBATIM subframes.
+    """
+    mask = (1 << bps) - 1
+    if np.all(samples == samples[0]):
+        return np.array([0b00000000, int(samples[0]) & mask], dtype=np.int64), np.array([8, bps], dtype=np.int64)
+
+    n = len(samples)
+    best = None
+    for order in (0, 1, 2):
+        if n <= order:
+            continue
+        residual = np.diff(samples, n=order) if order else samples
+        # Zigzag encoding, so small negative residuals become small numbers
+        u = np.where(residual >= 0, residual << 1, ((-residual) << 1) - 1)
+        # The best Rice parameter is close to log2 of the mean, so we only try its neighbours.
+        # 4-bit parameters go up to 14 (15 is the escape code), louder residuals fall back to VERBATIM below.
+        estimate = min(int(np.log2(max(float(u.mean()), 1.0))), 14)
+        costs = {k: int(np.sum(u >> k)) + len(u) * (k + 1) for k in range(max(estimate - 1, 0), min(estimate + 2, 15))}
+        k = min(costs, key=costs.get)
+        bits = 8 + order * bps + 6 + 4 + costs[k]
+        if best is None or bits < best[0]:
+            best = (bits, order, u, k)
+
+    if best[0] >= 8 + n * bps:
+        values = np.concatenate([[0b00000010], samples & mask])
+        widths = np.concatenate([[8], np.full(n, bps)])
+        return values.astype(np.int64), widths.astype(np.int64)
+
+    _, order, u, k = best
+    # Each Rice code is the quotient in unary (zeros, then a one) followed by k low bits
+    rice_values = (1 << k) | (u & ((1 << k) - 1))
+    rice_widths = (u >> k) + 1 + k
+    values = np.concatenate([[0b00010000 | (order << 1)], samples[:order] & mask, [0, 0, k], rice_values])
+    widths = np.concatenate([[8], np.full(order, bps), [2, 4, 4], rice_widths])
+    return values.astype(np.int64), widths.astype(np.int64)
+
+class Resampler:
+    """
+    Streaming linear-interpolation resampler for int16 frames (samples x channels).
+    Keeps the last input frame and the fractional position between calls, so chunks join seamlessly.
+    """
+    def __init__(self, input_rate: int, output_rate: int):
+        self.step = input_rate / output_rate
+        self.position = 0.0  # Position of the next output frame, relative to `self.tail`
+        self.tail = None
+
+    def process(self, frames: np.ndarray):
+        if self.step == 1.0:
+            return frames
+        buffer = frames if self.tail is None else np.concatenate([self.tail, frames])
+        if len(buffer) < 2:
+            self.tail = buffer
+            return np.zeros((0, frames.shape[1]), dtype=np.int16)
+        positions = np.arange(self.position, len(buffer) - 1, self.step)
+        index = positions.astype(np.int64)
+        fraction = (positions - index)[:, None]
+        out = buffer[index] * (1 - fraction) + buffer[index + 1] * fraction
+        self.position = (positions[-1] + self.step if len(positions) else self.position) - (len(buffer) - 1)
+        self.tail = buffer[-1:]
+        return np.clip(np.rint(out), -32768, 32767).astype(np.int16)
+
+class PCMEncoder:
+    """
+    In-process encoder for raw PCM (s16le): up-mixes and resamples to 24 kHz stereo s16
+    and returns a streamable FLAC or WAV byte stream, without an ffmpeg process.
+    """
+    def __init__(self, input_rate: int, input_channels: int, output_format: str = "flac", block_size: int = BLOCK_SIZE):
+        if output_format not in ("flac", "wav"):
+            raise ValueError(f"Unsupported output format: {output_format}")
+        self.input_channels = input_channels
+        self.output_format = output_format
+        self.block_size = block_size
+        self.resampler = Resampler(input_rate, OUTPUT_RATE)
+        self.remainder = b""  # Bytes of an incomplete input frame
+        self.pending = np.zeros((0, OUTPUT_CHANNELS), dtype=np.int16)  # Samples waiting for a full FLAC block
+        self.frame_number = 0
+
+    def header(self):
+        """Returns the stream header. The length is unknown, as we are streaming."""
+        if self.output_format == "wav":
+            byte_rate = OUTPUT_RATE * OUTPUT_CHANNELS * 2
+            return (
+                b"RIFF" + struct.pack("<I", 0xFFFFFFFF) + b"WAVE"
+                + b"fmt " + struct.pack("<IHHIIHH", 16, 1, OUTPUT_CHANNELS, OUTPUT_RATE, byte_rate, OUTPUT_CHANNELS * 2, 16)
+                + b"data" + struct.pack("<I", 0xFFFFFFFF)
+            )
+        streaminfo = struct.pack(">HH", self.block_size, self.block_size) + b"\x00" * 6
+        # Sample rate (20 bits), channels - 1 (3 bits), bits per sample - 1 (5 bits), total samples (36 bits, 0 = unknown)
+        streaminfo += ((OUTPUT_RATE << 44) | ((OUTPUT_CHANNELS - 1) << 41) | (15 << 36)).to_bytes(8, "big")
+        streaminfo += b"\x00" * 16  # MD5 is unknown
+        return b"fLaC" + bytes([0x80]) + len(streaminfo).to_bytes(3, "big") + streaminfo
+
+    def _frames(self, pcm: bytes):
+        """Converts PCM bytes to 24 kHz stereo int16 frames."""
+        data = self.remainder + pcm
+        frame_bytes = 2 * self.input_channels
+        usable = len(data) - len(data) % frame_bytes
+        self.remainder = data[usable:]
+        frames = np.frombuffer(data[:usable], dtype="<i2").reshape(-1, self.input_channels)
+        if self.input_channels == 1:
+            frames = np.repeat(frames, OUTPUT_CHANNELS, axis=1)
+        elif self.input_channels > OUTPUT_CHANNELS:
+            frames = frames[:, :OUTPUT_CHANNELS]
+        return self.resampler.process(frames)
+
+    def _flac_frame(self, block: np.ndarray):
+        """Encodes one FLAC frame with left/side stereo."""
+        n = len(block)
+        if n in FLAC_BLOCK_SIZE_CODES:
+            size_code, size_bytes = FLAC_BLOCK_SIZE_CODES[n], b""
+        else:
+            size_code, size_bytes = 0b0111, struct.pack(">H", n - 1)
+        header = bytes([
+            0xFF, 0xF8,  # Sync code, fixed block size
+            (size_code << 4) | FLAC_SAMPLE_RATE_CODES[OUTPUT_RATE],
+            (FLAC_LEFT_SIDE << 4) | (FLAC_16_BITS << 1),
+        ]) + utf8_number(self.frame_number) + size_bytes
+        header += bytes([crc8(header)])
+        self.frame_number += 1
+
+        left = block[:, 0].astype(np.int64)
+        side = left - block[:, 1].astype(np.int64)
+        left_values, left_widths = subframe_fields(left, 16)
+        side_values, side_widths = subframe_fields(side, 17)
+        frame = header + pack_bits(np.concatenate([left_values, side_values]), np.concatenate([left_widths, side_widths]))
+        return frame + struct.pack(">H", crc16(frame))
+
+    def encode(self, pcm: bytes):
+        """Returns the encoded bytes for the complete blocks we have so far."""
+        frames = self._frames(pcm)
+        if self.output_format == "wav":
+            return frames.astype("<i2").tobytes()
+        self.pending = np.concatenate([self.pending, frames])
+        out = []
+        while len(self.pending) >= self.block_size:
+            out.append(self._flac_frame(self.pending[:self.block_size]))
+            self.pending = self.pending[self.block_size:]
+        return b"".join(out)
+
+    def flush(self):
+        """Returns the encoded bytes for whatever is left."""
+        if self.output_format == "wav" or len(self.pending) == 0:
+            return b""
+        frame = self._flac_frame(self.pending)
+        self.pending = self.pending[:0]
+        return frame
@@ -0,0 +1,183 @@
+import asyncio
+from contextlib import aclosing
+import json
+import os
+import time
+from typing import AsyncIterator
+
+import aiofiles
+
+class Renderer:
+    """
+    Renders announcements to audio files in the background, so they can be played later without any TTS or LLM calls.
+
+    At most `max_concurrent` jobs render at once, the others wait in line. Each job has a JSON file next to its audio
+    with its status ("queued", "rendering", "done" or "failed"), so every worker process can see and serve it.
+    Finished renders are evicted least recently played first when they take more than `disk_max_bytes`.
+    """
+    def __init__(self, render_cfg: dict, logger):
+        self.disk_path = render_cfg["disk_path"]
+        self.disk_max_bytes = render_cfg["disk_max_bytes"]
+        self.chunk_size = render_cfg["chunk_size"]
+        self.slots = asyncio.Semaphore(render_cfg["max_concurrent"])
+        self.logger = logger
+        self.tasks = set()
+        self.counters = {"submitted": 0, "done": 0, "failed": 0, "evicted": 0}
+
+        os.makedirs(self.disk_path, exist_ok=True)
+        # Jobs of a previous run that did not finish will never finish
+        for job in self._jobs():
+            if job["status"] in ("queued", "rendering"):
+                self._remove_files(job, keep_audio=True)
+                self._write_job({**job, "status": "failed", "error": "interrupted by a restart"})
+
+    def stats(self):
+        """Returns the job counters, the jobs on disk by status and the disk usage."""
+        jobs = list(self._jobs())
+        return {
+            **self.counters,
+            "jobs": {status: sum(job["status"] == status for job in jobs) for status in ("queued", "rendering", "done", "failed")},
+            "disk_bytes": sum(job.get("bytes", 0) for job in jobs if job["status"] == "done"),
+        }
+
+    def audio_path(self, job: dict):
+        return os.path.join(self.disk_path, f"{job['id']}.{job['format']}")
+
+    def _job_path(self, job_id: str):
+        return os.path.join(self.disk_path, f"{job_id}.json")
+
+    def _write_job(self, job: dict):
+        tmp_path = self._job_path(job["id"]) + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(job, f)
+        os.replace(tmp_path, self._job_path(job["id"]))
+
+    def _remove_files(self, job: dict, keep_audio: bool = False):
+        for path in ([] if keep_audio else [self.audio_path(job)]) + [self.audio_path(job) + ".part"]:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def _jobs(self):
+        """Yields every job on disk."""
+        for name in os.listdir(self.disk_path):
+            if name.endswith(".json"):
+                job = self.job(name[:-len(".json")])
+                if job:
+                    yield job
+
+    def job(self, job_id: str):
+        """Returns a job, or None if there is no such job."""
+        if not valid_job_id(job_id):
+            return None
+        try:
+            with open(self._job_path(job_id)) as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def touch(self, job: dict):
+        """Marks a render as played, so eviction is least-recently-played."""
+        try:
+            os.utime(self.audio_path(job))
+        except FileNotFoundError:
+            pass
+
+    def submit(self, job_id: str, source: AsyncIterator[bytes], kind: str, audio_format: str):
+        """
+        Starts a job that writes the audio of `source` to disk and returns it. `kind` ("text" or "prompt") is only informative.
+        Rendering again under the same id replaces the audio once the new one is done, the old one can be played until then.
+        """
+        previous = self.job(job_id)
+        if previous and previous["format"] != audio_format:
+            self._remove_files(previous)
+        job = {
+            "id": job_id,
+            "kind": kind,
+            "format": audio_format,
+            "status": "queued",
+            "created_at": time.time(),
+        }
+        self._write_job(job)
+        self.counters["submitted"] += 1
+        task = asyncio.create_task(self._render(job, source))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return job
+
+    async def _render(self, job: dict, source: AsyncIterator[bytes]):
+        async with self.slots:
+            start = time.monotonic()
+            self._write_job({**job, "status": "rendering"})
+            part_path = self.audio_path(job) + ".part"
+            size = 0
+            try:
+                async with aclosing(source), aiofiles.open(part_path, "wb") as f:
+                    async for chunk in source:
+                        await f.write(chunk)
+                        size += len(chunk)
+                if not size:
+                    raise RuntimeError("no audio")
+                os.replace(part_path, self.audio_path(job))
+            except asyncio.CancelledError:
+                self._remove_files(job, keep_audio=True)
+                self._write_job({**job, "status": "failed", "error": "cancelled"})
+                raise
+            except Exception as e:
+                self.logger.error(f"RENDER {job['id']} FAILED: {e}")
+                self._remove_files(job, keep_audio=True)
+                self._write_job({**job, "status": "failed", "error": str(e)})
+                self.counters["failed"] += 1
+                return
+
+            seconds = time.monotonic() - start
+            self._write_job({**job, "status": "done", "bytes": size, "render_seconds": round(seconds, 2), "finished_at": time.time()})
+            self.counters["done"] += 1
+            self.logger.info(f"RENDER {job['id']} DONE in {seconds:.2f}s: {size} bytes of {job['format']}")
+            await asyncio.to_thread(self._evict)
+
+    def _evict(self):
+        """Removes the least recently played renders until they fit in `disk_max_bytes`."""
+        renders = []
+        for job in self._jobs():
+            if job["status"] == "done":
+                try:
+                    renders.append((os.stat(self.audio_path(job)).st_mtime, job))
+                except FileNotFoundError:
+                    pass
+        used = sum(job["bytes"] for _, job in renders)
+        for _, job in sorted(renders, key=lambda render: render[0]):
+            if used <= self.disk_max_bytes:
+                break
+            self._remove_files(job)
+            os.remove(self._job_path(job["id"]))
+            used -= job["bytes"]
+            self.counters["evicted"] += 1
+            self.logger.info(f"RENDER {job['id']} EVICTED")
+
+    def close(self):
+        """Cancels the running jobs."""
+        for task in self.tasks:
+            task.cancel()
+
+def valid_job_id(job_id: str):
+    """Job ids are used as file names, so only letters, digits, "-" and "_" are allowed."""
+    return bool(job_id) and len(job_id) <= 64 and job_id.replace("-", "").replace("_", "").isalnum() and job_id.isascii()
+
+# The shared renderer, see `start_renderer`
+renderer = None
+
+def start_renderer(cfg: dict, logger):
+    """
+    Creates the shared renderer.
+    """
+    global renderer
+    renderer = Renderer(cfg["render"], logger)
+    return renderer
+
+def renderer_get():
+    """
+    Returns the shared renderer
+    """
+    return renderer
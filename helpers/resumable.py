@@ -0,0 +1,185 @@
+import asyncio
+from collections import deque
+from contextlib import aclosing
+from typing import AsyncIterator
+import uuid
+
+# Output formats that start with a header a new decoder needs: it is sent again when a device resumes without an offset
+HEADER_FORMATS = ("flac", "wav", "opus")
+
+class ResumableStream:
+    """
+    Runs the audio stream of a /play request in the background and keeps its last `max_bytes` in a ring buffer,
+    so a device whose connection drops can open /play again and continue where it left off,
+    without running the LLM and TTS again.
+
+    The source runs at most half the buffer ahead of what was sent. The other half keeps audio that was already sent,
+    because the bytes in flight when the connection dropped never reached the device.
+    When the connection drops before the end, the source keeps running up to that lead, so a device that comes back
+    reattaches to a stream that is still producing. Without a listener, or once the source is done,
+    the stream is stopped and dropped after `grace_seconds`.
+    """
+    def __init__(self, client_id: str, audio_format: str, source: AsyncIterator[bytes], max_bytes: int, grace_seconds: float, logger):
+        self.id = uuid.uuid4().hex[:12]
+        self.client_id = client_id
+        self.audio_format = audio_format
+        self.max_bytes = max_bytes
+        self.grace_seconds = grace_seconds
+        self.logger = logger
+        self.chunks = deque()  # (offset, chunk)
+        self.header = None
+        self.base = 0  # Offset of the first buffered byte
+        self.total = 0  # Bytes produced so far
+        self.position = 0  # Bytes handed to the last listener
+        self.done = False
+        self.listener = 0  # Number of the current listener, 0 without one
+        self.listeners = 0
+        self.changed = asyncio.Condition()
+        self.expiry = None
+        self.task = asyncio.create_task(self._run(source))
+
+    async def _run(self, source: AsyncIterator[bytes]):
+        """Pulls the source into the ring buffer."""
+        try:
+            async with aclosing(source):
+                async for chunk in source:
+                    if not chunk:
+                        continue
+                    async with self.changed:
+                        await self.changed.wait_for(lambda: self.total - self.position < self.max_bytes // 2)
+                        if self.header is None and self.audio_format in HEADER_FORMATS:
+                            self.header = chunk
+                        self.chunks.append((self.total, chunk))
+                        self.total += len(chunk)
+                        while self.total - self.base > self.max_bytes and len(self.chunks) > 1:
+                            _, dropped = self.chunks.popleft()
+                            self.base += len(dropped)
+                        self.changed.notify_all()
+        except Exception as e:
+            self.logger.error(f"Resumable stream error: {e}")
+        finally:
+            self.done = True
+            async with self.changed:
+                self.changed.notify_all()
+            if not self.listener:
+                self._schedule_expiry()
+
+    def _schedule_expiry(self):
+        if self.expiry:
+            self.expiry.cancel()
+        self.expiry = asyncio.get_running_loop().call_later(self.grace_seconds, self.cancel)
+
+    def cancel(self):
+        """Stops the source and drops the buffer."""
+        if self.expiry:
+            self.expiry.cancel()
+        self.task.cancel()
+        self.chunks.clear()
+        if resumable_streams.get(self.client_id) is self:
+            del resumable_streams[self.client_id]
+
+    def start_offset(self, offset: int = None):
+        """
+        Returns where a listener starts: at `offset` if given, which must still be buffered (raises ValueError otherwise),
+        or else at the start of the chunk the last listener stopped in.
+        """
+        if offset is not None:
+            if not self.base <= offset <= self.total:
+                raise ValueError(f"Offset {offset} is not buffered anymore, bytes {self.base}-{self.total} are")
+            return offset
+        for chunk_offset, chunk in self.chunks:
+            if chunk_offset + len(chunk) > self.position:
+                return chunk_offset
+        return self.total if self.chunks else self.base
+
+    async def listen(self, offset: int = None):
+        """
+        Yields the audio from `start_offset(offset)` on, then the rest as it is produced.
+        Without an offset, a device that starts over gets the header of the format first.
+        A new listener takes over from the previous one, whose connection is most likely dead.
+        """
+        start = self.start_offset(offset)
+        self.listeners += 1
+        listener = self.listener = self.listeners
+        if self.expiry:
+            self.expiry.cancel()
+        cursor = start
+        try:
+            # Wake up the previous listener, so it lets go
+            async with self.changed:
+                self.changed.notify_all()
+            if offset is None and start > 0 and self.header:
+                yield self.header
+            while True:
+                async with self.changed:
+                    await self.changed.wait_for(lambda: self.total > cursor or self.done or self.listener != listener)
+                    if self.listener != listener or self.total <= cursor:
+                        break
+                    if cursor < self.base:
+                        raise RuntimeError("The listener fell behind the buffer")
+                    pending = [chunk[max(cursor - chunk_offset, 0):] for chunk_offset, chunk in self.chunks if chunk_offset + len(chunk) > cursor]
+                if not pending:
+                    break  # Dropped
+                for chunk in pending:
+                    yield chunk
+                    cursor += len(chunk)
+                    if self.listener == listener:
+                        self.position = cursor
+                async with self.changed:
+                    self.changed.notify_all()
+        finally:
+            if self.listener == listener:
+                self.listener = 0
+                # Nobody listens anymore: the source keeps filling the buffer for a while, then it is stopped
+                self._schedule_expiry()
+
+    def stats(self):
+        return {
+            "id": self.id,
+            "format": self.audio_format,
+            "buffered_from": self.base,
+            "produced": self.total,
+            "sent": self.position,
+            "done": self.done,
+            "listening": bool(self.listener),
+            "listeners": self.listeners,
+        }
+
+# The last /play stream of each client, by client_id
+resumable_streams = {}
+
+def start_resumable_stream(client_id: str, audio_format: str, source: AsyncIterator[bytes], resumable_cfg: dict, logger):
+    """
+    Runs the /play stream of a client in the background so it can be resumed. The previous one of the client is dropped.
+    """
+    previous = resumable_streams.get(client_id)
+    if previous:
+        previous.cancel()
+    resumable_streams[client_id] = ResumableStream(client_id, audio_format, source, resumable_cfg["max_bytes"], resumable_cfg["grace_seconds"], logger)
+    return resumable_streams[client_id]
+
+def find_resumable_stream(client_id: str, audio_format: str, stream_id: str = None, offset: int = None):
+    """
+    Returns the stream of a client to resume in the given format (and with the given id) from `offset`, or None.
+    A stream that has nothing left after the offset (or after what was sent) is not resumed:
+    the device has it all, so it is asking for something new.
+    """
+    stream = resumable_streams.get(client_id)
+    if not stream or stream.audio_format != audio_format or (stream_id and stream.id != stream_id):
+        return None
+    if stream.done and (offset if offset is not None else stream.position) >= stream.total:
+        return None
+    return stream
+
+def cancel_resumable_streams():
+    """
+    Stops and drops all resumable streams.
+    """
+    for stream in list(resumable_streams.values()):
+        stream.cancel()
+
+def resumable_stream_stats():
+    """
+    Returns the buffer positions of the resumable stream of each client.
+    """
+    return {client_id: stream.stats() for client_id, stream in resumable_streams.items()}
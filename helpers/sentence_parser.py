@@ -1,7 +1,22 @@
-import icu
-import regex
+import functools
 
-pattern = regex.compile(r'\b(\p{Lu}\w{0,3})\.(?!\w*\.)', regex.UNICODE)
+from helpers.pacing import group_units
+
+@functools.cache
+def patterns():
+    """
+    Compiles the patterns on first use, so importing this module does not load `regex` (see `warm_up` in main.py).
+    """
+    import regex
+    return {
+        "abbreviation": regex.compile(r'\b(\p{Lu}\w{0,3})\.(?!\w*\.)', regex.UNICODE),
+        "clause": regex.compile(r'[,;:\u2013\u2014](?=\s)'),
+        # Characters after which a sentence or a clause can end. No need to run ICU until we see one of them.
+        "boundary_candidate": regex.compile(r'[.!?\u2026\u3002\uff01\uff1f\n\r\u2029,;:\u2013\u2014]'),
+    }
+
+# ICU BreakIterators are expensive to create, so we keep one per locale
+break_iterators = {}
 
 async def chunk_text(text: str, chunk_size=128):
     """
@@ -40,7 +55,7 @@ def pre_process_text(text: str):
     The negative lookahead (?!\w*\.) ensures that we don't match if the
     token is part of a multi-dot abbreviation (e.g., U.S.A.).
     """
-    return pattern.sub(lambda m: m.group(1) + "<DOT>", text)
+    return patterns()["abbreviation"].sub(lambda m: m.group(1) + "<DOT>", text)
 
 def post_process_text(text: str):
     """
@@ -48,29 +63,43 @@ def post_process_text(text: str):
     """
     return text.replace("<DOT>", ".")
 
-def split_sentences(text: str, locale_str="en_US"):
+def get_break_iterator(locale_str="en_US"):
     """
-    Splits text into sentences using ICU's BreakIterator.
+    Returns a cached ICU sentence BreakIterator for the given locale.
     """
-    bi = icu.BreakIterator.createSentenceInstance(icu.Locale(locale_str))
+    if locale_str not in break_iterators:
+        import icu
+        break_iterators[locale_str] = icu.BreakIterator.createSentenceInstance(icu.Locale(locale_str))
+    return break_iterators[locale_str]
+
+def sentence_boundaries(text: str, locale_str="en_US"):
+    """
+    Returns the end positions of the sentences in text, as found by ICU's BreakIterator.
+    """
+    bi = get_break_iterator(locale_str)
     bi.setText(text)
+    bi.first()
+    return list(bi)
 
+def split_sentences(text: str, locale_str="en_US"):
+    """
+    Splits text into sentences using ICU's BreakIterator.
+    """
     sentences = []
-    start = bi.first()
-
-    for end in bi:
+    start = 0
+    for end in sentence_boundaries(text, locale_str):
         sentence = text[start:end].strip()
         if sentence:
             sentences.append(sentence)
         start = end
     return sentences
 
-def process_buffer(buf):
+def process_buffer(buf, locale_str="en_US"):
       """
       Processes the given text buffer and returns a tuple:
         (list_of_complete_sentences, remaining_buffer)
       """
-      possible_sentences = split_sentences(buf)
+      possible_sentences = split_sentences(buf, locale_str)
       if not possible_sentences:
           return [], buf
 
@@ -83,53 +112,153 @@ def process_buffer(buf):
           sentences = [post_process_text(sentence.strip()) for sentence in possible_sentences[:-1]]
           new_buf = possible_sentences[-1] if possible_sentences else ""
       return sentences, new_buf
-        
-async def stream_sentence_generator(chunks, target_size=128, min_length=15):
+
+class SentenceSegmenter:
+    """
+    Incremental sentence segmenter for streamed text.
+
+    Keeps only the raw text after the last confirmed sentence boundary and re-scans it with ICU
+    only when the new text contains a character a sentence (or a clause) could end at.
+    So the cost per token does not grow with the length of the response.
+    """
+    def __init__(self, locale_str="en_US"):
+        self.locale_str = locale_str
+        self.pending = ""  # Raw text after the last confirmed boundary
+        self.scanned = 0  # Position in `pending` we have already looked at
+
+    def push(self, text: str):
+        """Appends streamed text."""
+        self.pending += text
+
+    def has_candidates(self):
+        """
+        Checks if there is new text since the last scan that could contain a boundary.
+        The last non-space character we have scanned is checked again, because ICU needs to see
+        what follows a period to decide if it ends the sentence.
+        """
+        return patterns()["boundary_candidate"].search(self.pending, max(self.scanned - 1, 0)) is not None
+
+    def mark_scanned(self):
+        """Remembers that we have looked at all pending text."""
+        self.scanned = len(self.pending.rstrip())
+
+    def consume(self, end: int, text: str):
+        """Drops `text[:end]` (pre-processed) from the pending text."""
+        self.pending = post_process_text(text[end:])
+        self.mark_scanned()
+
+    def sentences(self, final=False):
+        """
+        Returns the complete sentences from the pending text and keeps the last one if it might be incomplete.
+        With `final`, returns everything that is left.
+        """
+        if not final and not self.has_candidates():
+            self.mark_scanned()
+            return []
+
+        # Pre-process the text (workaround for titles, initials, etc.)
+        text = pre_process_text(self.pending)
+        ends = sentence_boundaries(text, self.locale_str)
+        if not final and not (text and text[-1] in {'.', '?', '!'}):
+            # The last sentence might be incomplete, keep it.
+            ends = ends[:-1]
+
+        sentences = []
+        start = 0
+        for end in ends:
+            sentence = text[start:end].strip()
+            if sentence:
+                sentences.append(post_process_text(sentence))
+            start = end
+        self.consume(start, text)
+        return sentences
+
+    def first_unit(self, first_min_length=20):
+        """
+        Returns the first unit of speech that can be sent to TTS right away, or None if there is none yet.
+
+        The unit is either the first sentence, once we see text after it (so we know it has really ended),
+        or the text up to a clause boundary (",", ";", ":" or a dash) that is at least `first_min_length` characters long.
+        """
+        if not self.has_candidates():
+            self.mark_scanned()
+            return None
+
+        text = pre_process_text(self.pending)
+        ends = sentence_boundaries(text, self.locale_str)
+        if len(ends) > 1 and text[:ends[0]].strip() and text[ends[0]:].strip():
+            unit = text[:ends[0]].strip()
+            self.consume(ends[0], text)
+            return post_process_text(unit)
+
+        match = patterns()["clause"].search(text, max(first_min_length - 1, 0))
+        if match:
+            self.consume(match.end(), text)
+            return post_process_text(text[:match.end()].strip())
+
+        self.mark_scanned()
+        return None
+
+async def stream_sentence_generator(chunks, target_size=128, min_length=15, adaptive=False, first_min_length=20, unit_growth=2.0, locale="en_US", pacing=None):
     """
     Accumulates chunks until at least 'target_size' bytes of characters 
     have been buffered, then generates sentences from them
     with at least `min_length` bytes of characters.
+
+    In adaptive mode the first unit is yielded as soon as it is known (see `SentenceSegmenter.first_unit`),
+    so TTS can start speaking right away. Later units are generated from batches that start small
+    and grow by `unit_growth` until they reach 'target_size'.
+
+    With a `pacing` (see helpers/pacing.py), once the audio of the stream is far enough ahead of playback,
+    batches grow to `pacing.unit_chars()` and their sentences are grouped into units of up to that size,
+    so there are fewer TTS requests.
     """
-    buffer = "" # Our main buffer
-    chunk_buffer = []  # Temporary buffer to collect chunks until we hit the target_size 
+    segmenter = SentenceSegmenter(locale)
     current_size = 0  # Running total of the length of buffered chunks
+    units = 0  # Number of units yielded so far
+
+    def batch_size():
+        """Returns the number of bytes to accumulate before generating the next units."""
+        if not adaptive or units == 0:
+            size = target_size
+        else:
+            size = min(target_size, int(first_min_length * unit_growth ** units))
+        return max(size, pacing.unit_chars()) if pacing else size
+
+    def paced(sentences):
+        """Groups the sentences into units as the pacing says and counts them."""
+        if pacing:
+            unit_chars = pacing.unit_chars()
+            if unit_chars:
+                sentences = group_units(sentences, unit_chars)
+            for sentence in sentences:
+                pacing.unit(len(sentence))
+        return sentences
 
     # Loop over each incoming chunk of text.
     async for chunk in chunks:
-        chunk_buffer.append(chunk)
+        segmenter.push(chunk)
         current_size += len(chunk.encode('utf-8'))
 
-        # Once we've accumulated at least target_size bytes of characters, process the buffered text.
-        if current_size >= target_size:
-            combined_text = ''.join(chunk_buffer)
-            chunk_buffer.clear() 
-            current_size = 0
-
-            # Pre-process the combined text (workaround for titles, initials, etc.)
-            preprocessed_chunk = pre_process_text(combined_text)
-            buffer += preprocessed_chunk
+        # Fast path: yield the first unit as soon as we have it.
+        if adaptive and units == 0:
+            unit = segmenter.first_unit(first_min_length)
+            if unit:
+                current_size = 0
+                units += 1
+                if pacing:
+                    pacing.unit(len(unit))
+                yield unit
+                continue
 
-            # Process the main buffer to split it into complete sentences,
-            # and update the buffer with any leftover incomplete sentence.
-            sentences, buffer = process_buffer(buffer)
+        # Once we've accumulated enough bytes of characters, split the pending text into complete sentences.
+        if current_size >= batch_size():
+            current_size = 0
             # Merge adjacent sentences if one of them is shorter than min_length.
-            sentences = merge_adjacent_sentences(sentences, min_length)
-            for sentence in sentences:
+            for sentence in paced(merge_adjacent_sentences(segmenter.sentences(), min_length)):
+                units += 1
                 yield sentence
 
-    # After processing all full buffers, check if there are any leftover chunks.
-    if chunk_buffer:
-        combined_text = ''.join(chunk_buffer)
-        preprocessed_chunk = pre_process_text(combined_text)
-        buffer += preprocessed_chunk
-        chunk_buffer.clear()
-        sentences, buffer = process_buffer(buffer)
-        # Yield each complete sentence obtained from the leftover text.
-        for sentence in sentences:
-            yield sentence
-
-    # Finally, if any text remains in the main buffer (an incomplete sentence, perhaps),
-    # post-process and yield it as the final sentence.
-    if buffer:
-        yield post_process_text(buffer.strip())
-
+    # Finally, yield whatever is left (an incomplete sentence, perhaps).
+    for sentence in paced(segmenter.sentences(final=True)):
+        yield sentence
@@ -0,0 +1,373 @@
+from abc import ABC, abstractmethod
+import asyncio
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+import json
+import os
+import sqlite3
+import time
+from typing import Any, Callable
+
+def estimate_tokens(message: dict):
+    """
+    Roughly estimates the tokens of a chat message: ~4 characters per token, plus a few for the message itself.
+    """
+    return len(json.dumps(message, ensure_ascii=False)) // 4 + 4
+
+def unresolved_tool_call_ids(messages: list):
+    """
+    Returns the ids of tool calls that don't have a tool result (yet).
+    """
+    ids = set()
+    for message in messages:
+        for tool_call in message.get("tool_calls") or []:
+            ids.add(tool_call.get("id"))
+        if message.get("role") == "tool":
+            ids.discard(message.get("tool_call_id"))
+    return ids
+
+def compact_history(messages: list, max_turns: int = None, max_tokens: int = None):
+    """
+    Drops the oldest turns of a chat history until it fits the budget, in place.
+
+    A turn starts with a user message and holds everything up to the next one, so tool calls
+    always stay together with their results. The leading system prompt, the current (last) turn
+    and turns with tool calls that are still waiting for a result are always kept.
+    Returns the number of messages dropped.
+    """
+    start = 0
+    while start < len(messages) and messages[start].get("role") == "system":
+        start += 1
+
+    turns = []
+    for i in range(start, len(messages)):
+        if messages[i].get("role") == "user" or not turns:
+            turns.append([])
+        turns[-1].append(messages[i])
+
+    unresolved = unresolved_tool_call_ids(messages)
+    tokens = sum(estimate_tokens(message) for message in messages)
+    keep = []
+    dropped = 0
+    for i, turn in enumerate(turns):
+        over_turns = max_turns and len(turns) - i > max_turns
+        over_tokens = max_tokens and tokens > max_tokens
+        pending = any(tool_call.get("id") in unresolved for message in turn for tool_call in message.get("tool_calls") or [])
+        if i < len(turns) - 1 and (over_turns or over_tokens) and not pending:
+            tokens -= sum(estimate_tokens(message) for message in turn)
+            dropped += len(turn)
+        else:
+            keep.extend(turn)
+
+    if dropped:
+        messages[start:] = keep
+    return dropped
+
+class SessionStore(ABC):
+    """
+    Per-client session storage and signaling between requests.
+
+    `get` returns the session of a client, changes are only kept once it is `put` back.
+    `update` reads, changes and stores a session in one step, so changes made meanwhile by other requests
+    (or worker processes) are not overwritten. Use it for sessions that more than one request may change at a time.
+    `signal` sets a named flag for a client and `wait` waits until the flag is set and clears it.
+    /preload, /play and /write_history use signals to hand over tool calls, so with a shared backend
+    they can be served by different worker processes.
+    """
+    @abstractmethod
+    async def get(self, client_id: str) -> dict:
+        """Returns the session of a client, or an empty one."""
+
+    @abstractmethod
+    async def put(self, client_id: str, session: dict) -> dict:
+        """Stores the session of a client."""
+
+    @abstractmethod
+    async def update(self, client_id: str, change: Callable[[dict], Any]):
+        """
+        Calls `change` on the session of a client (or an empty one), which edits it in place, and stores it atomically.
+        Returns what `change` returns. `change` must not block, and may be called again if the store retries.
+        """
+
+    @abstractmethod
+    async def signal(self, client_id: str, name: str):
+        """Sets a signal for a client."""
+
+    @abstractmethod
+    async def wait(self, client_id: str, name: str):
+        """Waits until a signal is set for a client and clears it."""
+
+    @abstractmethod
+    async def stats(self) -> dict:
+        """Returns the store counters and size."""
+
+    def close(self):
+        """Releases the resources of the store."""
+
+class MemorySessionStore(SessionStore):
+    """
+    In-process session store with a cap on the number of sessions and idle expiry. Signals are asyncio Events.
+
+    Sessions are kept in least-recently-used order. Every access touches a session, sessions that
+    have been idle for more than `idle_ttl_seconds` are dropped, and the least recently used ones
+    are dropped when there are more than `max_sessions`. A client that a request is waiting for a signal of
+    is not idle, its session and signals are kept.
+    """
+    def __init__(self, max_sessions: int, idle_ttl_seconds: float):
+        self.max_sessions = max_sessions
+        self.idle_ttl_seconds = idle_ttl_seconds
+        self.sessions = OrderedDict()  # client_id -> (session, last access)
+        self.events = {}  # client_id -> {signal name -> Event}
+        self.waiting = {}  # client_id -> number of requests waiting for one of its signals
+        self.counters = {"created": 0, "expired": 0, "evicted": 0}
+
+    async def stats(self):
+        """Returns the store counters and size."""
+        return {**self.counters, "sessions": len(self.sessions)}
+
+    def _evict(self, now: float):
+        for client_id, (_, last_access) in list(self.sessions.items()):
+            expired = self.idle_ttl_seconds and now - last_access > self.idle_ttl_seconds
+            if not expired and len(self.sessions) <= self.max_sessions:
+                break
+            if client_id in self.waiting:
+                continue
+            self.counters["expired" if expired else "evicted"] += 1
+            del self.sessions[client_id]
+            self.events.pop(client_id, None)
+
+    async def get(self, client_id: str):
+        """Returns the session of a client, or an empty one."""
+        now = time.monotonic()
+        self._evict(now)
+        if client_id not in self.sessions:
+            return {}
+        session, _ = self.sessions.pop(client_id)
+        self.sessions[client_id] = (session, now)
+        return session
+
+    async def put(self, client_id: str, session: dict):
+        """Stores the session of a client."""
+        now = time.monotonic()
+        if client_id in self.sessions:
+            del self.sessions[client_id]
+        else:
+            self.counters["created"] += 1
+        self.sessions[client_id] = (session, now)
+        self._evict(now)
+        return session
+
+    async def update(self, client_id: str, change: Callable[[dict], Any]):
+        """Changes the session of a client. Nothing else runs in between, as `get` and `put` never suspend."""
+        session = await self.get(client_id)
+        result = change(session)
+        await self.put(client_id, session)
+        return result
+
+    def _event(self, client_id: str, name: str):
+        return self.events.setdefault(client_id, {}).setdefault(name, asyncio.Event())
+
+    async def signal(self, client_id: str, name: str):
+        """Sets a signal for a client."""
+        self._event(client_id, name).set()
+
+    async def wait(self, client_id: str, name: str):
+        """Waits until a signal is set for a client and clears it."""
+        event = self._event(client_id, name)
+        self.waiting[client_id] = self.waiting.get(client_id, 0) + 1
+        try:
+            await event.wait()
+        finally:
+            self.waiting[client_id] -= 1
+            if not self.waiting[client_id]:
+                del self.waiting[client_id]
+        event.clear()
+
+# How long a statement waits for the lock of another process in the database thread, before it is retried from the event loop
+BUSY_TIMEOUT_SECONDS = 0.05
+# How long a call keeps retrying while the database is locked
+LOCK_TIMEOUT_SECONDS = 5.0
+
+class SQLiteSessionStore(SessionStore):
+    """
+    Session store in an SQLite database (WAL mode), shared by all worker processes on this machine.
+
+    Sessions are stored as JSON. Signals are rows in a table: `signal` inserts one and a waiter takes it by deleting it,
+    so exactly one waiter consumes each signal, whichever process it runs in.
+    Idle and least recently used sessions are removed like in `MemorySessionStore`, based on the wall clock.
+
+    All database calls run in a thread of their own, so they never block the event loop. A statement waits at most
+    `BUSY_TIMEOUT_SECONDS` for a lock held by another process, then it is retried with a backoff from the event loop.
+    The waiters of this process share one poller, which takes all their signals with one query per `poll_interval`.
+    """
+    def __init__(self, path: str, max_sessions: int, idle_ttl_seconds: float, poll_interval: float):
+        self.max_sessions = max_sessions
+        self.idle_ttl_seconds = idle_ttl_seconds
+        self.poll_interval = poll_interval
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        # SQLite connections belong to the thread that created them
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="session-store")
+        self.db = self.executor.submit(self._connect, path).result()
+        self.counters = {"created": 0, "expired": 0, "evicted": 0}
+        self.waiters = {}  # (client_id, signal name) -> futures of the waiters of this process, oldest first
+        self.poller = None
+        self.wake = asyncio.Event()  # Polls right away, for a signal set by this process
+
+    def _connect(self, path: str):
+        # Autocommit mode, every statement is its own short transaction
+        db = sqlite3.connect(path, timeout=BUSY_TIMEOUT_SECONDS, isolation_level=None)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        db.execute("CREATE TABLE IF NOT EXISTS sessions (client_id TEXT PRIMARY KEY, data TEXT NOT NULL, last_access REAL NOT NULL)")
+        db.execute("CREATE INDEX IF NOT EXISTS sessions_last_access ON sessions (last_access)")
+        db.execute("CREATE TABLE IF NOT EXISTS signals (client_id TEXT NOT NULL, name TEXT NOT NULL, PRIMARY KEY (client_id, name))")
+        return db
+
+    async def _run(self, function, *args):
+        """Runs a database call in the database thread, retrying while another process holds the lock."""
+        loop = asyncio.get_running_loop()
+        deadline = time.monotonic() + LOCK_TIMEOUT_SECONDS
+        delay = 0.01
+        while True:
+            try:
+                return await loop.run_in_executor(self.executor, function, *args)
+            except sqlite3.OperationalError as e:
+                if "locked" not in str(e) or time.monotonic() + delay > deadline:
+                    raise
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 0.2)
+
+    def _stats(self):
+        sessions, = self.db.execute("SELECT COUNT(*) FROM sessions").fetchone()
+        return {**self.counters, "sessions": sessions}
+
+    async def stats(self):
+        """Returns this worker's counters and the number of sessions in the database."""
+        return await self._run(self._stats)
+
+    def _evict(self, now: float):
+        if self.idle_ttl_seconds:
+            expired = self.db.execute("DELETE FROM sessions WHERE last_access < ?", (now - self.idle_ttl_seconds,)).rowcount
+            self.counters["expired"] += expired
+        evicted = self.db.execute(
+            "DELETE FROM sessions WHERE client_id NOT IN (SELECT client_id FROM sessions ORDER BY last_access DESC LIMIT ?)",
+            (self.max_sessions,),
+        ).rowcount
+        self.counters["evicted"] += evicted
+        self.db.execute("DELETE FROM signals WHERE client_id NOT IN (SELECT client_id FROM sessions)")
+
+    def _get(self, client_id: str):
+        now = time.time()
+        row = self.db.execute(
+            "UPDATE sessions SET last_access = ? WHERE client_id = ? AND last_access >= ? RETURNING data",
+            (now, client_id, now - self.idle_ttl_seconds if self.idle_ttl_seconds else 0),
+        ).fetchone()
+        return json.loads(row[0]) if row else {}
+
+    async def get(self, client_id: str):
+        """Returns a copy of the session of a client, or an empty one."""
+        return await self._run(self._get, client_id)
+
+    def _put(self, client_id: str, data: str):
+        now = time.time()
+        created = self.db.execute(
+            "INSERT INTO sessions (client_id, data, last_access) VALUES (?, ?, ?) ON CONFLICT (client_id) DO NOTHING",
+            (client_id, data, now),
+        ).rowcount
+        if created:
+            self.counters["created"] += 1
+            self._evict(now)
+        else:
+            self.db.execute("UPDATE sessions SET data = ?, last_access = ? WHERE client_id = ?", (data, now, client_id))
+
+    async def put(self, client_id: str, session: dict):
+        """Stores the session of a client."""
+        await self._run(self._put, client_id, json.dumps(session))
+        return session
+
+    def _update(self, client_id: str, change: Callable[[dict], Any]):
+        # A write transaction from the start, so no other process changes the session between the read and the write
+        self.db.execute("BEGIN IMMEDIATE")
+        try:
+            session = self._get(client_id)
+            result = change(session)
+            self._put(client_id, json.dumps(session))
+            self.db.execute("COMMIT")
+        except BaseException:
+            self.db.execute("ROLLBACK")
+            raise
+        return result
+
+    async def update(self, client_id: str, change: Callable[[dict], Any]):
+        """Changes the session of a client in one transaction."""
+        return await self._run(self._update, client_id, change)
+
+    def _signal(self, client_id: str, name: str):
+        self.db.execute("INSERT OR IGNORE INTO signals (client_id, name) VALUES (?, ?)", (client_id, name))
+
+    async def signal(self, client_id: str, name: str):
+        """Sets a signal for a client."""
+        await self._run(self._signal, client_id, name)
+        if self.waiters.get((client_id, name)):
+            self.wake.set()
+
+    def _take_signals(self, keys: list):
+        placeholders = ", ".join("(?, ?)" for _ in keys)
+        rows = self.db.execute(
+            f"DELETE FROM signals WHERE (client_id, name) IN (VALUES {placeholders}) RETURNING client_id, name",
+            [value for key in keys for value in key],
+        ).fetchall()
+        return [tuple(row) for row in rows]
+
+    async def _poll(self):
+        """Takes the signals the waiters of this process wait for and hands each to the oldest of its waiters, until none are left."""
+        while True:
+            for key in [key for key, futures in self.waiters.items() if not any(not future.done() for future in futures)]:
+                del self.waiters[key]
+            if not self.waiters:
+                return
+            self.wake.clear()
+            for key in await self._run(self._take_signals, list(self.waiters)):
+                futures = self.waiters.get(key, deque())
+                while futures and futures[0].done():
+                    futures.popleft()
+                if futures:
+                    futures.popleft().set_result(None)
+                else:
+                    await self._run(self._signal, *key)  # The waiter gave up meanwhile, put the signal back
+            try:
+                await asyncio.wait_for(self.wake.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def wait(self, client_id: str, name: str):
+        """Waits until a signal is set for a client (by any process) and clears it."""
+        future = asyncio.get_running_loop().create_future()
+        self.waiters.setdefault((client_id, name), deque()).append(future)
+        if not self.poller or self.poller.done():
+            self.poller = asyncio.create_task(self._poll())
+        else:
+            self.wake.set()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                await self.signal(client_id, name)  # We were given the signal just as we were cancelled, put it back
+            raise
+
+    def close(self):
+        if self.poller:
+            self.poller.cancel()
+        self.executor.submit(self.db.close).result()
+        self.executor.shutdown()
+
+def create_session_store(store_cfg: dict):
+    """
+    Creates the session store configured in the "session_store" section.
+    """
+    if store_cfg["backend"] == "sqlite":
+        return SQLiteSessionStore(store_cfg["sqlite_path"], store_cfg["max_sessions"], store_cfg["idle_ttl_seconds"], store_cfg["signal_poll_interval"])
+    if store_cfg["backend"] == "memory":
+        return MemorySessionStore(store_cfg["max_sessions"], store_cfg["idle_ttl_seconds"])
+    raise ValueError(f"Unknown session store backend: {store_cfg['backend']}")
@@ -0,0 +1,113 @@
+import asyncio
+from collections import deque
+from contextlib import aclosing
+import time
+from typing import AsyncIterator
+
+from helpers.tracing import current_trace
+
+class SpeculativeStream:
+    """
+    Runs an audio source in the background before anybody listens and buffers its output until a listener attaches.
+
+    The buffer holds at most `max_bytes`: when it is full, the source is paused until the listener catches up.
+    If nobody attaches within `expiry_seconds`, the source is cancelled and the buffer is dropped.
+    The trace of the request that started it (if any) is kept for the listener.
+    """
+    def __init__(self, client_id: str, source: AsyncIterator[bytes], max_bytes: int, expiry_seconds: float, logger):
+        self.client_id = client_id
+        self.trace = current_trace.get()
+        self.max_bytes = max_bytes
+        self.logger = logger
+        self.chunks = deque()
+        self.buffered = 0
+        self.done = False
+        self.attached = False
+        self.started_at = time.monotonic()
+        self.changed = asyncio.Condition()
+        self.task = asyncio.create_task(self._run(source))
+        self.expiry = asyncio.get_running_loop().call_later(expiry_seconds, self._expire)
+
+    async def _run(self, source: AsyncIterator[bytes]):
+        """Pulls the source into the buffer."""
+        try:
+            async with aclosing(source):
+                async for chunk in source:
+                    async with self.changed:
+                        await self.changed.wait_for(lambda: self.buffered < self.max_bytes)
+                        self.chunks.append(chunk)
+                        self.buffered += len(chunk)
+                        self.changed.notify_all()
+        except Exception as e:
+            self.logger.error(f"Speculative stream error: {e}")
+        finally:
+            self.done = True
+            async with self.changed:
+                self.changed.notify_all()
+
+    def _expire(self):
+        if not self.attached:
+            self.logger.info(f"SPECULATIVE STREAM FOR {self.client_id} EXPIRED, nobody played it")
+            self.cancel()
+
+    def cancel(self):
+        """Stops the source and drops the buffer."""
+        self.expiry.cancel()
+        self.task.cancel()
+        self.chunks.clear()
+        self.buffered = 0
+        if speculative_streams.get(self.client_id) is self:
+            del speculative_streams[self.client_id]
+
+    async def attach(self):
+        """
+        Yields the buffered audio and then the rest as it is produced.
+        If the listener goes away early, the source is cancelled.
+        """
+        self.attached = True
+        self.expiry.cancel()
+        self.logger.info(f"SPECULATIVE STREAM FOR {self.client_id} ATTACHED after {time.monotonic() - self.started_at:.2f}s with {self.buffered} bytes buffered")
+        try:
+            while True:
+                async with self.changed:
+                    await self.changed.wait_for(lambda: self.chunks or self.done)
+                    if not self.chunks:
+                        break
+                    chunk = self.chunks.popleft()
+                    self.buffered -= len(chunk)
+                    self.changed.notify_all()
+                yield chunk
+        finally:
+            if not self.task.done():
+                self.task.cancel()
+
+    def audio_source(self, prompt: str, cfg: dict, client_id: str, llm_config=None):
+        """Attaches to the stream, with the signature of an audio source function."""
+        return self.attach()
+
+# Streams that have been started but not attached yet, by client_id
+speculative_streams = {}
+
+def start_speculative_stream(client_id: str, source: AsyncIterator[bytes], speculative_cfg: dict, logger):
+    """
+    Starts running an audio source for a client ahead of time. A previous one that was never played is cancelled.
+    """
+    previous = speculative_streams.get(client_id)
+    if previous:
+        previous.cancel()
+    logger.info(f"SPECULATIVE STREAM FOR {client_id} STARTED")
+    speculative_streams[client_id] = SpeculativeStream(client_id, source, speculative_cfg["max_buffer_bytes"], speculative_cfg["expiry_seconds"], logger)
+    return speculative_streams[client_id]
+
+def take_speculative_stream(client_id: str):
+    """
+    Returns the speculative stream of a client to attach to, or None. Each stream can be taken once.
+    """
+    return speculative_streams.pop(client_id, None)
+
+def cancel_speculative_streams():
+    """
+    Cancels all streams that were never played.
+    """
+    for stream in list(speculative_streams.values()):
+        stream.cancel()
@@ -0,0 +1,64 @@
+import json
+
+class ToolCallAssembler:
+    """
+    Assembles streamed tool call fragments (`delta.tool_calls`) into complete tool calls.
+
+    Fragments of different tool calls can be interleaved, they are matched by index.
+    `add` returns the tool calls that became complete with these fragments, i.e. whose arguments
+    parse as a JSON object now, so they can be dispatched before the completion ends.
+    """
+    def __init__(self):
+        self.calls = {}  # index -> {"id", "name", "arguments"}
+        self.released = set()
+
+    def add(self, fragments: list):
+        """Adds fragments and returns the tool calls that are complete now, in the standard format."""
+        changed = []
+        for fragment in fragments:
+            index = fragment.index
+            if index not in self.calls:
+                self.calls[index] = {"id": fragment.id, "name": fragment.function.name, "arguments": ""}
+            self.calls[index]["arguments"] += fragment.function.arguments or ""
+            if index not in changed:
+                changed.append(index)
+
+        complete = []
+        for index in changed:
+            arguments = self.calls[index]["arguments"]
+            # Arguments are a JSON object, it can only be complete when it ends with a closing brace
+            if index in self.released or not arguments.rstrip().endswith("}"):
+                continue
+            try:
+                json.loads(arguments)
+            except json.JSONDecodeError:
+                continue
+            self.released.add(index)
+            complete.append(self._format(index))
+        return complete
+
+    def _format(self, index: int):
+        call = self.calls[index]
+        return {"id": call["id"], "type": "function", "function": {"name": call["name"], "arguments": call["arguments"]}}
+
+    def tool_calls(self):
+        """Returns all tool calls in the standard format, in index order."""
+        return [self._format(index) for index in sorted(self.calls)]
+
+def take_tool_results(messages: list, results: list):
+    """
+    Returns the results for the tool calls of the last assistant message, in the order of the calls,
+    once there is a result for each of them. Returns None if they are not all there yet
+    (or the tool calls themselves are not in the history yet).
+    """
+    for i in range(len(messages) - 1, -1, -1):
+        if messages[i].get("tool_calls"):
+            break
+    else:
+        return None
+    answered = {message.get("tool_call_id") for message in messages[i + 1:] if message.get("role") == "tool"}
+    waiting = [tool_call["id"] for tool_call in messages[i]["tool_calls"] if tool_call["id"] not in answered]
+    by_id = {result["tool_call_id"]: result for result in results}
+    if not waiting or not all(tool_call_id in by_id for tool_call_id in waiting):
+        return None
+    return [by_id[tool_call_id] for tool_call_id in waiting]
@@ -0,0 +1,185 @@
+import bisect
+from collections import deque
+from contextlib import aclosing
+from contextvars import ContextVar
+import itertools
+import time
+from typing import AsyncIterator
+
+# The trace of the request being served. Tasks started while serving it (TTS requests, speculative streams) inherit it.
+current_trace = ContextVar("current_trace", default=None)
+
+class Span:
+    """
+    A timed step of a trace, like an LLM call or a TTS request. Does nothing without a trace.
+    """
+    def __init__(self, trace, name: str, fields: dict):
+        self.trace = trace
+        self.data = None
+        if trace:
+            self.data = {"name": name, "start": trace.now(), **fields}
+            trace.spans.append(self.data)
+
+    def mark(self, name: str, **fields):
+        """Records when something first happened within the span, e.g. its first audio byte."""
+        if self.data is not None and name not in self.data:
+            self.data[name] = self.trace.now()
+            self.data.update(fields)
+
+    def end(self, **fields):
+        if self.data is not None and "end" not in self.data:
+            self.data["end"] = self.trace.now()
+            self.data.update(fields)
+
+class Trace:
+    """
+    The timeline of one voice turn. Times are seconds since the request was received, on the monotonic clock.
+    """
+    def __init__(self, trace_id: int, kind: str, client_id: str):
+        self.id = trace_id
+        self.kind = kind
+        self.client_id = client_id
+        self.received_at = time.time()
+        self.start = time.monotonic()
+        self.events = []
+        self.spans = []
+
+    def now(self):
+        return round(time.monotonic() - self.start, 4)
+
+    def event(self, name: str, **fields):
+        self.events.append({"name": name, "at": self.now(), **fields})
+
+    def span(self, name: str, **fields):
+        return Span(self, name, fields)
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "client_id": self.client_id,
+            "received_at": self.received_at,
+            "events": self.events,
+            "spans": self.spans,
+        }
+
+def trace_event(name: str, **fields):
+    """Adds an event to the current trace, if any."""
+    trace = current_trace.get()
+    if trace:
+        trace.event(name, **fields)
+
+def trace_span(name: str, **fields):
+    """Starts a span in the current trace. Without a trace, the span does nothing."""
+    return Span(current_trace.get(), name, fields)
+
+class Tracer:
+    """
+    Keeps the traces of the last `max_traces` requests in a ring buffer, finished or not.
+    """
+    def __init__(self, tracing_cfg: dict):
+        self.traces = deque(maxlen=tracing_cfg["max_traces"])
+        self.ids = itertools.count(1)
+
+    def start(self, kind: str, client_id: str):
+        """Starts a trace and makes it the current one for the running task and the tasks it starts."""
+        trace = Trace(next(self.ids), kind, client_id)
+        self.traces.append(trace)
+        current_trace.set(trace)
+        return trace
+
+    def recent(self, client_id: str = None):
+        """Returns the kept traces, newest first, optionally only the ones of one client."""
+        return [trace.to_dict() for trace in reversed(self.traces) if client_id is None or trace.client_id == client_id]
+
+# The shared tracer, see `start_tracing`
+tracer = None
+
+def start_tracing(cfg: dict):
+    """
+    Creates the shared tracer.
+    """
+    global tracer
+    tracer = Tracer(cfg["tracing"])
+    return tracer
+
+def tracer_get():
+    """
+    Returns the shared tracer
+    """
+    return tracer
+
+async def traced_stream(stream: AsyncIterator[bytes], trace: Trace, encoded: bool):
+    """
+    Passes the audio sent to the device through, recording the first audio byte and the end of the stream in the trace.
+    An encoded stream may start with a container header, so its first audio is the first byte from the encoder.
+    """
+    sent = 0
+    first_audio = False
+    completed = False
+    try:
+        async with aclosing(stream):
+            async for chunk in stream:
+                if not first_audio and chunk and (not encoded or any(event["name"] == "encoder_first_byte" for event in trace.events)):
+                    first_audio = True
+                    trace.event("first_audio_byte")
+                    TIME_TO_FIRST_AUDIO.observe(trace.now(), kind=trace.kind)
+                sent += len(chunk)
+                yield chunk
+        completed = True
+    finally:
+        trace.event("stream_end", bytes=sent, completed=completed)
+
+class Histogram:
+    """
+    A Prometheus histogram with optional labels, rendered in the text exposition format.
+    """
+    def __init__(self, name: str, documentation: str, buckets: list):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = buckets
+        self.series = {}  # Sorted label items -> [bucket counts, sum, count]
+
+    def observe(self, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        if key not in self.series:
+            self.series[key] = [[0] * len(self.buckets), 0.0, 0]
+        series = self.series[key]
+        index = bisect.bisect_left(self.buckets, value)
+        if index < len(self.buckets):
+            series[0][index] += 1
+        series[1] += value
+        series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for key, (counts, total, count) in self.series.items():
+            labels = "".join(f'{name}="{value}",' for name, value in key)
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f'{self.name}_bucket{{{labels}le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_bucket{{{labels}le="+Inf"}} {count}')
+            suffix = "{" + labels.rstrip(",") + "}" if labels else ""
+            lines.append(f"{self.name}_sum{suffix} {total}")
+            lines.append(f"{self.name}_count{suffix} {count}")
+        return "\n".join(lines) + "\n"
+
+LATENCY_BUCKETS = [0.05, 0.1, 0.25, 0.5, 0.75, 1.0, 1.5, 2.0, 3.0, 5.0, 10.0]
+REAL_TIME_FACTOR_BUCKETS = [0.05, 0.1, 0.25, 0.5, 0.75, 1.0, 1.5, 2.0, 5.0]
+AHEAD_BUCKETS = [0.25, 0.5, 1.0, 2.0, 4.0, 6.0, 10.0, 20.0, 60.0]
+UNIT_CHARS_BUCKETS = [20, 40, 80, 128, 200, 300, 400, 600]
+
+TIME_TO_FIRST_AUDIO = Histogram("ttmg_time_to_first_audio_seconds", "Time from the request to the first audio byte sent to the device.", LATENCY_BUCKETS)
+LLM_FIRST_TOKEN = Histogram("ttmg_llm_first_token_seconds", "Time from an LLM call to its first streamed chunk.", LATENCY_BUCKETS)
+TTS_FIRST_AUDIO = Histogram("ttmg_tts_first_audio_seconds", "Time from a TTS request to its first audio, per engine.", LATENCY_BUCKETS)
+ADMISSION_WAIT = Histogram("ttmg_admission_wait_seconds", "Time an upstream call waited for admission, per upstream and priority.", LATENCY_BUCKETS)
+TTS_REAL_TIME_FACTOR = Histogram("ttmg_tts_real_time_factor", "Time to synthesize a sentence divided by the duration of its audio, per engine.", REAL_TIME_FACTOR_BUCKETS)
+AUDIO_AHEAD = Histogram("ttmg_audio_ahead_seconds", "Audio a stream had produced ahead of playback when it sent a unit of speech to TTS.", AHEAD_BUCKETS)
+TTS_UNIT_CHARS = Histogram("ttmg_tts_unit_characters", "Characters of the units of speech sent to TTS, as chosen by pacing.", UNIT_CHARS_BUCKETS)
+
+def render_metrics():
+    """
+    Returns all metrics in the Prometheus text exposition format.
+    """
+    return "".join(histogram.render() for histogram in (TIME_TO_FIRST_AUDIO, LLM_FIRST_TOKEN, TTS_FIRST_AUDIO, TTS_REAL_TIME_FACTOR, ADMISSION_WAIT, AUDIO_AHEAD, TTS_UNIT_CHARS))
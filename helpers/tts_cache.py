@@ -0,0 +1,233 @@
+import asyncio
+from collections import OrderedDict
+from contextlib import aclosing
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from typing import Callable
+import unicodedata
+
+from helpers.admission import Overloaded, current_priority
+from helpers.tts_streaming import tts_output_format
+
+# Engine settings that change how a sentence sounds. Everything else (keys, hosts, tuning) is not part of the cache key.
+VOICE_KEYS = {"name", "language_code", "gender", "model", "voice", "voice_name"}
+
+def normalize_text(text: str):
+    """
+    Normalizes a sentence for the cache key: unicode NFC and collapsed whitespace.
+    """
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+def cache_key(sentence: str, cfg: dict):
+    """
+    Returns a content address for the audio of a sentence: a hash of the engine, its voice settings,
+    the audio format and the text.
+    """
+    engine = cfg["main"]["tts_engine"]
+    voice = {k: v for k, v in cfg.get(engine, {}).items() if k in VOICE_KEYS}
+    payload = json.dumps([engine, voice, tts_output_format(cfg), normalize_text(sentence)], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+class TTSCache:
+    """
+    Content-addressed cache for synthesized sentences.
+
+    Audio lives in a size-bounded in-memory LRU and in a directory on disk that survives restarts.
+    Disk entries are looked up, read chunk by chunk and written in worker threads, and promoted to memory on a hit.
+    """
+    def __init__(self, cache_cfg: dict, tts_function: Callable, logger):
+        self.enabled = cache_cfg["enabled"]
+        self.memory_max_bytes = cache_cfg["memory_max_bytes"]
+        self.disk_path = cache_cfg["disk_path"]
+        self.disk_max_bytes = cache_cfg["disk_max_bytes"]
+        self.max_text_length = cache_cfg["max_text_length"]
+        self.chunk_size = cache_cfg["chunk_size"]
+        self.tts_function = tts_function
+        self.logger = logger
+
+        self.memory = OrderedDict()
+        self.memory_bytes = 0
+        self.disk_bytes = 0
+        self.disk_lock = threading.Lock()  # Guards `disk_bytes` and eviction, writes run in worker threads
+        self.counters = {
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "bytes_from_cache": 0,
+            "bytes_synthesized": 0,
+            "stored": 0,
+            "evicted_memory": 0,
+            "evicted_disk": 0,
+        }
+
+        if self.enabled:
+            os.makedirs(self.disk_path, exist_ok=True)
+            self.disk_bytes = sum(size for _, size, _ in self._disk_entries())
+
+    def stats(self):
+        """Returns the cache counters and sizes."""
+        return {
+            **self.counters,
+            "memory_entries": len(self.memory),
+            "memory_bytes": self.memory_bytes,
+            "disk_bytes": self.disk_bytes,
+        }
+
+    def _path(self, key: str):
+        return os.path.join(self.disk_path, key[:2], key + ".audio")
+
+    def _disk_entries(self):
+        """Yields (path, size, mtime) for every entry on disk."""
+        for root, _, files in os.walk(self.disk_path):
+            for name in files:
+                if name.endswith(".audio"):
+                    path = os.path.join(root, name)
+                    stat = os.stat(path)
+                    yield path, stat.st_size, stat.st_mtime
+
+    def _remember(self, key: str, audio: bytes):
+        """Puts audio into the memory tier and evicts the least recently used entries."""
+        if len(audio) > self.memory_max_bytes:
+            return
+        if key in self.memory:
+            self.memory_bytes -= len(self.memory.pop(key))
+        self.memory[key] = audio
+        self.memory_bytes += len(audio)
+        while self.memory_bytes > self.memory_max_bytes:
+            _, evicted = self.memory.popitem(last=False)
+            self.memory_bytes -= len(evicted)
+            self.counters["evicted_memory"] += 1
+
+    def _write_disk(self, key: str, audio: bytes):
+        """Writes audio to disk atomically and evicts the oldest entries if we are over the quota."""
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # A temporary file of our own, as the same sentence can be stored twice at once
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(audio)
+            with self.disk_lock:
+                try:
+                    self.disk_bytes -= os.path.getsize(path)  # The entry we replace
+                except FileNotFoundError:
+                    pass
+                os.replace(tmp_path, path)
+                self.disk_bytes += len(audio)
+
+                if self.disk_bytes > self.disk_max_bytes:
+                    for old_path, size, _ in sorted(self._disk_entries(), key=lambda entry: entry[2]):
+                        if self.disk_bytes <= self.disk_max_bytes:
+                            break
+                        os.remove(old_path)
+                        self.disk_bytes -= size
+                        self.counters["evicted_disk"] += 1
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def _open_disk(self, key: str):
+        """Opens a disk entry, or returns None if there is no such entry."""
+        try:
+            f = open(self._path(key), "rb")
+        except FileNotFoundError:
+            return None
+        # Touch the entry, so disk eviction is least-recently-used
+        os.utime(f.fileno())
+        return f
+
+    async def store(self, key: str, audio: bytes):
+        """Stores audio in both tiers."""
+        self._remember(key, audio)
+        await asyncio.to_thread(self._write_disk, key, audio)
+        self.counters["stored"] += 1
+
+    async def _stream_memory(self, key: str):
+        self.memory.move_to_end(key)
+        audio = self.memory[key]
+        self.counters["memory_hits"] += 1
+        self.counters["bytes_from_cache"] += len(audio)
+        for i in range(0, len(audio), self.chunk_size):
+            yield audio[i:i + self.chunk_size]
+
+    async def _stream_disk(self, key: str, f):
+        """Streams an open disk entry, reading each chunk in a worker thread. A fully read entry is promoted to memory."""
+        self.counters["disk_hits"] += 1
+        chunks = []
+        try:
+            while audio_chunk := await asyncio.to_thread(f.read, self.chunk_size):
+                chunks.append(audio_chunk)
+                self.counters["bytes_from_cache"] += len(audio_chunk)
+                yield audio_chunk
+        finally:
+            f.close()
+        if chunks:
+            self._remember(key, b"".join(chunks))
+
+    async def lookup(self, sentence: str, cfg: dict):
+        """
+        Returns a stream of the cached audio for a sentence, or None if it is not cached.
+        The disk is checked and the entry opened in one worker thread call.
+        """
+        if not self.enabled or len(sentence) > self.max_text_length:
+            return None
+        key = cache_key(sentence, cfg)
+        if key in self.memory:
+            return self._stream_memory(key)
+        f = await asyncio.to_thread(self._open_disk, key)
+        return self._stream_disk(key, f) if f else None
+
+    async def stream(self, sentence: str, cfg: dict, logger):
+        """
+        Streams the audio for a sentence from the cache, or from the TTS engine on a miss.
+        Complete, error-free responses for short sentences are stored for the next time.
+        """
+        if not self.enabled or len(sentence) > self.max_text_length:
+            async for audio_chunk in self.tts_function(sentence, cfg, logger):
+                yield audio_chunk
+            return
+
+        cached = await self.lookup(sentence, cfg)
+        if cached:
+            async with aclosing(cached):
+                async for audio_chunk in cached:
+                    yield audio_chunk
+            return
+
+        key = cache_key(sentence, cfg)
+        chunks = []
+
+        self.counters["misses"] += 1
+        failed = False
+        async for audio_chunk in self.tts_function(sentence, cfg, logger):
+            # TTS engines yield b"" on errors, never cache those
+            failed = failed or not audio_chunk
+            chunks.append(audio_chunk)
+            self.counters["bytes_synthesized"] += len(audio_chunk)
+            yield audio_chunk
+        if chunks and not failed:
+            await self.store(key, b"".join(chunks))
+
+    async def prewarm(self, phrases: list, cfg: dict):
+        """Synthesizes and stores the phrases that are not cached yet, at the background priority. Run it in its own task."""
+        current_priority.set("background")
+        warmed = 0
+        for phrase in phrases:
+            phrase = phrase.strip()
+            if not phrase or len(phrase) > self.max_text_length:
+                continue
+            key = cache_key(phrase, cfg)
+            if key in self.memory or await asyncio.to_thread(os.path.exists, self._path(key)):
+                continue
+            try:
+                async for _ in self.stream(phrase, cfg, self.logger):
+                    pass
+            except Overloaded:
+                self.logger.warning("TTS CACHE: pre-warm stopped, the TTS engine is overloaded")
+                break
+            warmed += 1
+        self.logger.info(f"TTS CACHE: pre-warmed {warmed} of {len(phrases)} phrases")
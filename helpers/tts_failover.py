@@ -0,0 +1,276 @@
+import asyncio
+from collections import deque
+from contextlib import aclosing
+import time
+from typing import AsyncIterator
+
+from helpers.admission import Overloaded, on_tts_admission
+from helpers.audio_processing import convert_audio_stream, resample_pcm_stream
+from helpers.tts_cache import TTSCache
+from helpers.tts_streaming import tts_output_format
+from helpers.tracing import TTS_FIRST_AUDIO, TTS_REAL_TIME_FACTOR, trace_event, trace_span
+
+class EngineHealth:
+    """
+    Tracks the time to the first audio of a TTS engine and trips a circuit breaker when it keeps failing.
+
+    After `failure_threshold` failures in a row the engine is taken out of rotation for `open_seconds`.
+    Then it gets another try: a success puts it back, a failure takes it out again.
+    """
+    def __init__(self, name: str, window: int, failure_threshold: int, open_seconds: float, logger):
+        self.name = name
+        self.samples = deque(maxlen=window)
+        self.failure_threshold = failure_threshold
+        self.open_seconds = open_seconds
+        self.logger = logger
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.counters = {"successes": 0, "failures": 0, "hedged": 0, "hedges_won": 0, "circuit_opened": 0}
+
+    def available(self):
+        """Returns False while the circuit is open."""
+        return self.opened_at is None or time.monotonic() - self.opened_at >= self.open_seconds
+
+    def record_success(self, seconds: float):
+        self.samples.append(seconds)
+        self.counters["successes"] += 1
+        self.consecutive_failures = 0
+        if self.opened_at is not None:
+            self.logger.info(f"TTS {self.name.upper()} IS BACK IN ROTATION")
+            self.opened_at = None
+
+    def record_failure(self):
+        self.counters["failures"] += 1
+        self.consecutive_failures += 1
+        if self.consecutive_failures >= self.failure_threshold and self.available():
+            self.logger.warning(f"TTS {self.name.upper()} TAKEN OUT OF ROTATION for {self.open_seconds}s after {self.consecutive_failures} failures")
+            self.opened_at = time.monotonic()
+            self.counters["circuit_opened"] += 1
+
+    def percentile(self, p: float):
+        """Returns the p-th percentile of the recent times to the first audio, or None without samples."""
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))]
+
+    def stats(self):
+        return {
+            **self.counters,
+            "p50_seconds": self.percentile(50),
+            "p95_seconds": self.percentile(95),
+            "samples": len(self.samples),
+            "available": self.available(),
+        }
+
+class Attempt:
+    """
+    Runs one TTS engine for a sentence in the background. `first` resolves to True on the first audio,
+    or to False if the engine finished without any (TTS engines yield b"" on errors).
+    While the call waits for admission control, `waiting` is True. Once it is let through, the time to the first audio
+    and the real-time factor count from there (`start`), as waiting in line is load, not engine latency.
+    `bytes_per_second` of the audio is used for the real-time factor.
+    An attempt shed by admission control is not a failure of the engine.
+    """
+    def __init__(self, source: AsyncIterator[bytes], health: EngineHealth, sentence: str, bytes_per_second: int, logger):
+        self.health = health
+        self.bytes_per_second = bytes_per_second
+        self.logger = logger
+        self.queue = asyncio.Queue()
+        self.shed = False
+        self.first = asyncio.get_running_loop().create_future()
+        self.admitted = asyncio.get_running_loop().create_future()
+        self.waiting = False
+        self.start = time.monotonic()
+        self.span = trace_span("tts", engine=health.name, chars=len(sentence))
+        self.task = asyncio.create_task(self._run(source))
+
+    def _admission(self, waiting: bool):
+        self.waiting = waiting
+        if not waiting:
+            self.start = time.monotonic()
+            self.span.mark("admitted")
+            if not self.admitted.done():
+                self.admitted.set_result(None)
+
+    async def _run(self, source: AsyncIterator[bytes]):
+        on_tts_admission.set(self._admission)
+        audio_bytes = 0
+        cancelled = False
+        try:
+            async with aclosing(source):
+                async for audio_chunk in source:
+                    if not audio_chunk:
+                        continue
+                    if not audio_bytes:
+                        first_audio = time.monotonic() - self.start
+                        self.health.record_success(first_audio)
+                        TTS_FIRST_AUDIO.observe(first_audio, engine=self.health.name)
+                        self.span.mark("first_audio")
+                        self.first.set_result(True)
+                    audio_bytes += len(audio_chunk)
+                    self.queue.put_nowait(audio_chunk)
+        except asyncio.CancelledError:
+            cancelled = True
+            raise
+        except Overloaded:
+            self.shed = True
+        except Exception as e:
+            self.logger.error(f"TTS {self.health.name.upper()} error: {e}")
+        finally:
+            # Losing a race is not a failure. Its latency is not recorded either, or every hedge
+            # would push the p95 up to the budget and keep the budget from coming back down.
+            self.waiting = False
+            if not self.admitted.done():
+                self.admitted.set_result(None)
+            if not audio_bytes:
+                if not cancelled and not self.shed:
+                    self.health.record_failure()
+                if not self.first.done():
+                    self.first.set_result(False)
+            elif not cancelled:
+                TTS_REAL_TIME_FACTOR.observe((time.monotonic() - self.start) / (audio_bytes / self.bytes_per_second), engine=self.health.name)
+            self.span.end(bytes=audio_bytes, status="cancelled" if cancelled else "ok" if audio_bytes else "failed")
+            self.queue.put_nowait(None)
+
+    async def chunks(self):
+        """Yields the audio of this attempt."""
+        while (audio_chunk := await self.queue.get()) is not None:
+            yield audio_chunk
+
+    async def cancel(self):
+        self.task.cancel()
+        await asyncio.gather(self.task, return_exceptions=True)
+
+class FailoverTTS:
+    """
+    Resilience layer over the TTS engines (through the TTS cache).
+
+    Each sentence gets a latency budget: the p95 time to the first audio of the engine, within
+    `min_budget_seconds` and `max_budget_seconds` (`latency_budget_seconds` until there are `min_samples`).
+    When the primary engine has not started speaking within the budget (counted from its admission, see `Attempt`), the sentence is also sent to the
+    `secondary_engine` and whichever speaks first is used. If the primary fails, the secondary takes over right away.
+    Engines that keep failing are skipped while their circuit breaker is open.
+    Audio from the secondary engine is converted to the format of the primary one if they differ (raw PCM in-process).
+    Cached sentences are served straight from the cache.
+    """
+    def __init__(self, failover_cfg: dict, cache: TTSCache, logger):
+        self.secondary = failover_cfg["secondary_engine"]
+        self.initial_budget = failover_cfg["latency_budget_seconds"]
+        self.min_budget = failover_cfg["min_budget_seconds"]
+        self.max_budget = failover_cfg["max_budget_seconds"]
+        self.min_samples = failover_cfg["min_samples"]
+        self.window = failover_cfg["latency_window"]
+        self.failure_threshold = failover_cfg["failure_threshold"]
+        self.open_seconds = failover_cfg["open_seconds"]
+        self.cache = cache
+        self.logger = logger
+        self.engines = {}
+
+    def health(self, engine: str):
+        if engine not in self.engines:
+            self.engines[engine] = EngineHealth(engine, self.window, self.failure_threshold, self.open_seconds, self.logger)
+        return self.engines[engine]
+
+    def budget(self, engine: str):
+        """Returns how long to wait for the first audio of an engine before hedging."""
+        health = self.health(engine)
+        if len(health.samples) < self.min_samples:
+            return self.initial_budget
+        return min(self.max_budget, max(self.min_budget, health.percentile(95)))
+
+    async def _wait_first(self, attempt: Attempt, budget: float):
+        """Waits until the first audio of an attempt or until `budget` seconds after its admission. Returns True if it finished in time."""
+        while not attempt.first.done():
+            if attempt.waiting:
+                await asyncio.wait([attempt.first, attempt.admitted], return_when=asyncio.FIRST_COMPLETED)
+                continue
+            remaining = attempt.start + budget - time.monotonic()
+            if remaining <= 0:
+                return False
+            await asyncio.wait([attempt.first], timeout=remaining)
+        return True
+
+    def stats(self):
+        """Returns the latency percentiles, counters and circuit state per engine."""
+        return {engine: {**health.stats(), "budget_seconds": self.budget(engine)} for engine, health in self.engines.items()}
+
+    def _attempt(self, engine: str, sentence: str, cfg: dict, logger):
+        """Starts synthesizing a sentence with an engine, in the output format of the configured engine."""
+        engine_cfg = cfg if engine == cfg["main"]["tts_engine"] else {**cfg, "main": {**cfg["main"], "tts_engine": engine}}
+        source = self.cache.stream(sentence, engine_cfg, logger)
+        input_format, output_format = tts_output_format(engine_cfg), tts_output_format(cfg)
+        if input_format != output_format:
+            # Raw PCM is resampled in-process, spawning ffmpeg for a sentence would cost more than the hedge saves
+            if input_format["codec"] == output_format["codec"] == "pcm":
+                source = resample_pcm_stream(source, input_format, output_format)
+            else:
+                source = convert_audio_stream(source, input_format, output_format)
+        return Attempt(source, self.health(engine), sentence, output_format["rate"] * output_format["channels"] * 2, logger)
+
+    async def stream(self, sentence: str, cfg: dict, logger):
+        """
+        Streams the audio for a sentence, hedging and failing over to the secondary engine when needed.
+        Has the signature of a TTS function.
+        """
+        primary = cfg["main"]["tts_engine"]
+        secondary = self.secondary if self.secondary and self.secondary != primary else None
+        cached = await self.cache.lookup(sentence, cfg)
+        if cached:
+            trace_event("tts_cache_hit", chars=len(sentence))
+            async with aclosing(cached):
+                async for audio_chunk in cached:
+                    yield audio_chunk
+            return
+
+        engines = [primary]
+        if secondary and self.health(secondary).available():
+            # A primary with an open circuit is skipped, unless the secondary is out of rotation too
+            engines = [primary, secondary] if self.health(primary).available() else [secondary]
+
+        attempts = [self._attempt(engines[0], sentence, cfg, logger)]
+        try:
+            winner = None
+            if len(engines) == 1:
+                winner = attempts[0]
+            else:
+                # Give the primary its budget, then race it against the secondary
+                done = await self._wait_first(attempts[0], self.budget(primary))
+                if done and attempts[0].first.result():
+                    winner = attempts[0]
+                else:
+                    if done:
+                        logger.warning(f"TTS {primary.upper()} FAILED, falling back to {secondary.upper()}")
+                        trace_event("tts_failover", engine=secondary)
+                    else:
+                        logger.info(f"TTS {primary.upper()} SLOW (>{self.budget(primary):.2f}s), hedging with {secondary.upper()}")
+                        trace_event("tts_hedged", engine=secondary, budget=self.budget(primary))
+                        self.health(secondary).counters["hedged"] += 1
+                    attempts.append(self._attempt(secondary, sentence, cfg, logger))
+                    pending = [attempt for attempt in attempts if not attempt.first.done() or attempt.first.result()]
+                    while pending and winner is None:
+                        await asyncio.wait([attempt.first for attempt in pending], return_when=asyncio.FIRST_COMPLETED)
+                        for attempt in pending:
+                            if attempt.first.done() and attempt.first.result():
+                                winner = attempt
+                                break
+                        pending = [attempt for attempt in pending if not attempt.first.done()]
+                    if winner is None:
+                        winner = attempts[-1]
+                    elif winner is attempts[-1] and not done:
+                        self.health(secondary).counters["hedges_won"] += 1
+
+            for attempt in attempts:
+                if attempt is not winner:
+                    await attempt.cancel()
+            got_audio = False
+            async for audio_chunk in winner.chunks():
+                got_audio = True
+                yield audio_chunk
+            if not got_audio:
+                if winner.shed:
+                    raise Overloaded(f"{winner.health.name} is overloaded")
+                yield b""  # Every engine failed, keep the convention of the TTS engines
+        finally:
+            for attempt in attempts:
+                await attempt.cancel()
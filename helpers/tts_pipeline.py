@@ -0,0 +1,83 @@
+import asyncio
+from typing import AsyncIterator, Callable
+
+from helpers.admission import Overloaded, first_sentence_priority
+from helpers.tts_streaming import tts_stream
+from helpers.tracing import trace_event
+
+async def tts_pipeline(sentences: AsyncIterator[str], cfg: dict, logger, tts_function: Callable = tts_stream, lookahead: int = None):
+    """
+    Synthesizes sentences with up to `lookahead` upcoming sentences running in parallel
+    with the one that is currently being streamed, and yields the audio in sentence order.
+
+    Each sentence gets its own queue, so its audio is released as soon as the sentence is next in line,
+    even if it is still being synthesized. A sentence frees its slot only when it has been fully streamed,
+    so we never hold more than `lookahead + 1` sentences of audio in memory.
+
+    The first sentence is synthesized at the "first_sentence" priority. If a sentence is shed by admission control,
+    the rest of the audio would have gaps, so the pipeline stops with the Overloaded error.
+    If the caller stops early, all running syntheses and the sentence source are cancelled before we return.
+    """
+    if lookahead is None:
+        lookahead = cfg[cfg["main"]["tts_engine"]]["tts_lookahead"]
+
+    slots = asyncio.Semaphore(lookahead + 1)
+    pending = asyncio.Queue()  # Per-sentence audio queues, in sentence order
+    tasks = {}  # Synthesis task -> its sentence
+
+    async def synthesize(sentence: str, queue: asyncio.Queue, first: bool):
+        """Runs TTS for one sentence and puts its audio into the queue, followed by None."""
+        if first:
+            first_sentence_priority()
+        try:
+            async for audio_chunk in tts_function(sentence, cfg, logger):
+                queue.put_nowait(audio_chunk)
+        except Overloaded as e:
+            queue.put_nowait(e)
+        except Exception as e:
+            logger.error(f"TTS error: {e}")
+        finally:
+            queue.put_nowait(None)
+
+    async def dispatch():
+        """Starts synthesis for each incoming sentence as soon as a slot is free."""
+        try:
+            first = True
+            async for sentence in sentences:
+                await slots.acquire()
+                logger.info(f"TTS {cfg['main']['tts_engine'].upper()}: {sentence}")
+                trace_event("sentence", chars=len(sentence))
+                queue = asyncio.Queue()
+                task = asyncio.create_task(synthesize(sentence, queue, first))
+                first = False
+                tasks[task] = sentence
+                task.add_done_callback(lambda done: tasks.pop(done, None))
+                pending.put_nowait(queue)
+        finally:
+            pending.put_nowait(None)
+
+    dispatcher = asyncio.create_task(dispatch())
+    try:
+        while True:
+            queue = await pending.get()
+            if queue is None:
+                break
+            while True:
+                audio_chunk = await queue.get()
+                if audio_chunk is None:
+                    break
+                if isinstance(audio_chunk, Overloaded):
+                    raise audio_chunk
+                yield audio_chunk
+            slots.release()
+
+        # Re-raise errors from the sentence source, if any
+        await dispatcher
+    finally:
+        unfinished = [sentence for task, sentence in tasks.items() if not task.done()]
+        if unfinished:
+            logger.info(f"TTS CANCELLED: {len(unfinished)} sentences ({sum(map(len, unfinished))} characters) not synthesized")
+        running = [dispatcher, *tasks]
+        for task in running:
+            task.cancel()
+        await asyncio.gather(*running, return_exceptions=True)
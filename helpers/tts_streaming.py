@@ -1,166 +1,544 @@
-# OpenAI
-import openai
+# The SDK of each engine is imported when the engine is created, so a server only loads the one it is configured for
+from abc import ABC, abstractmethod
+import asyncio
+import base64
+import json
+import struct
+from typing import AsyncGenerator, AsyncIterator
 
-# Google cloud
-from google.api_core.exceptions import GoogleAPIError
-from google.cloud import texttospeech
+import httpx
 
-# ElevenLabs
-from elevenlabs.client import ElevenLabs
+from helpers.pacing import read_size
+from helpers.tracing import trace_span
 
-# Wyoming-piper
-import asyncio
-import io
-from typing import AsyncGenerator
-from wyoming.client import AsyncTcpClient
-from wyoming.audio import AudioChunk, AudioStop
-from wyoming.tts import Synthesize, SynthesizeVoice
-import wave
-
-async def tts_stream_google(sentence: str, credentials_path: str, name: str, language_code: str, gender: str, logger):
-    """Calls Google Cloud TTS and streams back audio."""
-    try:
-        client = texttospeech.TextToSpeechClient.from_service_account_json(credentials_path)
-        input_text = texttospeech.SynthesisInput(text=sentence)
-        voice = texttospeech.VoiceSelectionParams(
-            name=name,
-            language_code=language_code,
-            ssml_gender = texttospeech.SsmlVoiceGender.FEMALE if gender == "FEMALE" else texttospeech.SsmlVoiceGender.MALE
-        )
-        audio_config = texttospeech.AudioConfig(
-            audio_encoding=texttospeech.AudioEncoding.MP3
+# OpenAI returns raw PCM at this rate only
+OPENAI_PCM_RATE = 24000
+
+def strip_wav_header(audio: bytes):
+    """
+    Returns the samples of a WAV file (LINEAR16 responses are wrapped in one), or the audio as is if it has no header.
+    """
+    if audio[:4] != b"RIFF" or audio[8:12] != b"WAVE":
+        return audio
+    offset = 12
+    while offset + 8 <= len(audio):
+        chunk_id, size = audio[offset:offset + 4], struct.unpack("<I", audio[offset + 4:offset + 8])[0]
+        if chunk_id == b"data":
+            return audio[offset + 8:offset + 8 + size]
+        offset += 8 + size + (size & 1)
+    return b""
+
+def pooled_http_client(max_connections: int):
+    """
+    Returns an async HTTP client that keeps up to `max_connections` connections open between requests.
+    """
+    return httpx.AsyncClient(
+        limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+        timeout=httpx.Timeout(60.0, connect=5.0),
+    )
+
+def feed_text(text_chunks: AsyncIterator[str], send, finish, logger):
+    """
+    Starts a task that passes each text chunk to `send` and calls `finish` at the end of the text.
+    The synthesis session reads audio while this task writes text. Cancelling the task stops reading the text source.
+    """
+    async def run():
+        try:
+            async for text in text_chunks:
+                if text:
+                    await send(text)
+        except Exception as e:
+            logger.error(f"TTS text stream error: {e}")
+        await finish()
+    return asyncio.create_task(run())
+
+class TTSEngine(ABC):
+    """
+    A TTS engine with one long-lived async client, shared by all sentences and requests.
+    """
+    # Engines that can synthesize text while it is still being written set this and override `stream_text`
+    supports_text_streaming = False
+
+    @abstractmethod
+    def stream(self, sentence: str, logger) -> AsyncGenerator[bytes, None]:
+        """Synthesizes a sentence and yields its audio. Yields b"" on errors."""
+
+    async def stream_text(self, text_chunks: AsyncIterator[str], logger) -> AsyncGenerator[bytes, None]:
+        """
+        Synthesizes text while it is still being written (e.g. LLM tokens) in one synthesis session
+        and yields the audio as it arrives. Engines without `supports_text_streaming` wait for the whole text
+        and synthesize it as one sentence.
+        """
+        text = "".join([text async for text in text_chunks])
+        if text.strip():
+            async for audio_chunk in self.stream(text, logger):
+                yield audio_chunk
+
+    async def warm_up(self):
+        """Opens a connection to the engine, so the first sentence does not pay for the handshake."""
+
+    async def close(self):
+        """Closes the client and its connections."""
+
+class GoogleTTSEngine(TTSEngine):
+    """
+    Google Cloud TTS over one async gRPC channel, which multiplexes all requests.
+    The credentials file is read once, when the engine is created.
+    """
+    supports_text_streaming = True
+
+    def __init__(self, engine_cfg: dict, transport=None):
+        from google.cloud import texttospeech
+        if transport is not None:
+            self.client = texttospeech.TextToSpeechAsyncClient(transport=transport)
+        else:
+            self.client = texttospeech.TextToSpeechAsyncClient.from_service_account_json(engine_cfg["credentials_path"])
+        self.voice = texttospeech.VoiceSelectionParams(
+            name=engine_cfg["name"],
+            language_code=engine_cfg["language_code"],
+            ssml_gender = texttospeech.SsmlVoiceGender.FEMALE if engine_cfg["gender"] == "FEMALE" else texttospeech.SsmlVoiceGender.MALE
         )
-        response = client.synthesize_speech(
-            input=input_text, voice=voice, audio_config=audio_config
+        # Raw PCM, so nothing has to be decoded before it is encoded for the device
+        self.audio_config = texttospeech.AudioConfig(
+            audio_encoding=texttospeech.AudioEncoding.LINEAR16,
+            sample_rate_hertz=engine_cfg["sample_rate"]
         )
-        yield response.audio_content
-    except GoogleAPIError as e:
-        logger.error(f"Google Cloud TTS API error: {e}")
-        yield b""  # Yield an empty byte string to indicate an error
-    except Exception as e:
-        logger.error(f"Unexpected error: {e}")
-        yield b""  # Yield an empty byte string to indicate an error
-
-async def tts_stream_openai(sentence: str, model: str, voice: str, logger):
-    """Calls OpenAI TTS, loads full audio (OpenAI does not support streaming), and streams it in chunks."""
-    try:
-        response = openai.audio.speech.create(
-            model=model,
-            voice=voice,
-            input=sentence,
-            response_format="mp3"
+        self.streaming_config = texttospeech.StreamingSynthesizeConfig(
+            voice=self.voice,
+            streaming_audio_config=texttospeech.StreamingAudioConfig(
+                audio_encoding=texttospeech.AudioEncoding.PCM,
+                sample_rate_hertz=engine_cfg["sample_rate"]
+            )
         )
-        # Stream response in chunks
-        for audio_chunk in response.iter_bytes(1024):
-          yield audio_chunk
-
-    except openai.OpenAIError as e:
-        logger.error(f"OpenAI TTS API error: {e}")
-        yield b""  # Return an empty byte string on error
-    except Exception as e:
-        logger.error(f"Unexpected error: {e}")
-        yield b""  # Return an empty byte string on error
-        
-async def tts_stream_elevenlabs(sentence: str, model: str, voice: str, api_key: str, logger):
-    """Calls ElevenLabs TTS and streams back audio."""
-    try:
-        client = ElevenLabs(api_key=api_key)
-        response = client.text_to_speech.convert_as_stream(
-            text=sentence,
-            voice_id=voice,
-            model_id=model
+
+    async def stream(self, sentence: str, logger):
+        """Calls Google Cloud TTS and streams back raw PCM (s16le, mono, `sample_rate`)."""
+        from google.api_core.exceptions import GoogleAPIError
+        from google.cloud import texttospeech
+        try:
+            response = await self.client.synthesize_speech(
+                input=texttospeech.SynthesisInput(text=sentence), voice=self.voice, audio_config=self.audio_config
+            )
+            yield strip_wav_header(response.audio_content)
+        except GoogleAPIError as e:
+            logger.error(f"Google Cloud TTS API error: {e}")
+            yield b""  # Yield an empty byte string to indicate an error
+        except Exception as e:
+            logger.error(f"Unexpected error: {e}")
+            yield b""  # Yield an empty byte string to indicate an error
+
+    async def stream_text(self, text_chunks: AsyncIterator[str], logger):
+        """
+        Sends the text to Google streaming synthesis as it arrives and yields raw PCM (s16le, mono, `sample_rate`).
+        Streaming synthesis needs a Chirp HD voice.
+        """
+        from google.api_core.exceptions import GoogleAPIError
+        from google.cloud import texttospeech
+        queue = asyncio.Queue()
+
+        async def requests():
+            yield texttospeech.StreamingSynthesizeRequest(streaming_config=self.streaming_config)
+            while (text := await queue.get()) is not None:
+                yield texttospeech.StreamingSynthesizeRequest(input=texttospeech.StreamingSynthesisInput(text=text))
+
+        async def send(text: str):
+            queue.put_nowait(text)
+
+        async def finish():
+            queue.put_nowait(None)
+
+        feeder = feed_text(text_chunks, send, finish, logger)
+        call = None
+        try:
+            call = await self.client.streaming_synthesize(requests=requests())
+            async for response in call:
+                yield response.audio_content
+        except GoogleAPIError as e:
+            logger.error(f"Google Cloud TTS API error: {e}")
+            yield b""  # Yield an empty byte string to indicate an error
+        except Exception as e:
+            logger.error(f"Unexpected error: {e}")
+            yield b""  # Yield an empty byte string to indicate an error
+        finally:
+            if call is not None and not call.done():
+                call.cancel()
+            feeder.cancel()
+            await asyncio.gather(feeder, return_exceptions=True)
+
+    async def warm_up(self):
+        await self.client.transport.grpc_channel.channel_ready()
+
+    async def close(self):
+        await self.client.transport.close()
+
+class OpenAITTSEngine(TTSEngine):
+    """
+    OpenAI TTS with a pooled async client. Raw PCM (s16le, mono, 24 kHz) is streamed as it arrives.
+    """
+    def __init__(self, engine_cfg: dict, api_key: str):
+        import openai
+        self.model = engine_cfg["model"]
+        self.voice = engine_cfg["voice"]
+        self.http_client = pooled_http_client(engine_cfg["max_connections"])
+        self.client = openai.AsyncOpenAI(
+            api_key=api_key,
+            base_url=engine_cfg["base_url"],
+            http_client=self.http_client,
         )
-        # Stream response in chunks
-        for audio_chunk in response:
+
+    async def stream(self, sentence: str, logger):
+        """Calls OpenAI TTS and streams back raw PCM in chunks, as large as the pacing of the stream allows."""
+        import openai
+        try:
+            async with self.client.audio.speech.with_streaming_response.create(
+                model=self.model,
+                voice=self.voice,
+                input=sentence,
+                response_format="pcm"
+            ) as response:
+                async for audio_chunk in response.iter_bytes(read_size()):
+                    yield audio_chunk
+
+        except openai.OpenAIError as e:
+            logger.error(f"OpenAI TTS API error: {e}")
+            yield b""  # Return an empty byte string on error
+        except Exception as e:
+            logger.error(f"Unexpected error: {e}")
+            yield b""  # Return an empty byte string on error
+
+    async def warm_up(self):
+        # Any response will do, the connection stays in the pool
+        await self.http_client.head(str(self.client.base_url))
+
+    async def close(self):
+        await self.client.close()
+
+class ElevenLabsTTSEngine(TTSEngine):
+    """
+    ElevenLabs TTS with a pooled async client, and the websocket input stream for the text streaming mode.
+    """
+    supports_text_streaming = True
+
+    def __init__(self, engine_cfg: dict):
+        from elevenlabs.client import AsyncElevenLabs
+        self.model = engine_cfg["model"]
+        self.voice = engine_cfg["voice"]
+        self.api_key = engine_cfg["api_key"]
+        self.output_format = f"pcm_{engine_cfg['sample_rate']}"
+        self.chunk_length_schedule = engine_cfg["chunk_length_schedule"]
+        base_url = (engine_cfg["base_url"] or "https://api.elevenlabs.io").rstrip("/")
+        self.base_url = base_url
+        self.websocket_url = "ws" + base_url[len("http"):] if base_url.startswith("http") else base_url
+        self.http_client = pooled_http_client(engine_cfg["max_connections"])
+        self.client = AsyncElevenLabs(api_key=engine_cfg["api_key"], base_url=engine_cfg["base_url"], httpx_client=self.http_client)
+
+    async def stream(self, sentence: str, logger):
+        """Calls ElevenLabs TTS and streams back raw PCM (s16le, mono, `sample_rate`)."""
+        try:
+            async for audio_chunk in self.client.text_to_speech.convert_as_stream(
+                text=sentence,
+                voice_id=self.voice,
+                model_id=self.model,
+                output_format=self.output_format
+            ):
+                yield audio_chunk
+
+        except Exception as e:
+            logger.error(f"ElevenLabs TTS API error: {e}")
+            yield b""  # Return an empty byte string on error
+
+    async def stream_text(self, text_chunks: AsyncIterator[str], logger):
+        """
+        Sends the text to the ElevenLabs websocket input stream as it arrives and yields raw PCM as it arrives.
+        ElevenLabs starts generating once it has `chunk_length_schedule` characters buffered.
+        """
+        from websockets.asyncio.client import connect as websocket_connect
+        url = f"{self.websocket_url}/v1/text-to-speech/{self.voice}/stream-input?model_id={self.model}&output_format={self.output_format}"
+        feeder = None
+        try:
+            async with websocket_connect(url, additional_headers={"xi-api-key": self.api_key}) as websocket:
+                await websocket.send(json.dumps({"text": " ", "generation_config": {"chunk_length_schedule": self.chunk_length_schedule}}))
+
+                # ElevenLabs expects whole words, so we only send text up to the last space
+                pending = ""
+
+                async def send(text: str):
+                    nonlocal pending
+                    pending += text
+                    cut = pending.rfind(" ") + 1
+                    if cut:
+                        await websocket.send(json.dumps({"text": pending[:cut]}))
+                        pending = pending[cut:]
+
+                async def finish():
+                    if pending:
+                        await websocket.send(json.dumps({"text": pending + " "}))
+                    # Empty text ends the input, the rest of the buffer is generated
+                    await websocket.send(json.dumps({"text": ""}))
+
+                feeder = feed_text(text_chunks, send, finish, logger)
+                async for message in websocket:
+                    data = json.loads(message)
+                    if data.get("audio"):
+                        yield base64.b64decode(data["audio"])
+                    if data.get("isFinal"):
+                        break
+
+        except Exception as e:
+            logger.error(f"ElevenLabs TTS API error: {e}")
+            yield b""  # Return an empty byte string on error
+        finally:
+            if feeder:
+                feeder.cancel()
+                await asyncio.gather(feeder, return_exceptions=True)
+
+    async def warm_up(self):
+        # Any response will do, the connection stays in the pool
+        await self.http_client.head(self.base_url)
+
+    async def close(self):
+        await self.http_client.aclose()
+
+class WyomingPool:
+    """
+    Pool of persistent connections to a Wyoming server.
+    Wyoming servers keep the connection open after a response, so we can reuse it for the next sentence.
+    """
+    def __init__(self, host: str, port: int, size: int):
+        self.host = host
+        self.port = int(port)
+        self.slots = asyncio.Semaphore(size)
+        self.idle = []  # Connected clients that are ready to be reused
+
+    async def acquire(self):
+        """Returns an idle connection (a wyoming `AsyncTcpClient`), or opens a new one."""
+        from wyoming.client import AsyncTcpClient
+        await self.slots.acquire()
+        try:
+            if self.idle:
+                return self.idle.pop()
+            client = AsyncTcpClient(self.host, self.port)
+            await client.connect()
+            return client
+        except BaseException:
+            self.slots.release()
+            raise
+
+    async def release(self, client, reusable: bool):
+        """
+        Returns a connection to the pool. Connections that were not read until the end
+        of a response can have events left in them, so they are closed instead.
+        """
+        try:
+            if reusable:
+                self.idle.append(client)
+            else:
+                await client.disconnect()
+        except OSError:
+            pass
+        finally:
+            self.slots.release()
+
+    async def close(self):
+        """Closes all idle connections."""
+        while self.idle:
+            try:
+                await self.idle.pop().disconnect()
+            except OSError:
+                pass
+
+# One pool per Wyoming server
+wyoming_pools = {}
+
+def get_wyoming_pool(host: str, port: str, size: int):
+    """
+    Returns the connection pool for a Wyoming server, creating it on the first use.
+    """
+    if (host, port) not in wyoming_pools:
+        wyoming_pools[(host, port)] = WyomingPool(host, port, size)
+    return wyoming_pools[(host, port)]
+
+async def close_wyoming_pools():
+    """
+    Closes all Wyoming connection pools.
+    """
+    for pool in wyoming_pools.values():
+        await pool.close()
+    wyoming_pools.clear()
+
+async def tts_stream_piper(sentence: str, voice_name: str, host: str, port:str, sample_rate: int, pool_size: int, logger) -> AsyncGenerator[bytes, None]:
+    """
+    Calls Piper over a pooled connection and streams back raw PCM (s16le, mono, `sample_rate`) as it arrives.
+    """
+    from wyoming.audio import AudioChunk, AudioChunkConverter, AudioStop
+    from wyoming.tts import Synthesize, SynthesizeVoice
+    pool = get_wyoming_pool(host, port, pool_size)
+    converter = AudioChunkConverter(rate=sample_rate, width=2, channels=1)
+    voice = None
+    if voice_name is not None:
+        voice = SynthesizeVoice(name=voice_name, language = None, speaker=None)
+    synthesize = Synthesize(text=sentence, voice=voice)
+
+    # A pooled connection might have been closed by the server in the meantime,
+    # so we retry once on a fresh one if we lose it before getting any audio.
+    for attempt in range(2):
+        got_audio = False
+        try:
+            client = await pool.acquire()
+        except OSError as e:
+            logger.error(f"Piper TTS API error: {e}")
+            yield b""  # Return an empty byte string on error
+            return
+
+        reusable = False
+        try:
+            await client.write_event(synthesize.event())
+            while True:
+                event = await client.read_event()
+                if event is None:
+                    logger.debug("Connection lost")
+                    break
+
+                if AudioStop.is_type(event.type):
+                    reusable = True
+                    return
+
+                if AudioChunk.is_type(event.type):
+                    got_audio = True
+                    yield converter.convert(AudioChunk.from_event(event)).audio
+
+        except OSError as e:
+            if got_audio or attempt:
+                logger.error(f"Piper TTS API error: {e}")
+                yield b""  # Return an empty byte string on error
+                return
+        except Exception as e:
+            logger.error(f"Piper TTS API error: {e}")
+            yield b""  # Return an empty byte string on error
+            return
+        finally:
+            await pool.release(client, reusable)
+
+        if got_audio:
+            return
+    logger.error("Piper TTS API error: connection lost")
+    yield b""
+
+class PiperTTSEngine(TTSEngine):
+    """
+    Piper over a pool of persistent Wyoming connections.
+    """
+    def __init__(self, engine_cfg: dict):
+        self.engine_cfg = engine_cfg
+
+    async def stream(self, sentence: str, logger):
+        cfg = self.engine_cfg
+        async for audio_chunk in tts_stream_piper(sentence, voice_name=cfg["voice_name"], host=cfg["host"], port=cfg["port"], sample_rate=cfg["sample_rate"], pool_size=cfg["pool_size"], logger=logger):
             yield audio_chunk
 
-    except Exception as e:
-        logger.error(f"ElevenLabs TTS API error: {e}")
-        yield b""  # Return an empty byte string on error
-  
-async def tts_stream_piper(sentence: str, voice_name: str, host: str, port:str, logger) -> AsyncGenerator[bytes, None]:
-    """Calls Piper, loads full audio (it does not support streaming), and streams it in chunks."""
-    try:
-      async with AsyncTcpClient(host, port) as client:
-          logger.info("Connected to Piper TTS")
-          voice: SynthesizeVoice | None = None
-          if voice_name is not None:
-              voice = SynthesizeVoice(name=voice_name, language = None, speaker=None)
-          synthesize = Synthesize(text=sentence, voice=voice)
-          await client.write_event(synthesize.event())
-          wav_writer: wave.Wave_write | None = None
-          with io.BytesIO() as wav_io:
-              while True:
-                  event = await client.read_event()
-                  if event is None:
-                      logger.debug("Connection lost")
-                      return
-
-                  if AudioStop.is_type(event.type):
-                      break
-
-                  if AudioChunk.is_type(event.type):
-                      chunk = AudioChunk.from_event(event)
-                      if wav_writer is None:
-                          wav_writer = wave.open(wav_io, "wb")
-                          wav_writer.setframerate(chunk.rate)
-                          wav_writer.setsampwidth(chunk.width)
-                          wav_writer.setnchannels(chunk.channels)
-
-                      wav_writer.writeframes(chunk.audio)
-                      # yield chunk.audio  # // TO-DO: figure out why this does not work :(
-                      
-              if wav_writer is not None:
-                  wav_writer.close()
-                  
-              wav_data = wav_io.getvalue() # yielding this also does not work (only the first sentence works), hmm...
-              
-              # Stupid workaround: convert WAV to MP3 using ffmpeg
-              mp3_io = io.BytesIO()
-              process = await asyncio.create_subprocess_exec(
-                  'ffmpeg',
-                  '-hide_banner',
-                  '-loglevel', 'error',
-                  '-i', 'pipe:0',         # input is WAV from stdin
-                  '-f', 'mp3',            # output format
-                  'pipe:1',               # send MP3 to stdout
-                  stdin=asyncio.subprocess.PIPE,
-                  stdout=asyncio.subprocess.PIPE,
-                  stderr=asyncio.subprocess.PIPE
-              )
-
-              stdout, stderr = await process.communicate(input=wav_data)
-              if process.returncode != 0:
-                  logger.error(f"ffmpeg error: {stderr.decode()}")
-                  return
-
-              mp3_io.write(stdout)
-              mp3_data = mp3_io.getvalue()
-
-              # Now this finally works
-              chunk_size = 1024
-              for i in range(0, len(mp3_data), chunk_size):
-                  yield mp3_data[i:i + chunk_size]
-                  
-    except (OSError, Exception) as e:
-        logger.error(f"Piper TTS API error: {e}")
-        yield b""  # Return an empty byte string on error
+    async def warm_up(self):
+        cfg = self.engine_cfg
+        pool = get_wyoming_pool(cfg["host"], cfg["port"], cfg["pool_size"])
+        await pool.release(await pool.acquire(), reusable=True)
+
+    async def close(self):
+        await close_wyoming_pools()
+
+TTS_ENGINE_CLASSES = {"google_cloud": GoogleTTSEngine, "openai": OpenAITTSEngine, "elevenlabs": ElevenLabsTTSEngine, "piper": PiperTTSEngine}
+
+# Engines that can synthesize text while it is still being written, see `TTSEngine.stream_text`
+TEXT_STREAMING_ENGINES = tuple(name for name, engine_class in TTS_ENGINE_CLASSES.items() if engine_class.supports_text_streaming)
+
+def create_tts_engine(name: str, cfg: dict) -> TTSEngine:
+    """
+    Creates the engine for one of the TTS engines in config ("google_cloud", "openai", "elevenlabs" or "piper").
+    """
+    if name == "google_cloud":
+        return GoogleTTSEngine(cfg["google_cloud"])
+    if name == "openai":
+        return OpenAITTSEngine(cfg["openai"], cfg["main"]["openai_api_key"])
+    if name == "elevenlabs":
+        return ElevenLabsTTSEngine(cfg["elevenlabs"])
+    if name == "piper":
+        return PiperTTSEngine(cfg["piper"])
+    raise ValueError(f"Unknown TTS engine: {name}")
+
+# One engine per configured TTS engine, by name
+tts_engines = {}
+
+def get_tts_engine(name: str, cfg: dict) -> TTSEngine:
+    """
+    Returns the engine with the given name, creating it on the first use.
+    """
+    if name not in tts_engines:
+        tts_engines[name] = create_tts_engine(name, cfg)
+    return tts_engines[name]
+
+def start_tts_engines(cfg: dict):
+    """
+    Creates the clients of the configured TTS engine and of the secondary (failover) engine,
+    so the first sentence does not pay for them. Must be called from the event loop the engines are used on.
+    """
+    get_tts_engine(cfg["main"]["tts_engine"], cfg)
+    if cfg["failover"]["secondary_engine"]:
+        get_tts_engine(cfg["failover"]["secondary_engine"], cfg)
+
+async def warm_up_tts_engines(logger):
+    """
+    Opens a connection to each started TTS engine. Errors are only logged, the engine connects again on the first sentence.
+    """
+    for name, engine in list(tts_engines.items()):
+        try:
+            await engine.warm_up()
+        except Exception as e:
+            logger.warning(f"Could not warm up TTS {name.upper()}: {e}")
+
+async def close_tts_engines():
+    """
+    Closes all TTS engines and their connections.
+    """
+    for engine in tts_engines.values():
+        await engine.close()
+    tts_engines.clear()
+
+def tts_output_format(cfg: dict):
+    """
+    Returns the format of the audio the configured TTS engine yields. All engines are asked for their native
+    raw output, so this is always {"codec": "pcm", "rate": ..., "channels": 1} for signed 16-bit little-endian PCM.
+    """
+    engine = cfg["main"]["tts_engine"]
+    if engine == "openai":
+        return {"codec": "pcm", "rate": OPENAI_PCM_RATE, "channels": 1}
+    return {"codec": "pcm", "rate": cfg[engine]["sample_rate"], "channels": 1}
+
+def text_streaming_enabled(cfg: dict):
+    """
+    Returns True if the configured TTS engine should get LLM tokens directly instead of whole sentences.
+    """
+    engine = cfg["main"]["tts_engine"]
+    return engine in TEXT_STREAMING_ENGINES and cfg[engine]["text_streaming"]
 
 async def tts_stream(sentence: str, cfg: dict, logger):
     """
     Simple wrapper to route to whichever TTS engine is in config.
     """
-    if cfg["main"]["tts_engine"] == "google_cloud":
-        async for audio_chunk in tts_stream_google(sentence, credentials_path=cfg["google_cloud"]["credentials_path"], name=cfg["google_cloud"]["name"], language_code=cfg["google_cloud"]["language_code"], gender=cfg["google_cloud"]["gender"], logger=logger):
-            yield audio_chunk
-    elif cfg["main"]["tts_engine"]  == "openai":
-        async for audio_chunk in tts_stream_openai(sentence, model=cfg["openai"]["model"], voice=cfg["openai"]["voice"], logger=logger):
-            yield audio_chunk
-    elif cfg["main"]["tts_engine"]  == "elevenlabs":
-        async for audio_chunk in tts_stream_elevenlabs(sentence, model=cfg["elevenlabs"]["model"], voice=cfg["elevenlabs"]["voice"], api_key=cfg["elevenlabs"]["api_key"], logger=logger):
-            yield audio_chunk
-    elif cfg["main"]["tts_engine"]  == "piper":
-        async for audio_chunk in tts_stream_piper(sentence, voice_name=cfg["piper"]["voice_name"], host=cfg["piper"]["host"], port=cfg["piper"]["port"], logger=logger):
-            yield audio_chunk
-    else:
+    if cfg["main"]["tts_engine"] not in ("google_cloud", "openai", "elevenlabs", "piper"):
         yield b""
+        return
+    async for audio_chunk in get_tts_engine(cfg["main"]["tts_engine"], cfg).stream(sentence, logger):
+        yield audio_chunk
+
+async def tts_text_stream(text_chunks: AsyncIterator[str], cfg: dict, logger):
+    """
+    Streams text into the configured TTS engine as it is written and yields the audio as it arrives.
+    """
+    span = trace_span("tts_text_stream", engine=cfg["main"]["tts_engine"])
+    audio_bytes = 0
+    try:
+        async for audio_chunk in get_tts_engine(cfg["main"]["tts_engine"], cfg).stream_text(text_chunks, logger):
+            if audio_chunk and not audio_bytes:
+                span.mark("first_audio")
+            audio_bytes += len(audio_chunk)
+            yield audio_chunk
+    finally:
+        span.end(bytes=audio_bytes)
@@ -1,20 +1,41 @@
 
 import aiofiles
-from asyncio import Event
-from fastapi import FastAPI, Request
-from fastapi.responses import StreamingResponse, JSONResponse
+import asyncio
+import copy
+from contextlib import aclosing, asynccontextmanager
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import FileResponse, StreamingResponse, JSONResponse, PlainTextResponse
+import httpx
 import json
 import logging
 import openai
 import os
-
-from helpers.audio_processing import create_persistent_flac_encoder, feed_encoder, stream_flac_from_audio_source
-from helpers.tts_streaming import tts_stream_google, tts_stream_openai, tts_stream_elevenlabs, tts_stream
+import time
+import uuid
+
+from helpers.admission import Overloaded, admission_get, admitted_tts, admitted_tts_text, current_priority, start_admission
+from helpers.audio_processing import OUTPUT_FORMATS, encodes_in_process, media_type, stream_encoded_from_audio_source, start_encoder_pool, stop_encoder_pool, encoder_pool_get
+from helpers.broadcast import broadcast_stats, cancel_broadcasts, get_broadcast
+from helpers.disconnect import stream_until_disconnect
+from helpers.pacing import start_pacing
+from helpers.prerender import renderer_get, start_renderer, valid_job_id
+from helpers.resumable import cancel_resumable_streams, find_resumable_stream, resumable_stream_stats, start_resumable_stream
+from helpers.speculative import start_speculative_stream, take_speculative_stream, cancel_speculative_streams
+from helpers.tts_streaming import tts_stream, tts_text_stream, text_streaming_enabled, tts_output_format, start_tts_engines, warm_up_tts_engines, close_tts_engines
+from helpers.tts_pipeline import tts_pipeline
+from helpers.tts_cache import TTSCache
+from helpers.tts_failover import FailoverTTS
+from helpers.session_store import create_session_store, compact_history, estimate_tokens
+from helpers.tool_calls import ToolCallAssembler, take_tool_results
 from helpers.sentence_parser import stream_sentence_generator, chunk_text
+from helpers.tracing import LLM_FIRST_TOKEN, current_trace, render_metrics, start_tracing, tracer_get, trace_event, trace_span, traced_stream
 
-# Global config and client store
+# Global config, client store, the shared LLM client, the TTS cache and the TTS failover layer
 config = {}
-store = {}
+store = None
+llm_client = None
+tts_cache = None
+tts_failover = None
 
 # Configure logging
 logging.basicConfig(
@@ -24,36 +45,175 @@ logging.basicConfig(
 )
 logger = logging.getLogger()
 
+def create_llm_client(cfg: dict):
+    """
+    Creates a long-lived async OpenAI client with a pooled HTTP connection.
+    It is shared by all requests, so streaming a completion never blocks the event loop
+    and we don't pay for a new TLS handshake on every call.
+    """
+    max_connections = cfg["main"]["llm_max_connections"]
+    return openai.AsyncOpenAI(
+        api_key=cfg["main"]["openai_api_key"],
+        base_url=cfg["main"]["llm_base_url"],
+        http_client=openai.DefaultAsyncHttpxClient(
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+        ),
+    )
+
+def llm_client_get():
+    """
+    Returns the shared LLM client
+    """
+    global llm_client
+    return llm_client
+
+def tts_cache_get():
+    """
+    Returns the TTS cache
+    """
+    global tts_cache
+    return tts_cache
+
+def tts_failover_get():
+    """
+    Returns the TTS failover layer
+    """
+    global tts_failover
+    return tts_failover
+
+def load_prewarm_phrases(cfg: dict):
+    """
+    Reads the phrases to pre-warm the TTS cache with, one per line.
+    """
+    path = cfg["tts_cache"]["prewarm_file"]
+    if not path:
+        return []
+    with open(path, 'r') as f:
+        return [line.strip() for line in f if line.strip()]
+
+async def warm_up(cfg: dict):
+    """
+    Does what the first request would otherwise pay for: segments a dummy response (which loads ICU and regex),
+    connects to the LLM and TTS hosts and waits for the encoder pool to start its encoders for `encoder_formats`.
+    Gives up after `timeout_seconds`, whatever is not warm yet is done on the first request.
+    """
+    warmup_cfg = cfg["warmup"]
+    start = time.monotonic()
+    async for _ in stream_sentence_generator(chunk_text("Warming up, Mr. Smith. The lights are on! Is the door locked?"), **cfg["sentence_parser"]):
+        pass
+
+    async def connect_llm():
+        try:
+            await llm_client.models.list()
+        except Exception as e:
+            logger.warning(f"Could not warm up the LLM connection: {e}")
+
+    input_format = tts_output_format(cfg)
+    encoders = [encoder_pool_get().warm(input_format, output_format) for output_format in warmup_cfg["encoder_formats"] if not encodes_in_process(input_format, output_format)]
+    try:
+        await asyncio.wait_for(asyncio.gather(connect_llm(), warm_up_tts_engines(logger), *encoders), warmup_cfg["timeout_seconds"])
+    except asyncio.TimeoutError:
+        logger.warning(f"WARM-UP TIMED OUT after {warmup_cfg['timeout_seconds']}s")
+        return
+    logger.info(f"WARM-UP DONE in {time.monotonic() - start:.2f}s")
+
+def worker_config(cfg: dict):
+    """
+    Returns the configuration of this worker process. The admission lanes, the encoder pool, the render slots
+    and the memory tier of the TTS cache live in each worker process, while their limits in the configuration
+    are for the whole server, so with several workers each of them gets its share.
+    """
+    workers = cfg["main"]["workers"]
+    if workers == 1:
+        return cfg
+    def share(limit):
+        return max(1, limit // workers) if limit else limit
+    cfg = copy.deepcopy(cfg)
+    for lane_cfg in cfg["admission"]["lanes"].values():
+        for key in ("max_concurrent", "rate_per_minute"):
+            if lane_cfg.get(key):
+                lane_cfg[key] = share(lane_cfg[key])
+    cfg["encoder_pool"]["max_processes"] = share(cfg["encoder_pool"]["max_processes"])
+    cfg["encoder_pool"]["warm_size"] = min(cfg["encoder_pool"]["warm_size"], cfg["encoder_pool"]["max_processes"])
+    cfg["render"]["max_concurrent"] = share(cfg["render"]["max_concurrent"])
+    cfg["tts_cache"]["memory_max_bytes"] = share(cfg["tts_cache"]["memory_max_bytes"])
+    return cfg
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Creates the session store, the shared LLM and TTS clients, the admission control, the TTS cache, the encoder pool and the tracer on startup and closes them on shutdown.
+    With several workers, each gets its share of the limits (see `worker_config`).
+    The warm-up and the TTS cache pre-warm run in the background, so they do not delay the startup.
+    """
+    global config, store, llm_client, tts_cache, tts_failover
+    if not config:
+        # Worker processes import this module without running __main__, so they load the config here
+        config = load_config()
+    cfg = worker_config(config_get())
+    store = create_session_store(cfg["session_store"])
+    llm_client = create_llm_client(cfg)
+    start_tts_engines(cfg)
+    start_admission(cfg, logger)
+    tts_cache = TTSCache(cfg["tts_cache"], admitted_tts(tts_stream), logger)
+    tts_failover = FailoverTTS(cfg["failover"], tts_cache, logger)
+    start_encoder_pool(cfg, logger)
+    start_tracing(cfg)
+    start_renderer(cfg, logger)
+
+    warm_up_task = asyncio.create_task(warm_up(cfg)) if cfg["warmup"]["enabled"] else None
+    prewarm_task = asyncio.create_task(tts_cache.prewarm(load_prewarm_phrases(cfg), cfg)) if tts_cache.enabled else None
+    yield
+    for task in (warm_up_task, prewarm_task):
+        if task:
+            task.cancel()
+    cancel_speculative_streams()
+    cancel_broadcasts()
+    cancel_resumable_streams()
+    renderer_get().close()
+    await stop_encoder_pool()
+    await close_tts_engines()
+    await llm_client.close()
+    llm_client = None
+    store.close()
+
 # Initialize API
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
-def store_get(client_id: str):
+async def store_get(client_id: str):
     """
     Returns store for a given client based on its id
     """
     global store
-    return store[client_id] if client_id in store else {}
+    return await store.get(client_id)
 
-def store_put(client_id: str, data: dict):
+async def store_put(client_id: str, data: dict):
     """
     Writes store for a given client based on its id
     """
     global store
-    store[client_id] = data
-    return store[client_id]
+    return await store.put(client_id, data)
 
-def get_client_events(client_id: str):
+async def store_update(client_id: str, change):
     """
-    Returns (preload_event, play_event) for the given client_id,
-    creating them if they don't yet exist in store[client_id].
+    Changes the store of a given client atomically, see `SessionStore.update`. Returns what `change` returns.
     """
-    client_store = store_get(client_id)
-    if "preload_event" not in client_store:
-        client_store["preload_event"] = Event()
-    if "play_event" not in client_store:
-        client_store["play_event"] = Event()
-    store_put(client_id, client_store)
-    return client_store["preload_event"], client_store["play_event"]
+    global store
+    return await store.update(client_id, change)
+
+async def signal_client(client_id: str, name: str):
+    """
+    Sets a signal ("preload" or "play") for the given client_id. It can be awaited by any worker process.
+    """
+    global store
+    await store.signal(client_id, name)
+
+async def wait_for_client(client_id: str, name: str):
+    """
+    Waits until a signal ("preload" or "play") is set for the given client_id and clears it.
+    """
+    global store
+    await store.wait(client_id, name)
   
 def config_get():
     """
@@ -90,13 +250,15 @@ def load_config():
             openai.api_key = cfg["main"]["openai_api_key"]
         except KeyError as e:
           raise Exception("You need to provide an OpenAI API key in your configuration.json") from e
+        # The secondary (failover) engine needs its credentials too
+        engines = {cfg["main"]["tts_engine"], cfg.get("failover", {}).get("secondary_engine")}
         try:
-            if cfg["main"]["tts_engine"]=="google_cloud" and not cfg["google_cloud"]["credentials_path"]:
+            if "google_cloud" in engines and not cfg["google_cloud"]["credentials_path"]:
                 raise Exception("You need to provide a Google Cloud credentials path in your configuration.json")
         except KeyError as e:
             raise Exception("You need to provide a Google Cloud credentials path in your configuration.json") from e
         try:
-            if cfg["main"]["tts_engine"]=="elevenlabs" and not cfg["elevenlabs"]["api_key"]:
+            if "elevenlabs" in engines and not cfg["elevenlabs"]["api_key"]:
                 raise Exception("You need to provide an ElevenLabs API key in your configuration.json")
         except KeyError as e:
             raise Exception("You need to provide an ElevenLabs API key in your configuration.json") from e
@@ -128,28 +290,25 @@ async def llm_stream(cfg: str, prompt: str, llm_config: dict, client_id: str):
     """
     Streams responses from OpenAI's GPT-4. 
     If tool calls are in the response, calls them, waits for Home Assistant response and re-calls the API if needed.
+    With "stream_tool_calls" in the llm config, each tool call is handed to /preload as soon as its arguments are complete.
     """
-    messages = None
-    client_store = store_get(client_id)
-    if "messages" in client_store:
-      messages = client_store["messages"]
-      
-    if messages is None:
-        # Check if messages were provided in the llm config
-        messages = (
-            json.loads(llm_config["messages"])
-            if llm_config and "messages" in llm_config
-            else [
-                {"role": "system", "content": cfg["main"]["llm_system_prompt"]}, {"role": "user", "content": prompt},
-            ]
-        )
-        client_store["messages"] = messages
-        store_put(client_id, client_store)
-
-    client = openai.OpenAI(api_key=cfg["main"]["openai_api_key"])
+    def start_history(client_store: dict):
+        if "messages" not in client_store:
+            # Check if messages were provided in the llm config
+            client_store["messages"] = (
+                json.loads(llm_config["messages"])
+                if llm_config and "messages" in llm_config
+                else [
+                    {"role": "system", "content": cfg["main"]["llm_system_prompt"]}, {"role": "user", "content": prompt},
+                ]
+            )
+    await store_update(client_id, start_history)
+
+    client = llm_client_get()
     
     max_iterations = 10
     iteration_count = 0
+    stream_tool_calls = bool(llm_config and llm_config.get("stream_tool_calls"))
     
     # The loop below:
     # 1. Calls LLM with the provided prompt
@@ -158,102 +317,133 @@ async def llm_stream(cfg: str, prompt: str, llm_config: dict, client_id: str):
     # This continues until the LLM returns text with no tool calls.
     # It will run once for simple requests and several times (up to 10) for tool calls.
     while iteration_count < max_iterations:
-        tool_calls = {}  # Dictionary to store tool calls by index
+        tool_calls = ToolCallAssembler()
         full_response = ""
-        client_store = store_get(client_id)
-        messages = client_store["messages"]
+
+        def start_iteration(client_store: dict):
+            client_store["released_tool_calls"] = []
+            messages = client_store["messages"]
+            # Fail-safe in case we did not get tool_call response and try to issue a new command.
+            # This might happen if TTMG Server or HASS crashes mid-response for some reason.
+            # The happy flow never hits this code block.
+            failsafe = "tool_calls" in messages[-2] and messages[-1]['role']=='user'
+            if failsafe:
+              messages.pop(-2)
+            # Keep the history (and so the prompt size and latency) within the budget
+            dropped = compact_history(messages, cfg["session_store"]["history_max_turns"], cfg["session_store"]["history_max_tokens"])
+            return list(messages), failsafe, dropped
+
+        messages, failsafe, dropped = await store_update(client_id, start_iteration)
         logger.info("CALLING LLM")
-        
-        # Fail-safe in case we did not get tool_call response and try to issue a new command.
-        # This might happen if TTMG Server or HASS crashes mid-response for some reason.
-        # The happy flow never hits this code block.
-        if "tool_calls" in messages[-2] and messages[-1]['role']=='user':
+        if failsafe:
           logger.info("FAILSAFE TRIGGERED, FIXING HISTORY (DO NOT WORRY)")
-          client_store["messages"].pop(-2)
-          store_put(client_id, client_store)
+        if dropped:
+          logger.info(f"HISTORY COMPACTED: dropped {dropped} old messages")
 
+        max_completion_tokens = llm_config["max_completion_tokens"] if llm_config and "tools" in llm_config else cfg["main"]["max_completion_tokens"]
+        # The prompt is charged up front, the answer token by token
         try:
-            completion = client.chat.completions.create(
+            ticket = await admission_get().admit("llm", sum(estimate_tokens(message) for message in messages))
+        except Overloaded as e:
+            logger.error(f"LLM call shed: {e}")
+            return
+        llm_start = time.monotonic()
+        span = trace_span("llm", iteration=iteration_count)
+        try:
+            completion = await client.chat.completions.create(
                 model=llm_config["model"] if llm_config else cfg["main"]["llm_model"],
                 messages=messages,
                 tools=json.loads(llm_config["tools"]) if llm_config and "tools" in llm_config else None,
                 temperature=llm_config["temperature"] if llm_config and "tools" in llm_config else cfg["main"]["temperature"],
                 top_p= llm_config["top_p"] if llm_config and "tools" in llm_config else cfg["main"]["top_p"],
-                max_completion_tokens= llm_config["max_completion_tokens"] if llm_config and "tools" in llm_config else cfg["main"]["max_completion_tokens"],
+                max_completion_tokens=max_completion_tokens,
                 stream=True,
             )
         except openai.OpenAIError as e:
             logger.error(f"OpenAI API error: {e}")
+            span.end(status="error")
+            ticket.release()
             return
         except Exception as e:
             logger.error(f"Unexpected error: {e}")
+            span.end(status="error")
+            ticket.release()
             return
+        except asyncio.CancelledError:
+            span.end(status="cancelled")
+            ticket.release()
+            raise
 
         # --- STREAM THE RESPONSE ---
-        for chunk in completion:
-            if chunk.choices:
-                delta = chunk.choices[0].delta
-                
-                # Handle streaming text
-                new_content = delta.content
-                if new_content:
-                    logger.info("Getting LLM response...")
-                    full_response += new_content
-                    yield new_content
-
-                # Handle tool calls
-                if delta.tool_calls:
-                    for tool_call in delta.tool_calls:
-                        index = tool_call.index
-                        if index not in tool_calls:
-                            tool_calls[index] = {
-                                "id": tool_call.id,
-                                "name": tool_call.function.name,
-                                "arguments": "",
-                            }
-                        tool_calls[index]["arguments"] += tool_call.function.arguments
+        # If the listener goes away, we are cancelled (or closed) mid-stream.
+        # Closing the completion then stops the LLM from generating the rest of the answer.
+        tokens = 0
+        completed = False
+        try:
+            async for chunk in completion:
+                if chunk.choices:
+                    if not tokens:
+                        LLM_FIRST_TOKEN.observe(time.monotonic() - llm_start)
+                        span.mark("first_token")
+                        logger.info(f"Getting LLM response... first token after {time.monotonic() - llm_start:.2f}s")
+                    tokens += 1
+                    ticket.charge(1)
+                    delta = chunk.choices[0].delta
+
+                    # Handle streaming text
+                    new_content = delta.content
+                    if new_content:
+                        full_response += new_content
+                        yield new_content
+
+                    # Handle tool calls
+                    if delta.tool_calls:
+                        for tool_call in tool_calls.add(delta.tool_calls):
+                            if stream_tool_calls:
+                                # Hand the complete tool call to /preload, so Home Assistant can run it right away
+                                logger.info(f"TOOL CALL READY: {tool_call['function']['name']}")
+                                trace_event("tool_call_ready", tool=tool_call["function"]["name"])
+                                await store_update(client_id, lambda client_store: client_store.setdefault("released_tool_calls", []).append(tool_call))
+                                await signal_client(client_id, "tool_call")
+            completed = True
+        finally:
+            span.end(tokens=tokens, status="ok" if completed else "cancelled")
+            if not completed:
+                await completion.close()
+                logger.info(f"LLM CANCELLED: stopped after {tokens} tokens, up to {max_completion_tokens - tokens} tokens not generated")
+            ticket.release()
 
         # Add the full response as a single message (if it has any content)
         if full_response.strip():
-            messages.append({"role": "assistant", "content": full_response.strip()})
-            client_store = store_get(client_id)
-            client_store["messages"] = messages
-            store_put(client_id, client_store)
+            response_message = {"role": "assistant", "content": full_response.strip()}
+            await store_update(client_id, lambda client_store: client_store["messages"].append(response_message))
 
         # If there are tool calls, add them to messages
-        if tool_calls:
-            for tcall in tool_calls.values():
-                try:
-                    # Modify the tool calls to the required standard
-                    tcall["function"] = {
-                        "name": tcall["name"],
-                        "arguments": tcall["arguments"],
-                    }
-                    tcall["type"] = "function"
-                    del tcall["arguments"]
-                    del tcall["name"]
-                except json.JSONDecodeError:
-                    logger.error(f"Error parsing JSON for tool (index={tcall}): {tcall['arguments']}")
-
-            final_tool_calls = list(tool_calls.values())
-            messages.append({"role": "assistant", "tool_calls": final_tool_calls})
-            
+        final_tool_calls = tool_calls.tool_calls()
+        if final_tool_calls:
             # Store the messages and tool_calls
-            client_store = store_get(client_id)
-            client_store["messages"] = messages
-            client_store["tool_commands"] = final_tool_calls
-            store_put(client_id, client_store)
+            def add_tool_calls(client_store: dict):
+                client_store["messages"].append({"role": "assistant", "tool_calls": final_tool_calls})
+                client_store["tool_commands"] = final_tool_calls
+                # With streamed tool calls, Home Assistant may have sent all the results already
+                results = take_tool_results(client_store["messages"], client_store.get("pending_tool_results", []))
+                if results:
+                    client_store["messages"].extend(results)
+                    client_store["pending_tool_results"] = []
+                return results
+            results = await store_update(client_id, add_tool_calls)
             
             # We signal that we are done and unblock the /preload endpoint.
             # This will return tool_calls to TTMG Conversation integration for Home Assistant.
             logger.info("GOT TOOLS RESPONSE, RUNNING A PROMPT TO GENERATE SPEECH RESPONSE")
-            preload_event, play_event = get_client_events(client_id)
-            preload_event.set()
+            await signal_client(client_id, "tool_call" if stream_tool_calls else "preload")
             
             # Now we wait for TTMG Conversation to call the tools
             # and append the response to the message history.
-            await play_event.wait()
-            play_event.clear()
+            if not results:
+                wait_span = trace_span("tool_call_wait", tool_calls=len(final_tool_calls))
+                await wait_for_client(client_id, "play")
+                wait_span.end()
 
             # With the tool calls response, we can re-run LLM to generate a nice output text.
         else:
@@ -263,33 +453,63 @@ async def llm_stream(cfg: str, prompt: str, llm_config: dict, client_id: str):
 
 async def audio_streamer(text: str, cfg: dict, client_id: str, llm_config=None, file_path: str = os.devnull):
     """
-    Takes the user text, splits into sentences, calls TTS for each one,
-    and yields the raw audio data in chunks. Also saves to 'file_path' (if desired).
+    Takes the user text, splits into sentences, synthesizes upcoming sentences in parallel
+    and yields the raw audio data in chunks, in sentence order. Also saves to 'file_path' (if desired).
     """
     if text is not None and text.strip() != "":
       async with aiofiles.open(file_path, 'wb') as f:
-          async for sentence in stream_sentence_generator(chunk_text(text)):
-              if sentence.strip():
-                  logger.info(f"TTS {cfg['main']['tts_engine'].upper()} => {sentence}")
-                  async for audio_chunk in tts_stream(sentence, cfg, logger):
-                      await f.write(audio_chunk)
-                      yield audio_chunk
+          pacing = start_pacing(cfg["pacing"], tts_output_format(cfg))
+          sentences = (sentence async for sentence in stream_sentence_generator(chunk_text(text), **cfg["sentence_parser"], pacing=pacing) if sentence.strip())
+          audio_source = tts_pipeline(sentences, cfg, logger, tts_failover_get().stream)
+          async with aclosing(pacing.rechunk(audio_source) if pacing else audio_source) as audio_chunks:
+              async for audio_chunk in audio_chunks:
+                  await f.write(audio_chunk)
+                  yield audio_chunk
+          if pacing:
+              logger.info(f"PACING: {pacing.summary()}")
     
 async def prompt_audio_streamer(prompt: str, cfg: dict, client_id: str, llm_config: dict, file_path: str = os.devnull):
   """
   Runs LLM prompt and streams the response in real time.
-  Takes the streaming response, splits into sentences, calls TTS for each one,
-  and yields the raw MP3 data in chunks. Also saves to 'file_path' (if desired).
+  Takes the streaming response, splits into sentences, synthesizes upcoming sentences in parallel
+  and yields the raw audio data in chunks, in sentence order. Also saves to 'file_path' (if desired).
+  If the engine is in the text streaming mode, the tokens go straight into one TTS session instead.
+  If we are closed early, the TTS pipeline and then the LLM stream are closed too.
   """
-  collected_text = ""
-  async with aiofiles.open(file_path, 'wb') as f:
-      async for sentence in stream_sentence_generator(llm_stream(cfg, prompt, llm_config, client_id)):
-          if sentence.strip() !=".":
-            logger.info(f"TTS {config['main']['tts_engine'].upper()}: {sentence}")
-            async for audio_chunk in tts_stream(sentence, cfg, logger):
-                await f.write(audio_chunk)
-                yield audio_chunk
+  async with aiofiles.open(file_path, 'wb') as f, aclosing(llm_stream(cfg, prompt, llm_config, client_id)) as tokens:
+      pacing = start_pacing(cfg["pacing"], tts_output_format(cfg))
+      if text_streaming_enabled(cfg):
+          logger.info(f"TTS {cfg['main']['tts_engine'].upper()}: streaming LLM tokens")
+          audio_source = admitted_tts_text(tts_text_stream)(tokens, cfg, logger)
+      else:
+          sentences = (sentence async for sentence in stream_sentence_generator(tokens, **cfg["sentence_parser"], pacing=pacing) if sentence.strip() != ".")
+          audio_source = tts_pipeline(sentences, cfg, logger, tts_failover_get().stream)
+      async with aclosing(pacing.rechunk(audio_source) if pacing else audio_source) as audio_chunks:
+          async for audio_chunk in audio_chunks:
+              await f.write(audio_chunk)
+              yield audio_chunk
+      if pacing:
+          logger.info(f"PACING: {pacing.summary()}")
   
+def encoded_audio_stream(audio_source_function, audio_format: str, prompt: str, cfg: dict, client_id: str, llm_config=None):
+  """
+  Returns the audio stream in the requested format.
+  TTS output (raw PCM) is streamed as is for "pcm", encoded in-process for FLAC and WAV, and with ffmpeg otherwise.
+  """
+  if tts_output_format(cfg)["codec"] == audio_format:
+    return audio_source_function(prompt, cfg, client_id, llm_config)
+  return stream_encoded_from_audio_source(audio_source_function, prompt, cfg, client_id, llm_config, audio_format)
+
+def reject_if_overloaded(cfg: dict, llm: bool = False):
+  """
+  Turns background work (announcements, renders) away with a 503 while the TTS engine (and the LLM) are overloaded,
+  instead of queueing it behind the voice turns. Call it from the handler, the request then runs at the background priority.
+  """
+  lanes = [cfg["main"]["tts_engine"]] + (["llm"] if llm else [])
+  if admission_get().overloaded(*lanes):
+    raise HTTPException(status_code=503, detail="Overloaded, try again later", headers={"Retry-After": str(cfg["admission"]["shed_wait_seconds"])})
+  current_priority.set("background")
+
 @app.post("/preload-text/{client_id}")
 async def preload_text(client_id: str,  request: Request):
     """
@@ -301,17 +521,40 @@ async def preload_text(client_id: str,  request: Request):
     if not text:
         raise HTTPException(status_code=400, detail="Text is required")
 
-    client_store = store_get(client_id)
-    client_store["preloaded_text"]= text
-    store_put(client_id, client_store)
+    await store_update(client_id, lambda client_store: client_store.update(preloaded_text=text))
     
-    logger.info(f"NEW PRELOADED TEXT: {client_store['preloaded_text']}")
+    logger.info(f"NEW PRELOADED TEXT: {text}")
     response_data = {
         "status": "ok",
         "msg": "Text preloaded successfully.",
     }
     return JSONResponse(content=response_data)
   
+def take_tool_commands(client_store: dict):
+    """
+    Returns the tool calls released so far and the full list of tool calls once the LLM is done with them, which is cleared.
+    """
+    tools_request = client_store.get("tool_commands")
+    client_store["tool_commands"] = None
+    return list(client_store.get("released_tool_calls", [])), tools_request
+
+async def tool_call_events(client_id: str, messages: list):
+    """
+    Yields a JSON line {"tool_call": ...} for each tool call as soon as it is complete,
+    then a last line with all tool calls, like the regular /preload response.
+    """
+    sent = 0
+    while True:
+        await wait_for_client(client_id, "tool_call")
+        released, tools_request = await store_update(client_id, take_tool_commands)
+        for tool_call in released[sent:]:
+            yield json.dumps({"tool_call": tool_call}) + "\n"
+        sent = len(released)
+
+        if tools_request:
+            yield json.dumps({"status": "ok", "msg": "Text preloaded successfully.", "tool_calls": tools_request, "messages": messages}) + "\n"
+            return
+
 @app.post("/preload/{client_id}")
 async def preload_llm_config(client_id: str, request: Request):
     """
@@ -320,6 +563,7 @@ async def preload_llm_config(client_id: str, request: Request):
     """
     data = await request.json()
     messages = json.loads(data.get("messages", "[]"))
+    stream_tool_calls = data.get("stream_tool_calls", False)
     tools = data.get("tools", "")
     max_completion_tokens = data.get("max_completion_tokens", "")
     top_p = data.get("top_p", "")
@@ -330,26 +574,30 @@ async def preload_llm_config(client_id: str, request: Request):
 
     logger.info(f"GOT USER MESSAGE: {messages[-1]['content']}")
 
-    client_store = store_get(client_id)
-    client_store["messages"] = messages
-    client_store["preloaded_llm_config"] = {"messages": messages, "tools": tools, "max_completion_tokens":max_completion_tokens, "top_p":top_p, "temperature":temperature, "model": model  }
-    store_put(client_id, client_store)
-
-    # Now we have our llm config with tools and messages ready. 
-    # We wait for the /play endpoint to trigger LLM pipeline with this config.
-    # It will call preload_event.set() when it has the full response.
-    preload_event, play_event = get_client_events(client_id)
-    await preload_event.wait()
-    preload_event.clear()
+    preloaded_llm_config = {"messages": messages, "tools": tools, "max_completion_tokens":max_completion_tokens, "top_p":top_p, "temperature":temperature, "model": model, "stream_tool_calls": stream_tool_calls }
+    await store_update(client_id, lambda client_store: client_store.update(messages=messages, preloaded_llm_config=preloaded_llm_config, pending_tool_results=[]))
+
+    # Now we have our llm config with tools and messages ready.
+    # We start the LLM-TTS pipeline right away and buffer its audio until the device opens /play,
+    # so we don't wait for the round-trip from Home Assistant to the device.
+    # With several workers /play may land in another process, so there the pipeline starts with /play.
+    config = config_get()
+    if config["speculative"]["enabled"] and config["main"]["workers"] == 1:
+        tracer_get().start("speculative", client_id)
+        start_speculative_stream(client_id, prompt_audio_streamer(None, config, client_id, preloaded_llm_config), config["speculative"], logger)
+
+    # In the streaming mode, tool calls are sent one per line as soon as each of them is complete
+    if stream_tool_calls:
+        return StreamingResponse(tool_call_events(client_id, messages), media_type="application/x-ndjson")
+
+    # The pipeline will set the "preload" signal when it has the full response.
+    await wait_for_client(client_id, "preload")
     
     # We have the full response now, so we return 
     # the updated messages history and the tool_calls to Home Assistant.
     # This will allow it to run the tools and append the results to the messages history.
     # Updated messages will come via the /write_history endpoint.
-    client_store = store_get(client_id)
-    tools_request = client_store["tool_commands"]
-    client_store["tool_commands"] = None
-    store_put(client_id, client_store)
+    _, tools_request = await store_update(client_id, take_tool_commands)
     response_data = {
         "status": "ok",
         "msg": "Text preloaded successfully.",
@@ -358,36 +606,162 @@ async def preload_llm_config(client_id: str, request: Request):
     }
     return JSONResponse(content=response_data)
 
-@app.get("/tts_say/{client_id}.flac")
-async def tts(client_id: str, request: Request):
-    """Processes a long text through TTS sentence by sentence and returns an audio stream in real time."""
+@app.get("/tts_say/{client_id}.{audio_format}")
+async def tts(client_id: str, audio_format: str, request: Request):
+    """Processes a long text through TTS sentence by sentence and returns an audio stream (flac, mp3, wav, pcm or opus) in real time."""
+    if audio_format not in OUTPUT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unknown audio format: {audio_format}")
     config = config_get()
-    client_store = store_get(client_id)
+    reject_if_overloaded(config)
+    trace = tracer_get().start("tts_say", client_id)
+    client_store = await store_get(client_id)
     preloaded_text = client_store["preloaded_text"] if "preloaded_text" in client_store else None
 
-    # Call a function to run LLM-TTS pipeline that returns a flac stream
-    flac_stream = stream_flac_from_audio_source(audio_streamer, preloaded_text, config, client_id)
+    # Call a function to run LLM-TTS pipeline that returns an audio stream
+    audio_stream = encoded_audio_stream(audio_streamer, audio_format, preloaded_text, config, client_id)
 
     return StreamingResponse(
-        flac_stream,
-        media_type="audio/flac",
-        headers={"Content-Disposition": f'inline; filename="{client_id}.flac"'}     # Content-Disposition so the browser sees it as a .flac file
+        stream_until_disconnect(traced_stream(audio_stream, trace, audio_format != tts_output_format(config)["codec"]), client_id, logger),
+        media_type=media_type(audio_format, tts_output_format(config)),
+        headers={"Content-Disposition": f'inline; filename="{client_id}.{audio_format}"'}     # Content-Disposition so the browser sees it correctly
     )
       
+@app.post("/broadcast/{broadcast_id}")
+async def preload_broadcast(broadcast_id: str, request: Request):
+    """
+    Accepts JSON {"text": "..."} for an announcement that many devices play at once from /broadcast/<broadcast_id>.<format>.
+    """
+    data = await request.json()
+    text = data.get("text", "")
+    if not text:
+        raise HTTPException(status_code=400, detail="Text is required")
+
+    def set_text(broadcast_store: dict):
+        changed = broadcast_store.get("text") != text
+        broadcast_store["text"] = text
+        return changed
+    if await store_update(f"broadcast:{broadcast_id}", set_text):
+        # A new announcement, the audio of the previous one is not needed anymore
+        cancel_broadcasts(broadcast_id)
+
+    logger.info(f"NEW BROADCAST {broadcast_id}: {text}")
+    response_data = {
+        "status": "ok",
+        "msg": "Broadcast preloaded successfully.",
+    }
+    return JSONResponse(content=response_data)
+
+@app.get("/broadcast/{broadcast_id}.{audio_format}")
+async def play_broadcast(broadcast_id: str, audio_format: str, request: Request):
+    """
+    Streams an announcement (flac, mp3, wav, pcm or opus) to any number of devices.
+    It is synthesized and encoded once per format, every device gets the same audio from the start, even if it joins late.
+    """
+    if audio_format not in OUTPUT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unknown audio format: {audio_format}")
+    config = config_get()
+    text = (await store_get(f"broadcast:{broadcast_id}")).get("text")
+    if not text:
+        raise HTTPException(status_code=404, detail="No text for this broadcast, send it to POST /broadcast/<broadcast_id> first")
+    trace = tracer_get().start("broadcast", broadcast_id)
+
+    def start_source():
+        """Runs the TTS pipeline once for all listeners. It starts in the trace of the first listener."""
+        reject_if_overloaded(config)
+        return encoded_audio_stream(audio_streamer, audio_format, text, config, broadcast_id)
+
+    broadcast, started = get_broadcast(broadcast_id, text, audio_format, start_source, config["broadcast"], logger)
+    if not started:
+        trace.event("broadcast_joined", buffered_bytes=broadcast.size)
+
+    return StreamingResponse(
+        stream_until_disconnect(traced_stream(broadcast.listen(), trace, started and audio_format != tts_output_format(config)["codec"]), broadcast_id, logger),
+        media_type=media_type(audio_format, tts_output_format(config)),
+        headers={"Content-Disposition": f'inline; filename="{broadcast_id}.{audio_format}"'}
+    )
+
+@app.post("/render")
+async def render(request: Request):
+    """
+    Accepts JSON {"text": "..."} or {"prompt": "..."}, with an optional "format" (flac, mp3, wav, pcm or opus, default flac)
+    and "id". Renders the audio to disk in the background and returns the job. Once it is done, /render/<id>.<format> plays it.
+    """
+    data = await request.json()
+    text = data.get("text")
+    prompt = data.get("prompt")
+    audio_format = data.get("format", "flac")
+    job_id = data.get("id") or uuid.uuid4().hex
+    if not text and not prompt:
+        raise HTTPException(status_code=400, detail="Text or prompt is required")
+    if audio_format not in OUTPUT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unknown audio format: {audio_format}")
+    if not valid_job_id(job_id):
+        raise HTTPException(status_code=400, detail='The id can only have letters, digits, "-" and "_"')
+    previous = renderer_get().job(job_id)
+    if previous and previous["status"] in ("queued", "rendering"):
+        raise HTTPException(status_code=409, detail="This id is still rendering")
+
+    config = config_get()
+    reject_if_overloaded(config, llm=bool(prompt))
+    client_id = f"render:{job_id}"
+    tracer_get().start("render", client_id)
+    if text:
+        source = encoded_audio_stream(audio_streamer, audio_format, text, config, client_id)
+    else:
+        # A fresh conversation, not the one of the last render under this id
+        await store_put(client_id, {})
+        source = encoded_audio_stream(prompt_audio_streamer, audio_format, prompt, config, client_id)
+    job = renderer_get().submit(job_id, source, "text" if text else "prompt", audio_format)
+
+    logger.info(f"NEW RENDER {job_id}: {text or prompt}")
+    return JSONResponse(content={"status": "ok", "msg": "Render started.", "job": job, "url": f"/render/{job_id}.{audio_format}"}, status_code=202)
+
+@app.get("/render/{job_id}.{audio_format}")
+async def play_render(job_id: str, audio_format: str, request: Request):
+    """
+    Serves a rendered announcement from disk. Supports HTTP Range requests, so players can seek and resume.
+    """
+    renderer = renderer_get()
+    job = renderer.job(job_id)
+    if not job or job["format"] != audio_format:
+        raise HTTPException(status_code=404, detail="No such render")
+    path = renderer.audio_path(job)
+    if not os.path.exists(path):
+        raise HTTPException(status_code=409, detail=f"The render is {job['status']}")
+    renderer.touch(job)
+    response = FileResponse(
+        path,
+        media_type=media_type(audio_format, tts_output_format(config_get())),
+        headers={"Content-Disposition": f'inline; filename="{job_id}.{audio_format}"'}
+    )
+    response.chunk_size = renderer.chunk_size
+    return response
+
+@app.get("/render/{job_id}")
+async def get_render(job_id: str):
+    """
+    Returns the status of a render job.
+    """
+    job = renderer_get().job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="No such render")
+    return JSONResponse(content=job)
+
 @app.get("/play/{client_id}.{audio_format}")
 async def play(client_id: str, audio_format: str, request: Request):
     """
-    Endpoint for calling the LLM and streaming the TTS audio in flac or mp3 format.
+    Endpoint for calling the LLM and streaming the TTS audio in flac, mp3, wav, pcm or opus format.
     We use ?prompt= from the query string.
     Otherwise if llm config (tools + messages) was preloaded via /preload, we use that.
+    Otherwise the last stream of the client is resumed, if its connection dropped (see `resume_play`).
     """
-    if audio_format not in ["flac", "mp3"]:
-        raise Exception("Uknown audio format", audio_format)
+    if audio_format not in OUTPUT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unknown audio format: {audio_format}")
     config = config_get()
 
     # Get llm config and preloaded text
-    client_store = store_get(client_id)
-    hass_store = store_get("ttmg_tts")
+    client_store = await store_get(client_id)
+    hass_store = await store_get("ttmg_tts")
     preloaded_llm_config = client_store["preloaded_llm_config"] if "preloaded_llm_config" in client_store else None
     preloaded_text = hass_store["preloaded_text"] if "preloaded_text" in hass_store else None
     prompt = request.query_params.get("prompt", None)
@@ -396,45 +770,180 @@ async def play(client_id: str, audio_format: str, request: Request):
     # (for example, provided by TTMG TTS as a local agent response)
     if preloaded_text:
       # Clear the preloaded_text
-      hass_store["preloaded_text"]= None
-      store_put("ttmg_tts", hass_store)
+      await store_update("ttmg_tts", lambda hass_store: hass_store.update(preloaded_text=None))
+      trace = tracer_get().start("play", client_id)
 
       #  Call a function to run a TTS pipeline that returns an audio stream
-      if audio_format == "flac":
-        audio_stream = stream_flac_from_audio_source(audio_streamer, preloaded_text, config, client_id)
-      elif audio_format == "mp3":
-        audio_stream = audio_streamer(preloaded_text, config, client_id)
+      audio_stream = encoded_audio_stream(audio_streamer, audio_format, preloaded_text, config, client_id)
 
     # Handles the regular flow where we want to call the LLM 
     # and pipe the response into the TTS engine
     else:
+      # Attach to the pipeline /preload has already started, unless we got a prompt
+      speculative = None if prompt else take_speculative_stream(client_id)
+      if speculative and speculative.trace:
+          # Keep timing the turn from /preload, which is when the user stopped speaking
+          trace = speculative.trace
+          current_trace.set(trace)
+          trace.event("play_received", buffered_bytes=speculative.buffered)
+      elif not speculative and not prompt and not preloaded_llm_config and config["resumable"]["enabled"] and config["main"]["workers"] == 1:
+          # Nothing new to say: the device is probably reconnecting after its connection dropped
+          offset = requested_offset(request)
+          resumable = find_resumable_stream(client_id, audio_format, request.query_params.get("stream"), offset)
+          if resumable:
+              return resume_play(resumable, client_id, audio_format, offset, config)
+          if request.query_params.get("stream"):
+              raise HTTPException(status_code=404, detail="No such stream to resume")
+
+      if not speculative or not speculative.trace:
+          trace = tracer_get().start("play", client_id)
+
       # Use prompt query param, otherwise use provided llm config
-      if not preloaded_llm_config and not prompt:
+      if not preloaded_llm_config and not prompt and not speculative:
           prompt ="Say you have received no prompt."
       llm_config =None if prompt else preloaded_llm_config
       # Clear the preloaded_llm config
-      client_store["preloaded_llm_config"]= None
-      store_put(client_id, client_store)
+      await store_update(client_id, lambda client_store: client_store.update(preloaded_llm_config=None))
       
       # Call a function to run a LLM-TTS pipeline that returns an audio stream
-      if audio_format == "flac":
-        audio_stream = stream_flac_from_audio_source(prompt_audio_streamer, prompt, config, client_id, llm_config)
-      elif audio_format == "mp3":
-        audio_stream = prompt_audio_streamer(prompt, config, client_id, llm_config)
+      audio_source_function = speculative.audio_source if speculative else prompt_audio_streamer
+      audio_stream = encoded_audio_stream(audio_source_function, audio_format, prompt, config, client_id, llm_config)
+
+    headers = {"Content-Disposition": f'inline; filename="{client_id}.{audio_format}"'}     # Content-Disposition so the browser sees it correctly
+    # With several workers the device may reconnect to another worker, which does not have the stream
+    if config["resumable"]["enabled"] and config["main"]["workers"] == 1:
+        # Run the pipeline in the background and keep the end of its audio, so a dropped connection can resume
+        resumable = start_resumable_stream(client_id, audio_format, audio_stream, config["resumable"], logger)
+        audio_stream = resumable.listen(0)
+        headers["X-TTMG-Stream"] = resumable.id
 
     return StreamingResponse(
-        audio_stream,
-        media_type="audio/"+audio_format,
-        headers={"Content-Disposition": f'inline; filename="{client_id}.{audio_format}"'}     # Content-Disposition so the browser sees it correctly
+        stream_until_disconnect(traced_stream(audio_stream, trace, audio_format != tts_output_format(config)["codec"]), client_id, logger),
+        media_type=media_type(audio_format, tts_output_format(config)),
+        headers=headers
+    )
+
+def requested_offset(request: Request):
+    """
+    Returns the byte offset a device asks to resume at, with ?offset=<bytes> or a "Range: bytes=<offset>-" header, or None.
+    """
+    offset = request.query_params.get("offset")
+    range_header = request.headers.get("range", "")
+    if offset is None and range_header.startswith("bytes=") and range_header.endswith("-"):
+        offset = range_header[len("bytes="):-1]
+    try:
+        return int(offset) if offset is not None else None
+    except ValueError:
+        raise HTTPException(status_code=416, detail=f"Invalid offset: {offset}")
+
+def resume_play(resumable, client_id: str, audio_format: str, offset: int, config: dict):
+    """
+    Continues the last /play stream of a client from its buffer, without running the LLM or TTS again.
+    It starts at `offset` (see `requested_offset`), otherwise where the last connection stopped,
+    behind a new header for formats that have one. A stream that is still producing goes on to its end.
+    """
+    try:
+        start = resumable.start_offset(offset)
+    except ValueError as e:
+        raise HTTPException(status_code=416, detail=str(e))
+
+    trace = tracer_get().start("resume", client_id)
+    trace.event("stream_resumed", stream=resumable.id, offset=start, buffered_bytes=resumable.total - start)
+    logger.info(f"CLIENT {client_id} RESUMED STREAM {resumable.id} AT BYTE {start}")
+    headers = {
+        "Content-Disposition": f'inline; filename="{client_id}.{audio_format}"',
+        "X-TTMG-Stream": resumable.id,
+        "X-TTMG-Offset": str(start),
+    }
+    status_code = 200
+    if offset is not None and resumable.done:
+        # The length is only known once the stream is done, a running one answers with 200 and X-TTMG-Offset
+        status_code = 206
+        headers["Content-Range"] = f"bytes {start}-{resumable.total - 1}/{resumable.total}"
+    return StreamingResponse(
+        stream_until_disconnect(traced_stream(resumable.listen(offset), trace, False), client_id, logger),
+        status_code=status_code,
+        media_type=media_type(audio_format, tts_output_format(config)),
+        headers=headers
     )
   
+@app.get("/debug/tts_cache")
+async def get_tts_cache_stats():
+    """
+    Returns TTS cache hit/miss/byte counters.
+    """
+    return JSONResponse(content=tts_cache_get().stats())
+
+@app.get("/debug/tts_engines")
+async def get_tts_engine_stats():
+    """
+    Returns per-engine TTS latency percentiles, hedging budgets and circuit breaker state.
+    """
+    return JSONResponse(content=tts_failover_get().stats())
+
+@app.get("/debug/traces")
+async def get_traces(client_id: str = None):
+    """
+    Returns the timelines of the recent requests, newest first. ?client_id= returns only the ones of one client.
+    """
+    return JSONResponse(content=tracer_get().recent(client_id))
+
+@app.get("/metrics")
+async def get_metrics():
+    """
+    Returns latency histograms in the Prometheus text format.
+    """
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+@app.get("/debug/admission")
+async def get_admission_stats():
+    """
+    Returns the calls in flight, queue depth, longest wait, rate budget and shed counts of each upstream.
+    """
+    return JSONResponse(content=admission_get().stats())
+
+@app.get("/debug/broadcasts")
+async def get_broadcast_stats():
+    """
+    Returns the size and listener counts of the running and recently finished broadcasts.
+    """
+    return JSONResponse(content=broadcast_stats())
+
+@app.get("/debug/streams")
+async def get_stream_stats():
+    """
+    Returns the buffer positions of the resumable /play stream of each client.
+    """
+    return JSONResponse(content=resumable_stream_stats())
+
+@app.get("/debug/renders")
+async def get_render_stats():
+    """
+    Returns render job counts by status and the disk usage of the renders.
+    """
+    return JSONResponse(content=renderer_get().stats())
+
+@app.get("/debug/encoders")
+async def get_encoder_stats():
+    """
+    Returns encoder pool spawn counts and wait times.
+    """
+    return JSONResponse(content=encoder_pool_get().stats())
+
+@app.get("/debug/sessions")
+async def get_session_stats():
+    """
+    Returns session counts and evictions.
+    """
+    return JSONResponse(content=await store.stats())
+
 @app.get("/history/{client_id}")
 async def get_history(client_id: str):
     """
     Returns the history of messages as a JSON response.
     Used by the Home Assistant integration to provide tool_calls responses.
     """
-    client_store = store_get(client_id)
+    client_store = await store_get(client_id)
     return JSONResponse(content={"messages": client_store["messages"]})
 
 @app.post("/write_history/{client_id}")
@@ -442,17 +951,33 @@ async def write_history(client_id: str, request: Request):
     """
     Writes the messages history.
     Used by the Home Assistant integration to provide tool_calls responses.
+    Accepts either the full history as {"messages": [...]}, or the result of a single streamed tool call
+    as {"tool_result": {"tool_call_id": ..., "content": ...}}. The LLM continues once all results are in.
     """
     data = await request.json()
+    tool_result = data.get("tool_result")
+    if tool_result:
+        if "tool_call_id" not in tool_result:
+            raise HTTPException(status_code=400, detail='"tool_call_id" is required')
+        def add_tool_result(client_store: dict):
+            pending = client_store.get("pending_tool_results", []) + [{"role": "tool", **tool_result}]
+            results = take_tool_results(client_store.get("messages", []), pending)
+            if results:
+                client_store["messages"].extend(results)
+                pending = []
+            client_store["pending_tool_results"] = pending
+            return results
+        results = await store_update(client_id, add_tool_result)
+        if results:
+            await signal_client(client_id, "play")
+        return JSONResponse(content={"status": "ok", "msg": "Tool result stored."})
+
     messages = data.get("messages", [])
     if not messages:
         raise HTTPException(status_code=400, detail="Messages are required")
       
-    client_store = store_get(client_id)
-    client_store["messages"] = messages
-    store_put(client_id, client_store)
-    preload_event, play_event = get_client_events(client_id)
-    play_event.set()
+    await store_update(client_id, lambda client_store: client_store.update(messages=messages))
+    await signal_client(client_id, "play")
 
     response_data = {"status": "ok", "msg": "Messages history updated."}
     return JSONResponse(content=response_data)
@@ -460,4 +985,11 @@ async def write_history(client_id: str, request: Request):
 if __name__ == "__main__":
     import uvicorn
     config = load_config()
-    uvicorn.run(app, host=config["main"]["host"], port=config["main"]["port"])
+    workers = config["main"]["workers"]
+    if workers > 1:
+        if config["session_store"]["backend"] == "memory":
+            raise Exception('Set "backend" to "sqlite" in the "session_store" section of your configuration.json to run several workers')
+        # Each worker imports this module and loads the config in `lifespan`
+        uvicorn.run("main:app", host=config["main"]["host"], port=config["main"]["port"], workers=workers)
+    else:
+        uvicorn.run(app, host=config["main"]["host"], port=config["main"]["port"])
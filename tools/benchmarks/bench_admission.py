@@ -0,0 +1,99 @@
+"""
+Measures voice turns during a burst of announcements, against a TTS stand-in with a provider concurrency limit,
+with and without admission control.
+
+Starts a fake LLM, an OpenAI TTS stand-in that answers HTTP 429 over `--provider-limit` concurrent requests
+and the TTMG app. Plays `--announcements` long announcements through /tts_say at once, and `--turns` voice turns
+through /play shortly after. Reports the time to the first audio of the voice turns, how much of their audio
+arrived (against a turn played alone), the 429s of the provider and the announcements that arrived in full, short (sentences lost to 429s, or shed mid-way) or were turned away (503).
+
+Usage (from the repo root):
+    python -m tools.benchmarks.bench_admission
+    python -m tools.benchmarks.bench_admission --announcements 16 --provider-limit 4 --shed-queue-depth 8
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+import httpx
+
+import main
+from tools.benchmarks.bench_broadcast import ANNOUNCEMENT
+from tools.benchmarks.bench_load import FIRST_AUDIO_BYTES, PCM_BYTES_PER_SECOND
+from tools.benchmarks.bench_llm_concurrency import bench_config
+from tools.benchmarks.fake_servers import ServerThread, fake_openai_app, fake_tts_app
+
+async def play(client: httpx.AsyncClient, url: str, delay: float = 0.0):
+    """Plays an URL after `delay`. Returns (HTTP status, seconds to the first KB, bytes)."""
+    await asyncio.sleep(delay)
+    start = time.perf_counter()
+    first, received = None, 0
+    async with client.stream("GET", url) as response:
+        if response.status_code != 200:
+            return response.status_code, None, 0
+        async for chunk in response.aiter_bytes():
+            received += len(chunk)
+            if first is None and received >= FIRST_AUDIO_BYTES:
+                first = time.perf_counter() - start
+    return 200, first, received
+
+async def burst(app_url: str, announcements: int, turns: int, args):
+    """Plays the announcements and, `--turn-delay` later, the voice turns. Returns (announcement results, turn results)."""
+    async with httpx.AsyncClient(timeout=120, limits=httpx.Limits(max_connections=None)) as client:
+        text = " ".join([ANNOUNCEMENT] * args.repeat)
+        for i in range(announcements):
+            await client.post(f"{app_url}/preload-text/announce-{i}", json={"text": text})
+        plays = [play(client, f"{app_url}/tts_say/announce-{i}.{args.format}") for i in range(announcements)]
+        plays += [play(client, f"{app_url}/play/turn-{i}.{args.format}?prompt=Tell+me+a+story", args.turn_delay) for i in range(turns)]
+        results = await asyncio.gather(*plays)
+    return results[:announcements], results[announcements:]
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--format", choices=["wav", "pcm", "flac", "mp3", "opus"], default="flac")
+    parser.add_argument("--announcements", type=int, default=8)
+    parser.add_argument("--repeat", type=int, default=4, help="length of an announcement, in copies of a 3-sentence text")
+    parser.add_argument("--turns", type=int, default=4)
+    parser.add_argument("--turn-delay", type=float, default=0.3, help="seconds between the announcements and the voice turns")
+    parser.add_argument("--provider-limit", type=int, default=4, help="concurrent requests the TTS stand-in accepts")
+    parser.add_argument("--shed-queue-depth", type=int, default=None, help="overrides admission.shed_queue_depth")
+    parser.add_argument("--tts-latency", type=float, default=0.2)
+    parser.add_argument("--seconds-per-char", type=float, default=0.06)
+    parser.add_argument("--llm-port", type=int, default=18171)
+    parser.add_argument("--tts-port", type=int, default=18172)
+    parser.add_argument("--app-port", type=int, default=18170)
+    args = parser.parse_args()
+
+    main.logger.setLevel("CRITICAL")  # Rate-limited sentences are logged as errors
+    tts_app = fake_tts_app(latency=args.tts_latency, seconds_per_chunk=0.002, http_bytes_per_char=int(args.seconds_per_char * PCM_BYTES_PER_SECOND), max_concurrent=args.provider_limit)
+    tts_stats = tts_app.state.stats
+
+    with ServerThread(fake_openai_app(first_token_delay=0.3), args.llm_port) as llm, ServerThread(tts_app, args.tts_port) as tts:
+        main.config = bench_config(llm.url)
+        main.config["openai"]["base_url"] = f"{tts.url}/v1"
+        main.config["admission"]["lanes"]["openai"] = {"max_concurrent": args.provider_limit}
+        if args.shed_queue_depth is not None:
+            main.config["admission"]["shed_queue_depth"] = args.shed_queue_depth
+        with ServerThread(main.app, args.app_port) as app:
+            (_, _, announcement_bytes), = asyncio.run(burst(app.url, 1, 0, args))[0]
+            (_, alone_first, alone_bytes), = asyncio.run(burst(app.url, 0, 1, args))[1]
+            print(f"Alone, a voice turn has its first KB after {alone_first:.2f}s and {alone_bytes} bytes, an announcement has {announcement_bytes} bytes")
+            print(f"{'admission':<9} {'turn first KB p50/max s':>24} {'turn audio %':>13} {'provider 429s':>14} {'announcements full/short/503':>29}")
+            for enabled in (False, True):
+                main.config["admission"]["enabled"] = enabled
+                main.start_admission(main.config, main.logger)
+                rate_limited = tts_stats["rate_limited"]
+                announcements, turns = asyncio.run(burst(app.url, args.announcements, args.turns, args))
+                firsts = [first if first is not None else float("inf") for _, first, _ in turns]
+                audio = min(received for _, _, received in turns) / alone_bytes * 100
+                full = sum(received == announcement_bytes for _, _, received in announcements)
+                rejected = sum(status == 503 for status, _, _ in announcements)
+                print(
+                    f"{str(enabled):<9} {f'{statistics.median(firsts):.2f} / {max(firsts):.2f}':>24} {audio:>12.0f}% "
+                    f"{tts_stats['rate_limited'] - rate_limited:>14} "
+                    f"{f'{full} / {args.announcements - full - rejected} / {rejected}':>29}"
+                )
+
+if __name__ == "__main__":
+    main_cli()
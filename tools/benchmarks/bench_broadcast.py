@@ -0,0 +1,132 @@
+"""
+Compares an announcement played on N devices through /tts_say (one pipeline per device)
+with the same announcement through /broadcast (one pipeline for all devices).
+
+Runs the TTMG app in its own process against the stand-ins of bench_load.py and reports, per number of devices:
+the TTS requests and ffmpeg encoders the app used, its CPU time, the time to the first KB of audio
+(p50 and max over the devices) and whether every device got the same audio.
+Broadcast listeners join `--stagger` seconds apart, so the later ones start from the buffer.
+
+Usage (from the repo root):
+    python -m tools.benchmarks.bench_broadcast --devices 1 4 16
+    python -m tools.benchmarks.bench_broadcast --format flac --engine openai
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+import httpx
+
+from tools.benchmarks.bench_load import FIRST_AUDIO_BYTES, ProcessStats, app_config, serve_fakes
+from tools.benchmarks.bench_workers import CONFIG_ENV, wait_until_up
+
+ANNOUNCEMENT = (
+    "Someone is at the front door. "
+    "The package you were waiting for has been delivered and left on the porch. "
+    "Please pick it up before it starts raining this afternoon."
+)
+
+async def fetch(client: httpx.AsyncClient, url: str, delay: float):
+    """Plays an URL after `delay` seconds. Returns (seconds to the first KB, sha256 of the audio)."""
+    await asyncio.sleep(delay)
+    start = time.perf_counter()
+    first_audio, received, digest = None, 0, hashlib.sha256()
+    async with client.stream("GET", url) as response:
+        response.raise_for_status()
+        async for chunk in response.aiter_bytes():
+            received += len(chunk)
+            digest.update(chunk)
+            if first_audio is None and received >= FIRST_AUDIO_BYTES:
+                first_audio = time.perf_counter() - start
+    return first_audio, digest.hexdigest()
+
+def tts_requests(app_url: str):
+    """Counts the TTS requests of the app from its /metrics."""
+    metrics = httpx.get(f"{app_url}/metrics").text
+    return sum(int(line.rsplit(" ", 1)[1]) for line in metrics.splitlines() if line.startswith("ttmg_tts_first_audio_seconds_count"))
+
+async def announce(app_url: str, mode: str, devices: int, args):
+    """Plays the announcement on all devices. Returns [(first KB seconds, sha256)]."""
+    async with httpx.AsyncClient(timeout=60) as client:
+        if mode == "tts_say":
+            for i in range(devices):
+                await client.post(f"{app_url}/preload-text/device-{i}", json={"text": ANNOUNCEMENT})
+            urls = [(f"{app_url}/tts_say/device-{i}.{args.format}", 0.0) for i in range(devices)]
+        else:
+            await client.post(f"{app_url}/broadcast/doorbell", json={"text": ANNOUNCEMENT})
+            urls = [(f"{app_url}/broadcast/doorbell.{args.format}", i * args.stagger) for i in range(devices)]
+        return await asyncio.gather(*[fetch(client, url, delay) for url, delay in urls])
+
+def run(mode: str, devices: int, env: dict, args):
+    """Starts the app and plays the announcement once. Returns a result row."""
+    app_url = f"http://127.0.0.1:{args.app_port}"
+    app = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "tools.benchmarks.bench_workers:app", "--port", str(args.app_port), "--log-level", "warning"],
+        env=env,
+    )
+    try:
+        wait_until_up(app_url)
+        time.sleep(0.5)  # Let the warm-up finish
+        stats = ProcessStats(app.pid)
+        requests_before = tts_requests(app_url)
+        encoders_before = httpx.get(f"{app_url}/debug/encoders").json()["taken"]
+        cpu_start = stats.cpu_seconds()
+        results = asyncio.run(announce(app_url, mode, devices, args))
+        cpu = stats.cpu_seconds() - cpu_start
+        requests = tts_requests(app_url) - requests_before
+        encoders = httpx.get(f"{app_url}/debug/encoders").json()["taken"] - encoders_before
+    finally:
+        app.terminate()
+        app.wait()
+    first_audio = [first for first, _ in results]
+    return {
+        "tts_requests": requests,
+        "encoders": encoders,
+        "cpu_seconds": cpu,
+        "first_audio_p50": statistics.median(first_audio),
+        "first_audio_max": max(first_audio),
+        "same_audio": len({digest for _, digest in results}) == 1,
+    }
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--devices", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--format", choices=["wav", "pcm", "flac", "mp3", "opus"], default="mp3")
+    parser.add_argument("--engine", choices=["piper", "openai", "elevenlabs"], default="piper")
+    parser.add_argument("--stagger", type=float, default=0.05, help="seconds between broadcast listeners joining")
+    parser.add_argument("--tts-latency", type=float, default=0.1, help="seconds the stub TTS takes to start answering")
+    parser.add_argument("--tts-kbps", type=float, default=1536.0)
+    parser.add_argument("--seconds-per-char", type=float, default=0.06)
+    parser.add_argument("--llm-port", type=int, default=18141)
+    parser.add_argument("--tts-port", type=int, default=18142)
+    parser.add_argument("--app-port", type=int, default=18140)
+    args = parser.parse_args()
+    # Stand-in settings shared with bench_load, the LLM is not used
+    args.tokens_per_second, args.first_token_delay, args.story_repeat, args.tool_calls = 50.0, 0.3, 1, 0
+
+    logging.getLogger().setLevel("WARNING")
+    fakes = multiprocessing.Process(target=serve_fakes, args=(args,), daemon=True)
+    fakes.start()
+    env = {**os.environ, CONFIG_ENV: json.dumps(app_config(args))}
+    try:
+        print(f"{'devices':>7} {'mode':<9} {'tts requests':>12} {'encoders':>9} {'cpu s':>7} {'first KB p50 s':>15} {'first KB max s':>15} {'same audio':>11}")
+        for devices in args.devices:
+            for mode in ("tts_say", "broadcast"):
+                row = run(mode, devices, env, args)
+                print(
+                    f"{devices:>7} {mode:<9} {row['tts_requests']:>12} {row['encoders']:>9} {row['cpu_seconds']:>7.2f} "
+                    f"{row['first_audio_p50']:>15.3f} {row['first_audio_max']:>15.3f} {str(row['same_audio']):>11}"
+                )
+    finally:
+        fakes.terminate()
+
+if __name__ == "__main__":
+    main_cli()
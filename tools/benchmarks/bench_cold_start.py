@@ -0,0 +1,99 @@
+"""
+Measures the startup of the TTMG app and its first voice turn, with and without the warm-up phase.
+
+For each TTS engine, starts the app in a fresh process against local stand-ins for the LLM and the TTS
+engine (see bench_load.py) and reports: the seconds until it answers HTTP, its RSS once it has settled,
+and the time to the first audio of the first and of the second `/play` turn. Without the warm-up,
+the first turn also pays for loading ICU and regex and for the connections to the LLM and TTS hosts.
+The app is given `--settle` seconds after startup, like a server that is idle before its first request.
+It runs from cold_start_app.py, which does not import the stand-ins and their SDKs.
+
+Usage (from the repo root):
+    python -m tools.benchmarks.bench_cold_start
+    python -m tools.benchmarks.bench_cold_start --engines piper --runs 5
+"""
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+import httpx
+
+from tools.benchmarks.bench_load import app_config, device, serve_fakes
+from tools.benchmarks.bench_workers import CONFIG_ENV, wait_until_up
+
+def rss_mb(pid: int):
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+
+async def two_turns(app_url: str):
+    """Returns the time to the first audio of two turns in a row."""
+    async with httpx.AsyncClient(timeout=60) as client:
+        first, _, _ = await device(client, f"{app_url}/play/cold-start.wav?prompt=Tell+me+a+story", "wav")
+        second, _, _ = await device(client, f"{app_url}/play/cold-start.wav?prompt=Tell+me+a+story", "wav")
+    return first, second
+
+def run_app(env: dict, args):
+    """Starts the app and runs two turns. Returns (startup seconds, RSS MB, first turn, second turn)."""
+    app_url = f"http://127.0.0.1:{args.app_port}"
+    start = time.monotonic()
+    app = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "tools.benchmarks.cold_start_app:app", "--port", str(args.app_port), "--log-level", "warning"],
+        env=env,
+    )
+    try:
+        wait_until_up(app_url)
+        startup = time.monotonic() - start
+        time.sleep(args.settle)
+        rss = rss_mb(app.pid)
+        first, second = asyncio.run(two_turns(app_url))
+    finally:
+        app.terminate()
+        app.wait()
+    return startup, rss, first, second
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--engines", nargs="+", choices=["piper", "openai", "elevenlabs"], default=["piper", "openai", "elevenlabs"])
+    parser.add_argument("--runs", type=int, default=3, help="app starts per engine and mode, the medians are reported")
+    parser.add_argument("--settle", type=float, default=1.0, help="seconds between the startup and the first request")
+    parser.add_argument("--tokens-per-second", type=float, default=50.0)
+    parser.add_argument("--first-token-delay", type=float, default=0.3)
+    parser.add_argument("--tts-latency", type=float, default=0.1, help="seconds the stub TTS takes to start answering")
+    parser.add_argument("--tts-kbps", type=float, default=1536.0)
+    parser.add_argument("--seconds-per-char", type=float, default=0.06)
+    parser.add_argument("--llm-port", type=int, default=18111)
+    parser.add_argument("--tts-port", type=int, default=18112)
+    parser.add_argument("--app-port", type=int, default=18110)
+    args = parser.parse_args()
+    # Stand-in settings shared with bench_load
+    args.story_repeat, args.tool_calls = 1, 0
+
+    logging.getLogger().setLevel("WARNING")
+
+    print(f"{'engine':<11} {'warm-up':<8} {'startup s':>10} {'rss MB':>7} {'1st turn first audio s':>23} {'2nd turn first audio s':>23}")
+    for engine in args.engines:
+        args.engine = engine
+        fakes = multiprocessing.Process(target=serve_fakes, args=(args,), daemon=True)
+        fakes.start()
+        try:
+            for warm_up in (False, True):
+                cfg = app_config(args)
+                cfg["warmup"]["enabled"] = warm_up
+                env = {**os.environ, CONFIG_ENV: json.dumps(cfg)}
+                runs = [run_app(env, args) for _ in range(args.runs)]
+                startup, rss, first, second = (statistics.median(values) for values in zip(*runs))
+                print(f"{engine:<11} {'on' if warm_up else 'off':<8} {startup:>10.2f} {rss:>7.0f} {first:>23.3f} {second:>23.3f}")
+        finally:
+            fakes.terminate()
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,73 @@
+"""
+Checks that no upstream work continues after a client hangs up mid-answer.
+
+Starts a fake OpenAI-compatible server, a stub Wyoming (Piper) server and the TTMG app,
+opens a /play stream, reads the first few KB of audio and disconnects. It then waits and reports
+how many LLM tokens and TTS characters were still produced after the disconnect,
+next to what the full answer would have cost, whether the LLM stream is still open
+and whether the encoder slot was given back.
+Each format runs without and with resumable streams. With them, the pipeline keeps running after the hang-up
+(at most half the buffer ahead of what was sent) until `--grace` seconds have passed, so it is stopped within `--settle`.
+
+Usage (from the repo root):
+    python -m tools.benchmarks.bench_disconnect
+    python -m tools.benchmarks.bench_disconnect --formats flac mp3 --settle 3
+"""
+import argparse
+import asyncio
+import time
+
+import httpx
+
+import main
+from tools.benchmarks.bench_llm_concurrency import bench_config
+from tools.benchmarks.fake_servers import DEFAULT_STORY, ServerThread, WyomingThread, fake_openai_app
+
+STORY = " ".join([DEFAULT_STORY] * 8)
+
+async def disconnect_after_first_audio(url: str, min_bytes: int = 8192):
+    """Opens a stream, waits for the first audio (past the container header) and hangs up. Returns the time to it."""
+    start = time.perf_counter()
+    received = 0
+    async with httpx.AsyncClient(timeout=60) as client:
+        async with client.stream("GET", url) as response:
+            async for chunk in response.aiter_bytes():
+                received += len(chunk)
+                if received >= min_bytes:
+                    return time.perf_counter() - start
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--formats", nargs="+", default=["flac", "mp3"])
+    parser.add_argument("--settle", type=float, default=2.0, help="seconds to wait after the disconnect")
+    parser.add_argument("--grace", type=float, default=1.0, help="grace_seconds of the resumable streams, shorter than --settle")
+    parser.add_argument("--llm-port", type=int, default=18011)
+    parser.add_argument("--app-port", type=int, default=18010)
+    parser.add_argument("--piper-port", type=int, default=18012)
+    args = parser.parse_args()
+
+    main.logger.setLevel("WARNING")
+    llm_app = fake_openai_app(text=STORY, tokens_per_second=50.0, first_token_delay=0.1)
+    llm_stats = llm_app.state.stats
+
+    with ServerThread(llm_app, args.llm_port) as llm, WyomingThread(args.piper_port) as piper:
+        main.config = bench_config(llm.url)
+        main.config["main"]["tts_engine"] = "piper"
+        main.config["piper"].update({"host": "127.0.0.1", "port": str(args.piper_port)})
+        main.config["resumable"]["grace_seconds"] = args.grace
+        with ServerThread(main.app, args.app_port) as app:
+            print(f"Full answer: {len(STORY.split(' '))} tokens, {len(STORY)} characters")
+            print(f"{'format':<7} {'resumable':<10} {'ttfa s':>7} {'tokens at hangup':>17} {'tokens after':>13} {'tts chars at hangup':>20} {'tts chars after':>16} {'llm streams open':>17} {'encoders busy':>14}")
+            for audio_format, resumable in [(audio_format, resumable) for audio_format in args.formats for resumable in (False, True)]:
+                main.config["resumable"]["enabled"] = resumable
+                tokens_before, chars_before = llm_stats["tokens_sent"], piper.stats["characters"]
+                ttfa = asyncio.run(disconnect_after_first_audio(f"{app.url}/play/bench.{audio_format}?prompt=Tell+me+a+story"))
+                tokens_hangup, chars_hangup = llm_stats["tokens_sent"] - tokens_before, piper.stats["characters"] - chars_before
+                time.sleep(args.settle)
+                tokens_after = llm_stats["tokens_sent"] - tokens_before - tokens_hangup
+                chars_after = piper.stats["characters"] - chars_before - chars_hangup
+                busy = httpx.get(f"{app.url}/debug/encoders").json()["busy"]
+                print(f"{audio_format:<7} {str(resumable):<10} {ttfa:>7.2f} {tokens_hangup:>17} {tokens_after:>13} {chars_hangup:>20} {chars_after:>16} {llm_stats['streams_open']:>17} {busy:>14}")
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,78 @@
+"""
+Compares the in-process PCM encoder with ffmpeg for raw PCM from Piper (22.05 kHz mono s16le).
+
+For each output format it reports the CPU time per second of audio, the output size and
+whether the in-process output decodes to exactly the same samples as its WAV counterpart (lossless).
+
+Usage (from the repo root):
+    python -m tools.benchmarks.bench_encoder
+    python -m tools.benchmarks.bench_encoder --seconds 30
+"""
+import argparse
+import math
+import resource
+import subprocess
+import time
+
+import numpy as np
+
+from helpers.pcm_encoding import PCMEncoder
+
+INPUT_RATE = 22050
+
+def test_pcm(seconds: float):
+    """Returns speech-like PCM: a few tones with a syllable-rate envelope and some noise."""
+    t = np.arange(int(seconds * INPUT_RATE)) / INPUT_RATE
+    envelope = 0.5 + 0.5 * np.sin(2 * math.pi * 4 * t)
+    tone = sum(np.sin(2 * math.pi * f * t) / (i + 1) for i, f in enumerate((180, 360, 720, 1440)))
+    noise = np.random.default_rng(0).normal(0, 0.02, len(t))
+    return np.clip((envelope * tone * 0.3 + noise) * 32767, -32768, 32767).astype("<i2").tobytes()
+
+def in_process(pcm: bytes, output_format: str, chunk_size: int = 2048):
+    """Encodes PCM in chunks like the TTS stream would. Returns (encoded bytes, cpu seconds)."""
+    start = time.process_time()
+    encoder = PCMEncoder(INPUT_RATE, 1, output_format)
+    out = [encoder.header()]
+    for i in range(0, len(pcm), chunk_size):
+        out.append(encoder.encode(pcm[i:i + chunk_size]))
+    out.append(encoder.flush())
+    return b"".join(out), time.process_time() - start
+
+def with_ffmpeg(pcm: bytes, output_format: str):
+    """Encodes PCM with ffmpeg. Returns (encoded bytes, cpu seconds of the ffmpeg process)."""
+    before = resource.getrusage(resource.RUSAGE_CHILDREN)
+    args = ["-sample_fmt", "s16"] if output_format == "flac" else []
+    encoded = subprocess.run(
+        ["ffmpeg", "-hide_banner", "-loglevel", "error", "-f", "s16le", "-ar", str(INPUT_RATE), "-ac", "1",
+         "-i", "pipe:0", "-ar", "24000", "-ac", "2", *args, "-f", output_format, "pipe:1"],
+        input=pcm, capture_output=True, check=True,
+    ).stdout
+    after = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return encoded, (after.ru_utime + after.ru_stime) - (before.ru_utime + before.ru_stime)
+
+def decode(encoded: bytes):
+    """Decodes audio to raw s16le with ffmpeg."""
+    return subprocess.run(
+        ["ffmpeg", "-hide_banner", "-loglevel", "error", "-i", "pipe:0", "-f", "s16le", "pipe:1"],
+        input=encoded, capture_output=True, check=True,
+    ).stdout
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seconds", type=float, default=10.0, help="seconds of audio to encode")
+    args = parser.parse_args()
+
+    pcm = test_pcm(args.seconds)
+    results = {}
+    print(f"{'encoder':<12} {'format':<6} {'cpu ms/s':>9} {'bytes':>9}")
+    for output_format in ("wav", "flac"):
+        for name, encode in (("in-process", in_process), ("ffmpeg", with_ffmpeg)):
+            encoded, cpu = encode(pcm, output_format)
+            results[name, output_format] = encoded
+            print(f"{name:<12} {output_format:<6} {cpu * 1000 / args.seconds:>9.2f} {len(encoded):>9}")
+
+    lossless = decode(results["in-process", "flac"]) == decode(results["in-process", "wav"])
+    print(f"in-process FLAC is lossless: {lossless}")
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,88 @@
+"""
+Measures how hedged TTS requests and failover keep sentences coming when the primary engine is slow or down.
+
+The primary engine is ElevenLabs against a local stub server with injectable faults, the secondary is
+Piper against a stub Wyoming server (its PCM is resampled in-process when the sample rates differ).
+Each scenario synthesizes `--sentences` different sentences one after another, with and without a
+secondary engine, and reports the time to the first audio (p50, p95, max), sentences without audio,
+how many were answered by the secondary, and whether the circuit breaker opened.
+
+Scenarios:
+    healthy  - no faults
+    spikes   - `--spike-probability` of the requests take `--spike-latency` seconds
+    outage   - every request to the primary fails
+
+Usage (from the repo root):
+    python -m tools.benchmarks.bench_failover --sentences 60
+"""
+import argparse
+import asyncio
+import json
+import logging
+import statistics
+import time
+
+from helpers.tts_cache import TTSCache
+from helpers.tts_failover import FailoverTTS
+from helpers.tts_streaming import close_tts_engines, tts_stream
+from tools.benchmarks.fake_servers import ServerThread, WyomingThread, fake_tts_app
+
+async def run(cfg: dict, sentences: int):
+    """Returns (times to the first audio, sentences without audio, FailoverTTS stats)."""
+    logger = logging.getLogger()
+    failover = FailoverTTS(cfg["failover"], TTSCache(cfg["tts_cache"], tts_stream, logger), logger)
+    first_audio, silent = [], 0
+    try:
+        for i in range(sentences):
+            start = time.perf_counter()
+            first = None
+            async for audio_chunk in failover.stream(f"This is test sentence number {i}.", cfg, logger):
+                if audio_chunk and first is None:
+                    first = time.perf_counter() - start
+            if first is None:
+                silent += 1
+            else:
+                first_audio.append(first)
+    finally:
+        await close_tts_engines()
+    return first_audio, silent, failover.stats()
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sentences", type=int, default=60)
+    parser.add_argument("--spike-probability", type=float, default=0.1)
+    parser.add_argument("--spike-latency", type=float, default=2.0)
+    parser.add_argument("--http-port", type=int, default=18090)
+    parser.add_argument("--piper-port", type=int, default=18091)
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel("CRITICAL")
+    with open("defaults.json") as f:
+        defaults = json.load(f)
+    with ServerThread(fake_tts_app(latency=0.1), args.http_port) as http, WyomingThread(args.piper_port, latency=0.05, seconds_per_char=0.01):
+        faults = http.server.config.app.state.faults
+        scenarios = {
+            "healthy": {"spike_probability": 0.0, "failure_probability": 0.0},
+            "spikes": {"spike_probability": args.spike_probability, "spike_latency": args.spike_latency, "failure_probability": 0.0},
+            "outage": {"spike_probability": 0.0, "failure_probability": 1.0},
+        }
+        print(f"{'scenario':<9} {'secondary':<10} {'p50 s':>7} {'p95 s':>7} {'max s':>7} {'silent':>7} {'by secondary':>13} {'circuit opened':>15}")
+        for scenario, scenario_faults in scenarios.items():
+            for secondary in (None, "piper"):
+                faults.update(scenario_faults)
+                cfg = json.loads(json.dumps(defaults))
+                cfg["main"].update({"tts_engine": "elevenlabs", "openai_api_key": "bench"})
+                cfg["elevenlabs"].update({"api_key": "bench", "base_url": http.url})
+                cfg["piper"].update({"host": "127.0.0.1", "port": str(args.piper_port)})
+                cfg["tts_cache"]["enabled"] = False
+                cfg["failover"].update({"secondary_engine": secondary, "min_samples": 5})
+                first_audio, silent, stats = asyncio.run(run(cfg, args.sentences))
+                ordered = sorted(first_audio) or [float("nan")]
+                by_secondary = stats.get("piper", {}).get("successes", 0)
+                print(
+                    f"{scenario:<9} {str(secondary):<10} {statistics.median(ordered):>7.2f} {ordered[int(0.95 * (len(ordered) - 1))]:>7.2f} "
+                    f"{ordered[-1]:>7.2f} {silent:>7} {by_secondary:>13} {stats['elevenlabs']['circuit_opened']:>15}"
+                )
+
+if __name__ == "__main__":
+    main_cli()
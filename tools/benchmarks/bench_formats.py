@@ -0,0 +1,65 @@
+"""
+Measures the CPU cost per second of audio of each /play output format, with the engines' old MP3 output
+and with their native raw PCM output.
+
+With MP3 from the engine, every format except mp3 went through ffmpeg to decode the MP3 and encode it again.
+With PCM, "pcm" is streamed as is, FLAC and WAV are encoded in-process, and only mp3 and opus need ffmpeg.
+The engine's own MP3 encoding happens on the TTS service and is not counted.
+
+Usage (from the repo root):
+    python -m tools.benchmarks.bench_formats
+    python -m tools.benchmarks.bench_formats --seconds 30
+"""
+import argparse
+import resource
+import subprocess
+
+from tools.benchmarks.bench_encoder import INPUT_RATE, in_process, test_pcm
+
+def ffmpeg_cpu(data: bytes, input_args: list, output_format: str):
+    """Transcodes with ffmpeg like the encoder pool does. Returns (output bytes, cpu seconds of the ffmpeg process)."""
+    before = resource.getrusage(resource.RUSAGE_CHILDREN)
+    args = ["-sample_fmt", "s16"] if output_format == "flac" else []
+    encoded = subprocess.run(
+        ["ffmpeg", "-hide_banner", "-loglevel", "error", *input_args, "-i", "pipe:0",
+         "-ar", "24000", "-ac", "2", *args, "-f", output_format, "pipe:1"],
+        input=data, capture_output=True, check=True,
+    ).stdout
+    after = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return encoded, (after.ru_utime + after.ru_stime) - (before.ru_utime + before.ru_stime)
+
+def from_mp3(mp3: bytes, output_format: str):
+    """The old path: MP3 from the engine."""
+    if output_format == "mp3":
+        return mp3, 0.0
+    if output_format == "pcm":
+        return None, None  # Was not available
+    return ffmpeg_cpu(mp3, [], output_format)
+
+def from_pcm(pcm: bytes, output_format: str):
+    """The new path: raw PCM from the engine."""
+    if output_format == "pcm":
+        return pcm, 0.0
+    if output_format in ("flac", "wav"):
+        return in_process(pcm, output_format)
+    return ffmpeg_cpu(pcm, ["-f", "s16le", "-ar", str(INPUT_RATE), "-ac", "1"], output_format)
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seconds", type=float, default=10.0, help="seconds of audio to encode")
+    args = parser.parse_args()
+
+    pcm = test_pcm(args.seconds)
+    # What a cloud engine used to send us
+    mp3, _ = ffmpeg_cpu(pcm, ["-f", "s16le", "-ar", str(INPUT_RATE), "-ac", "1"], "mp3")
+
+    print(f"{'format':<7} {'from MP3 cpu ms/s':>18} {'from PCM cpu ms/s':>18} {'ffmpeg from MP3':>16} {'ffmpeg from PCM':>16}")
+    for output_format in ("flac", "wav", "pcm", "mp3", "opus"):
+        _, old_cpu = from_mp3(mp3, output_format)
+        _, new_cpu = from_pcm(pcm, output_format)
+        old = "n/a" if old_cpu is None else f"{old_cpu * 1000 / args.seconds:.2f}"
+        old_ffmpeg = "n/a" if old_cpu is None else str(output_format != "mp3")
+        print(f"{output_format:<7} {old:>18} {new_cpu * 1000 / args.seconds:>18.2f} {old_ffmpeg:>16} {str(output_format in ('mp3', 'opus')):>16}")
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,91 @@
+"""
+Measures whether parallel /play streams are served concurrently.
+
+Starts a fake OpenAI-compatible server and the TTMG app, then opens N parallel
+/play/<client>.pcm streams. TTS is replaced with an async stand-in, so only the
+LLM path is measured. If the streams serialize, the wall time grows linearly with N;
+if they don't, it stays close to the duration of a single stream.
+
+Usage (from the repo root):
+    python -m tools.benchmarks.bench_llm_concurrency --streams 1 4 8
+"""
+import argparse
+import asyncio
+import json
+import time
+
+import httpx
+
+import main
+from tools.benchmarks.fake_servers import ServerThread, fake_openai_app
+
+def bench_config(llm_url: str):
+    """Returns a config that points the LLM at the fake server."""
+    with open("defaults.json", "r") as f:
+        cfg = json.load(f)
+    cfg["main"].update({
+        "openai_api_key": "sk-fake",
+        "llm_base_url": llm_url + "/v1",
+        "llm_model": "fake",
+        "llm_system_prompt": "You are a benchmark.",
+        "max_completion_tokens": 400,
+        "temperature": 1.0,
+        "top_p": 1.0,
+        "tts_engine": "openai",
+    })
+    # Never mix fake audio into the real TTS cache
+    cfg["tts_cache"]["enabled"] = False
+    return cfg
+
+async def fake_tts_stream(sentence: str, cfg: dict, logger):
+    """Async TTS stand-in: 50ms per sentence, 1 KiB of audio per 10 characters."""
+    await asyncio.sleep(0.05)
+    for _ in range(max(1, len(sentence) // 10)):
+        yield b"\x00" * 1024
+
+async def one_stream(client: httpx.AsyncClient, url: str):
+    start = time.perf_counter()
+    first_byte = None
+    async with client.stream("GET", url) as response:
+        async for _ in response.aiter_bytes():
+            if first_byte is None:
+                first_byte = time.perf_counter() - start
+    return first_byte, time.perf_counter() - start
+
+async def run(app_url: str, n: int):
+    async with httpx.AsyncClient(timeout=60) as client:
+        start = time.perf_counter()
+        results = await asyncio.gather(*[
+            one_stream(client, f"{app_url}/play/bench-{n}-{i}.pcm?prompt=Tell+me+a+story") for i in range(n)
+        ])
+        wall = time.perf_counter() - start
+    ttfb = sorted(r[0] for r in results)
+    total = sorted(r[1] for r in results)
+    return wall, ttfb, total
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--streams", type=int, nargs="+", default=[1, 4, 8])
+    parser.add_argument("--tokens-per-second", type=float, default=50.0)
+    parser.add_argument("--llm-port", type=int, default=18001)
+    parser.add_argument("--app-port", type=int, default=18000)
+    args = parser.parse_args()
+
+    main.tts_stream = fake_tts_stream
+    main.logger.setLevel("WARNING")
+
+    with ServerThread(fake_openai_app(tokens_per_second=args.tokens_per_second), args.llm_port) as llm:
+        main.config = bench_config(llm.url)
+        with ServerThread(main.app, args.app_port) as app:
+            baseline = None
+            print(f"{'streams':>7} {'wall s':>8} {'ttfb p50':>9} {'ttfb max':>9} {'stream p50':>10} {'serialization':>13}")
+            for n in args.streams:
+                wall, ttfb, total = asyncio.run(run(app.url, n))
+                single = total[len(total) // 2]
+                baseline = baseline or single
+                # ~1.0 means fully concurrent, ~N means the streams ran one after another
+                ratio = wall / baseline
+                print(f"{n:>7} {wall:>8.2f} {ttfb[len(ttfb) // 2]:>9.3f} {ttfb[-1]:>9.3f} {single:>10.2f} {ratio:>13.2f}")
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,306 @@
+"""
+Load test of whole voice turns: many simulated HAVPE devices against the TTMG app, with local stand-ins
+for the LLM and the TTS engine, so no API keys are needed.
+
+The stand-ins run in their own process: a fake OpenAI-compatible LLM (`--tokens-per-second`, and
+`--tool-calls` tool calls before the answer) and either a stub Piper (Wyoming) server or stub
+OpenAI/ElevenLabs speech endpoints (`--tts-latency`, streaming at `--tts-kbps`). The TTMG app runs in
+another process, started fresh for each number of clients, so its CPU time and peak RSS can be measured.
+
+Each simulated client repeats the flow of a Home Assistant voice turn for `--duration` seconds:
+Home Assistant posts the conversation to /preload, the device opens /play `--round-trip` seconds later,
+Home Assistant runs the tool calls it gets back (`--tool-seconds`) and sends the results to /write_history.
+The device plays the audio as it arrives.
+
+Reports, per number of clients: the time to the first audio from /preload and from /play (p50, p95),
+the silence heard between sentences when the audio arrives slower than it plays (total per turn, p95 and max),
+turns and seconds of audio per second, and the CPU and peak RSS of the app process (Linux only).
+Gaps are measured for the uncompressed formats (wav, pcm). For compressed formats the first audio is
+when the first KB arrived.
+
+Each run is appended to `--save` (one JSON line with the git commit and an optional `--label`),
+`--show` prints the saved runs to compare them.
+
+Usage (from the repo root):
+    python -m tools.benchmarks.bench_load --clients 1 8 32 --duration 20
+    python -m tools.benchmarks.bench_load --engine openai --tts-latency 0.2 --label "bigger lookahead"
+    python -m tools.benchmarks.bench_load --show
+"""
+import argparse
+import asyncio
+from datetime import datetime
+import json
+import logging
+import multiprocessing
+import os
+import subprocess
+import sys
+import time
+
+import httpx
+
+from tools.benchmarks.bench_llm_concurrency import bench_config
+from tools.benchmarks.bench_preload import PRELOAD
+from tools.benchmarks.bench_tool_calls import TOOL_CALLS
+from tools.benchmarks.bench_workers import CONFIG_ENV, wait_until_up
+from tools.benchmarks.fake_servers import DEFAULT_STORY, ServerThread, WyomingThread, fake_openai_app, fake_tts_app
+
+RESULTS_PATH = "tools/benchmarks/results/bench_load.jsonl"
+
+# Raw PCM of the cloud engines: 24 kHz mono s16
+PCM_BYTES_PER_SECOND = 48000
+# Bytes of a compressed stream that count as its first audio, past the container header
+FIRST_AUDIO_BYTES = 1024
+
+def serve_fakes(args):
+    """Runs the fake LLM and the stub TTS server until the process is terminated."""
+    llm = fake_openai_app(
+        text=" ".join([DEFAULT_STORY] * args.story_repeat), tokens_per_second=args.tokens_per_second,
+        first_token_delay=args.first_token_delay, tool_calls=TOOL_CALLS[:args.tool_calls] or None,
+    )
+    if args.engine == "piper":
+        tts = WyomingThread(args.tts_port, latency=args.tts_latency, seconds_per_char=args.seconds_per_char)
+    else:
+        tts = ServerThread(fake_tts_app(
+            latency=args.tts_latency, seconds_per_chunk=1024 * 8 / (args.tts_kbps * 1000),
+            http_bytes_per_char=int(args.seconds_per_char * PCM_BYTES_PER_SECOND),
+        ), args.tts_port)
+    with ServerThread(llm, args.llm_port), tts:
+        while True:
+            time.sleep(3600)
+
+def app_config(args):
+    """Returns the config of the app under test, pointed at the stand-ins."""
+    cfg = bench_config(f"http://127.0.0.1:{args.llm_port}")
+    cfg["main"]["tts_engine"] = args.engine
+    if args.engine == "piper":
+        cfg["piper"].update({"host": "127.0.0.1", "port": str(args.tts_port)})
+    elif args.engine == "openai":
+        cfg["openai"]["base_url"] = f"http://127.0.0.1:{args.tts_port}/v1"
+    else:
+        cfg["elevenlabs"].update({"api_key": "bench", "base_url": f"http://127.0.0.1:{args.tts_port}"})
+    return cfg
+
+class ProcessStats:
+    """Reads the CPU time (including reaped children like ffmpeg) and the peak RSS of a process from /proc."""
+    def __init__(self, pid: int):
+        self.pid = pid
+
+    def cpu_seconds(self):
+        with open(f"/proc/{self.pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        # utime, stime, cutime, cstime
+        return sum(int(field) for field in fields[11:15]) / os.sysconf("SC_CLK_TCK")
+
+    def peak_rss_mb(self):
+        with open(f"/proc/{self.pid}/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+
+async def home_assistant(client: httpx.AsyncClient, app_url: str, client_id: str, tool_seconds: float):
+    """Posts the conversation to /preload, runs the tool calls it gets back and sends the results to /write_history."""
+    response = (await client.post(f"{app_url}/preload/{client_id}", json=PRELOAD)).json()
+    await asyncio.sleep(tool_seconds)
+    results = [{"role": "tool", "tool_call_id": call["id"], "content": json.dumps({"success": True})} for call in response["tool_calls"]]
+    messages = (await client.get(f"{app_url}/history/{client_id}")).json()["messages"]
+    await client.post(f"{app_url}/write_history/{client_id}", json={"messages": messages + results})
+
+async def device(client: httpx.AsyncClient, url: str, audio_format: str):
+    """
+    Plays a /play stream as it arrives. Returns (time to the first audio, [gaps], seconds of audio).
+    Without a known byte rate (compressed formats), there are no gaps and no audio duration.
+    """
+    start = time.perf_counter()
+    first_audio, playing_until, gaps = None, None, []
+    received, header, bytes_per_second = 0, b"", None
+    async with client.stream("GET", url) as response:
+        response.raise_for_status()
+        if audio_format == "pcm":
+            params = dict(param.split("=") for param in response.headers["content-type"].split(";")[1:])
+            bytes_per_second = int(params["rate"]) * int(params["channels"]) * 2
+        async for chunk in response.aiter_bytes():
+            now = time.perf_counter() - start
+            if audio_format == "wav" and bytes_per_second is None:
+                # 44 byte streaming header: the byte rate is at offset 28
+                header += chunk
+                if len(header) < 44:
+                    continue
+                bytes_per_second = int.from_bytes(header[28:32], "little")
+                chunk = header[44:]
+            received += len(chunk)
+            if not chunk:
+                continue
+            if bytes_per_second:
+                if first_audio is None:
+                    first_audio = playing_until = now
+                elif now > playing_until:
+                    gaps.append(now - playing_until)
+                    playing_until = now
+                playing_until += len(chunk) / bytes_per_second
+            elif first_audio is None and received >= FIRST_AUDIO_BYTES:
+                first_audio = now
+    return first_audio, gaps, received / bytes_per_second if bytes_per_second else None
+
+async def turn(client: httpx.AsyncClient, app_url: str, client_id: str, args):
+    """One voice turn. Returns (first audio from /preload, first audio from /play, [gaps], seconds of audio)."""
+    ha = asyncio.create_task(home_assistant(client, app_url, client_id, args.tool_seconds))
+    try:
+        await asyncio.sleep(args.round_trip)
+        first_audio, gaps, audio_seconds = await device(client, f"{app_url}/play/{client_id}.{args.format}", args.format)
+        if not ha.done() and args.tool_calls:
+            await ha
+    finally:
+        # Without tool calls /preload does not return, it is only there to start the pipeline
+        ha.cancel()
+    return first_audio + args.round_trip if first_audio is not None else None, first_audio, gaps, audio_seconds
+
+async def load(app_url: str, clients: int, args):
+    """Runs `clients` simulated devices for `--duration` seconds. Returns (turns, errors)."""
+    turns, errors = [], 0
+    deadline = time.monotonic() + args.duration
+
+    async def client_loop(i: int):
+        nonlocal errors
+        async with httpx.AsyncClient(timeout=60) as client:
+            while time.monotonic() < deadline:
+                try:
+                    turns.append(await turn(client, app_url, f"load-{clients}-{i}", args))
+                except (httpx.HTTPError, KeyError) as e:
+                    errors += 1
+                    print(f"client {i}: {type(e).__name__}: {e}", file=sys.stderr)
+
+    await asyncio.gather(*[client_loop(i) for i in range(clients)])
+    return turns, errors
+
+def percentile(values: list, p: float):
+    ordered = sorted(values)
+    return ordered[int(p / 100 * (len(ordered) - 1))] if ordered else None
+
+def run_level(clients: int, args, env: dict):
+    """Starts the app, runs the load and returns the results for this number of clients."""
+    app_url = f"http://127.0.0.1:{args.app_port}"
+    app = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "tools.benchmarks.bench_workers:app", "--port", str(args.app_port), "--log-level", "warning"],
+        env=env,
+    )
+    try:
+        wait_until_up(app_url)
+        stats = ProcessStats(app.pid)
+        cpu_start = stats.cpu_seconds()
+        start = time.monotonic()
+        turns, errors = asyncio.run(load(app_url, clients, args))
+        wall = time.monotonic() - start
+        cpu = stats.cpu_seconds() - cpu_start
+        peak_rss = stats.peak_rss_mb()
+    finally:
+        app.terminate()
+        app.wait()
+
+    from_preload = [t[0] for t in turns if t[0] is not None]
+    from_play = [t[1] for t in turns if t[1] is not None]
+    gaps_per_turn = [sum(t[2]) for t in turns]
+    audio_seconds = sum(t[3] for t in turns if t[3])
+    return {
+        "clients": clients,
+        "turns": len(turns),
+        "errors": errors,
+        "first_audio_p50_seconds": percentile(from_preload, 50),
+        "first_audio_p95_seconds": percentile(from_preload, 95),
+        "first_audio_from_play_p50_seconds": percentile(from_play, 50),
+        "gap_p95_seconds": percentile(gaps_per_turn, 95) if args.format in ("wav", "pcm") else None,
+        "max_gap_seconds": max((gap for t in turns for gap in t[2]), default=0.0) if args.format in ("wav", "pcm") else None,
+        "turns_per_second": len(turns) / wall,
+        "audio_seconds_per_second": audio_seconds / wall if audio_seconds else None,
+        "cpu_percent": 100 * cpu / wall,
+        "cpu_ms_per_turn": 1000 * cpu / len(turns) if turns else None,
+        "peak_rss_mb": peak_rss,
+    }
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def fmt(value, spec: str = ".2f"):
+    return "-" if value is None else format(value, spec)
+
+def print_header():
+    print(
+        f"{'run':<28} {'clients':>7} {'turns':>6} {'errors':>6} {'first audio p50/p95 s':>22} {'from /play p50 s':>17} "
+        f"{'gap p95 s':>10} {'max gap s':>10} {'turns/s':>8} {'audio s/s':>10} {'cpu %':>7} {'cpu ms/turn':>12} {'rss MB':>7}"
+    )
+
+def print_row(run: str, row: dict):
+    print(
+        f"{run:<28} {row['clients']:>7} {row['turns']:>6} {row['errors']:>6} "
+        f"{fmt(row['first_audio_p50_seconds']) + ' / ' + fmt(row['first_audio_p95_seconds']):>22} {fmt(row['first_audio_from_play_p50_seconds']):>17} "
+        f"{fmt(row['gap_p95_seconds']):>10} {fmt(row['max_gap_seconds']):>10} {fmt(row['turns_per_second']):>8} {fmt(row['audio_seconds_per_second']):>10} "
+        f"{fmt(row['cpu_percent'], '.1f'):>7} {fmt(row['cpu_ms_per_turn'], '.1f'):>12} {fmt(row['peak_rss_mb'], '.0f'):>7}"
+    )
+
+def show(path: str):
+    """Prints the saved runs, oldest first."""
+    with open(path) as f:
+        runs = [json.loads(line) for line in f if line.strip()]
+    for run in runs:
+        params = run["params"]
+        print(f"{run['time']} {run['commit'] or ''} {run['label'] or ''}: {params['engine']}, {params['format']}, "
+              f"{params['tokens_per_second']:g} tokens/s, {params['tool_calls']} tool calls, {params['duration']:g}s per level")
+    print()
+    print_header()
+    for run in runs:
+        for row in run["results"]:
+            print_row(f"{run['time'][5:16]} {run['label'] or run['commit'] or ''}"[:28], row)
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, nargs="+", default=[1, 8, 32], help="numbers of simulated devices")
+    parser.add_argument("--duration", type=float, default=15.0, help="seconds of load per number of clients")
+    parser.add_argument("--engine", choices=["piper", "openai", "elevenlabs"], default="piper")
+    parser.add_argument("--format", choices=["wav", "pcm", "flac", "mp3", "opus"], default="wav", help="format the devices ask /play for")
+    parser.add_argument("--tokens-per-second", type=float, default=50.0)
+    parser.add_argument("--first-token-delay", type=float, default=0.3)
+    parser.add_argument("--story-repeat", type=int, default=1, help="how many times the fake LLM repeats its 4 sentence story")
+    parser.add_argument("--tool-calls", type=int, default=1, choices=range(len(TOOL_CALLS) + 1), help="tool calls before the answer")
+    parser.add_argument("--tool-seconds", type=float, default=0.1, help="time Home Assistant takes to run the tools")
+    parser.add_argument("--round-trip", type=float, default=0.3, help="seconds between /preload and /play")
+    parser.add_argument("--tts-latency", type=float, default=0.1, help="seconds the stub TTS takes to start answering")
+    parser.add_argument("--tts-kbps", type=float, default=1536.0, help="rate the stub OpenAI/ElevenLabs endpoints stream audio at (24 kHz PCM plays at 384 kbps)")
+    parser.add_argument("--seconds-per-char", type=float, default=0.06, help="seconds of speech per character of text")
+    parser.add_argument("--llm-port", type=int, default=18101)
+    parser.add_argument("--tts-port", type=int, default=18102)
+    parser.add_argument("--app-port", type=int, default=18100)
+    parser.add_argument("--label", help="note saved with the results")
+    parser.add_argument("--save", default=RESULTS_PATH, help="JSON lines file the results are appended to")
+    parser.add_argument("--no-save", action="store_true")
+    parser.add_argument("--show", action="store_true", help="print the saved runs instead of running")
+    args = parser.parse_args()
+
+    if args.show:
+        show(args.save)
+        return
+
+    logging.getLogger().setLevel("WARNING")
+    fakes = multiprocessing.Process(target=serve_fakes, args=(args,), daemon=True)
+    fakes.start()
+    env = {**os.environ, CONFIG_ENV: json.dumps(app_config(args))}
+    results = []
+    try:
+        print_header()
+        for clients in args.clients:
+            results.append(run_level(clients, args, env))
+            print_row("", results[-1])
+    finally:
+        fakes.terminate()
+
+    if not args.no_save:
+        os.makedirs(os.path.dirname(args.save) or ".", exist_ok=True)
+        params = {key: value for key, value in vars(args).items() if key not in ("label", "save", "no_save", "show")}
+        with open(args.save, "a") as f:
+            f.write(json.dumps({"time": datetime.now().isoformat(timespec="seconds"), "commit": git_commit(), "label": args.label, "params": params, "results": results}) + "\n")
+        print(f"Saved to {args.save}")
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,109 @@
+"""
+Simulates a voice turn and an announcement from the LLM to the device, with fixed sizes and with pacing.
+
+The LLM replays a recorded token stream, or the announcement comes as a whole text. The simulated TTS answers each request
+after `--request-overhead` seconds, then synthesizes `--seconds-per-char` of audio per character at `--real-time-factor`,
+read in chunks of the size the pacing picks (1 KiB without it). It runs through the real sentence generator, TTS pipeline
+and pacing. The device plays the audio in real time from its first chunk.
+Reports the time to the first audio, the playback stalls, the TTS requests and their mean length, the audio chunks
+and their mean size, and the seconds of audio ahead of playback at the most critical unit.
+
+Usage (from the repo root):
+    python -m tools.benchmarks.bench_pacing
+    python -m tools.benchmarks.bench_pacing --real-time-factor 0.6 --request-overhead 0.5
+"""
+import argparse
+import asyncio
+import json
+import logging
+import time
+
+from helpers.pacing import read_size, start_pacing
+from helpers.sentence_parser import chunk_text, stream_sentence_generator
+from helpers.tts_pipeline import tts_pipeline
+from tools.benchmarks.bench_broadcast import ANNOUNCEMENT
+from tools.benchmarks.bench_load import PCM_BYTES_PER_SECOND
+from tools.benchmarks.bench_sentence_replay import DATA_PATH
+
+logger = logging.getLogger("bench_pacing")
+
+async def replay(tokens: list):
+    """Yields recorded tokens at their arrival times."""
+    start = time.monotonic()
+    for arrived_ms, token in tokens:
+        await asyncio.sleep(max(0.0, start + arrived_ms / 1000 - time.monotonic()))
+        yield token
+
+def simulated_tts(args, stats: dict):
+    """Returns a TTS function that takes `--request-overhead` to answer and synthesizes at `--real-time-factor`."""
+    async def stream(sentence: str, cfg: dict, logger):
+        stats["requests"] += 1
+        stats["chars"] += len(sentence)
+        await asyncio.sleep(args.request_overhead)
+        remaining = int(len(sentence) * args.seconds_per_char * PCM_BYTES_PER_SECOND) // 2 * 2
+        while remaining:
+            size = min(read_size(), remaining)
+            await asyncio.sleep(size / PCM_BYTES_PER_SECOND * args.real_time_factor)
+            remaining -= size
+            yield b"\0" * size
+    return stream
+
+async def play(text_chunks, cfg: dict, args):
+    """Plays one stream on the simulated device. Returns its measurements."""
+    stats = {"requests": 0, "chars": 0}
+    start = time.monotonic()
+    pacing = start_pacing(cfg["pacing"], {"rate": PCM_BYTES_PER_SECOND // 2, "channels": 1})
+    sentences = stream_sentence_generator(text_chunks, **cfg["sentence_parser"], pacing=pacing)
+    audio = tts_pipeline(sentences, cfg, logger, simulated_tts(args, stats))
+    first, chunks, stalls, stalled = None, 0, 0, 0.0
+    played_until = None  # When the device runs out of audio
+    async for audio_chunk in (pacing.rechunk(audio) if pacing else audio):
+        now = time.monotonic()
+        if first is None:
+            first, played_until = now - start, now
+        elif now > played_until:
+            stalls += 1
+            stalled += now - played_until
+            played_until = now
+        played_until += len(audio_chunk) / PCM_BYTES_PER_SECOND
+        chunks += 1
+    summary = pacing.summary() if pacing else {}
+    return {
+        **stats, "first": first, "stalls": stalls, "stalled": stalled, "chunks": chunks,
+        "audio": stats["chars"] * args.seconds_per_char, "min_ahead": summary.get("min_ahead_seconds"),
+    }
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--stream", default="story", help="recorded token stream for the voice turn")
+    parser.add_argument("--repeat", type=int, default=3, help="length of the announcement, in copies of a 3-sentence text")
+    parser.add_argument("--request-overhead", type=float, default=0.3, help="seconds before a TTS request starts answering")
+    parser.add_argument("--real-time-factor", type=float, default=0.3, help="seconds of synthesis per second of audio")
+    parser.add_argument("--seconds-per-char", type=float, default=0.06)
+    args = parser.parse_args()
+    logger.setLevel("WARNING")
+
+    with open("defaults.json", "r") as f:
+        cfg = json.load(f)
+    cfg["main"]["tts_engine"] = "openai"
+    with open(DATA_PATH, "r") as f:
+        tokens = next(stream["tokens"] for stream in json.load(f) if stream["name"] == args.stream)
+    sources = {
+        "turn": lambda: replay(tokens),
+        "announcement": lambda: chunk_text(" ".join([ANNOUNCEMENT] * args.repeat)),
+    }
+
+    print(f"{'stream':<13} {'pacing':<7} {'first audio s':>14} {'stalls':>7} {'stalled s':>10} {'tts requests':>13} {'chars/request':>14} {'chunks':>7} {'KB/chunk':>9} {'min ahead s':>12}")
+    for name, source in sources.items():
+        for enabled in (False, True):
+            cfg["pacing"]["enabled"] = enabled
+            result = asyncio.run(play(source(), cfg, args))
+            kb_per_chunk = result["audio"] * PCM_BYTES_PER_SECOND / result["chunks"] / 1024
+            min_ahead = f"{result['min_ahead']:.2f}" if result["min_ahead"] is not None else "-"
+            print(
+                f"{name:<13} {str(enabled):<7} {result['first']:>14.2f} {result['stalls']:>7} {result['stalled']:>10.2f} "
+                f"{result['requests']:>13} {result['chars'] / result['requests']:>14.0f} {result['chunks']:>7} {kb_per_chunk:>9.1f} {min_ahead:>12}"
+            )
+
+if __name__ == "__main__":
+    main_cli()
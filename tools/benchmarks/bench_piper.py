@@ -0,0 +1,53 @@
+"""
+Measures Piper (Wyoming) latency per sentence against a local stub Wyoming server.
+
+Compares pooled connections (the default) with opening a new connection for every sentence,
+and reports time to the first PCM chunk, time to the last chunk and how many connections were opened.
+
+Usage (from the repo root):
+    python -m tools.benchmarks.bench_piper --sentences 20
+"""
+import argparse
+import asyncio
+import logging
+import statistics
+import time
+
+from helpers.tts_streaming import close_wyoming_pools, tts_stream_piper
+from tools.benchmarks.fake_servers import start_stub_wyoming
+
+SENTENCE = "Turning on the kitchen lights now."
+
+async def run(port: int, sentences: int, pooled: bool):
+    server, stats = await start_stub_wyoming(port)
+    logger = logging.getLogger()
+    first, last = [], []
+    try:
+        for _ in range(sentences):
+            start = time.perf_counter()
+            got_first = False
+            async for audio_chunk in tts_stream_piper(SENTENCE, "stub", "127.0.0.1", str(port), 22050, 2, logger):
+                if not got_first:
+                    first.append(time.perf_counter() - start)
+                    got_first = True
+            last.append(time.perf_counter() - start)
+            if not pooled:
+                await close_wyoming_pools()
+    finally:
+        await close_wyoming_pools()
+        await server.stop()
+    return first, last, stats
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sentences", type=int, default=20)
+    parser.add_argument("--port", type=int, default=18300)
+    args = parser.parse_args()
+
+    print(f"{'mode':<12} {'first chunk ms p50':>18} {'last chunk ms p50':>18} {'connections':>12}")
+    for i, (mode, pooled) in enumerate((("reconnect", False), ("pooled", True))):
+        first, last, stats = asyncio.run(run(args.port + i, args.sentences, pooled))
+        print(f"{mode:<12} {statistics.median(first) * 1000:>18.2f} {statistics.median(last) * 1000:>18.2f} {stats['connections']:>12}")
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,69 @@
+"""
+Measures how much the speculative start at /preload saves on the time to the first audio.
+
+Home Assistant posts the conversation to /preload and then tells the device to open /play.
+This benchmark does the same against a fake LLM and a stub Piper server, with a configurable delay
+between the two (the round-trip through Home Assistant and the device), with and without
+speculative start, and reports the time from /preload and from /play to the first audio.
+
+Usage (from the repo root):
+    python -m tools.benchmarks.bench_preload --round-trip 0.3 0.6
+"""
+import argparse
+import asyncio
+import json
+import time
+
+import httpx
+
+import main
+from tools.benchmarks.bench_disconnect import disconnect_after_first_audio
+from tools.benchmarks.bench_llm_concurrency import bench_config
+from tools.benchmarks.fake_servers import ServerThread, WyomingThread, fake_openai_app
+
+PRELOAD = {
+    "messages": json.dumps([
+        {"role": "system", "content": "You are a benchmark."},
+        {"role": "user", "content": "Tell me a story"},
+    ]),
+    "tools": "[]",
+    "model": "fake",
+    "max_completion_tokens": 400,
+    "top_p": 1.0,
+    "temperature": 1.0,
+}
+
+async def preload_then_play(app_url: str, client_id: str, round_trip: float):
+    """Returns (seconds from /preload to the first audio, seconds from /play to the first audio)."""
+    async with httpx.AsyncClient(timeout=60) as client:
+        start = time.perf_counter()
+        # /preload only returns when the LLM asks for tools, so it stays open in the background
+        preload = asyncio.create_task(client.post(f"{app_url}/preload/{client_id}", json=PRELOAD))
+        await asyncio.sleep(round_trip)
+        from_play = await disconnect_after_first_audio(f"{app_url}/play/{client_id}.flac")
+        preload.cancel()
+    return time.perf_counter() - start, from_play
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--round-trip", type=float, nargs="+", default=[0.3, 0.6], help="seconds between /preload and /play")
+    parser.add_argument("--llm-port", type=int, default=18031)
+    parser.add_argument("--piper-port", type=int, default=18032)
+    parser.add_argument("--app-port", type=int, default=18030)
+    args = parser.parse_args()
+
+    main.logger.setLevel("WARNING")
+    with ServerThread(fake_openai_app(first_token_delay=0.3), args.llm_port) as llm, WyomingThread(args.piper_port):
+        main.config = bench_config(llm.url)
+        main.config["main"]["tts_engine"] = "piper"
+        main.config["piper"].update({"host": "127.0.0.1", "port": str(args.piper_port)})
+        with ServerThread(main.app, args.app_port) as app:
+            print(f"{'round-trip s':>12} {'speculative':>12} {'first audio from /preload s':>28} {'from /play s':>13}")
+            for round_trip in args.round_trip:
+                for i, enabled in enumerate((False, True)):
+                    main.config["speculative"]["enabled"] = enabled
+                    from_preload, from_play = asyncio.run(preload_then_play(app.url, f"bench-{round_trip}-{i}", round_trip))
+                    print(f"{round_trip:>12.2f} {str(enabled):>12} {from_preload:>28.2f} {from_play:>13.2f}")
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,125 @@
+"""
+Compares playing a long announcement live through /tts_say with rendering it once through /render
+and playing the file.
+
+Runs the TTMG app in its own process against the stand-ins of bench_load.py, renders `--sentences` sentences,
+then plays the announcement `--plays` times both ways. Reports the time to the first KB and to the whole file,
+the TTS requests made while playing, the render time, and checks that Range requests return the right bytes.
+
+Usage (from the repo root):
+    python -m tools.benchmarks.bench_render
+    python -m tools.benchmarks.bench_render --format mp3 --sentences 40
+"""
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+from tools.benchmarks.bench_broadcast import ANNOUNCEMENT, tts_requests
+from tools.benchmarks.bench_load import FIRST_AUDIO_BYTES, app_config, serve_fakes
+from tools.benchmarks.bench_workers import CONFIG_ENV, wait_until_up
+
+async def download(client: httpx.AsyncClient, url: str):
+    """Returns (seconds to the first KB, seconds to the end, the audio)."""
+    start = time.perf_counter()
+    first, audio = None, b""
+    async with client.stream("GET", url) as response:
+        response.raise_for_status()
+        async for chunk in response.aiter_bytes():
+            audio += chunk
+            if first is None and len(audio) >= FIRST_AUDIO_BYTES:
+                first = time.perf_counter() - start
+    return first, time.perf_counter() - start, audio
+
+async def bench(app_url: str, text: str, args):
+    async with httpx.AsyncClient(timeout=120) as client:
+        start = time.perf_counter()
+        response = await client.post(f"{app_url}/render", json={"text": text, "format": args.format, "id": "briefing"})
+        response.raise_for_status()
+        while (job := (await client.get(f"{app_url}/render/briefing")).json())["status"] in ("queued", "rendering"):
+            await asyncio.sleep(0.05)
+        if job["status"] != "done":
+            raise RuntimeError(f"Render failed: {job}")
+        render_seconds = time.perf_counter() - start
+
+        results = {}
+        for mode in ("tts_say", "render"):
+            requests_before = tts_requests(app_url)
+            runs = []
+            for _ in range(args.plays):
+                if mode == "tts_say":
+                    await client.post(f"{app_url}/preload-text/bench", json={"text": text})
+                    runs.append(await download(client, f"{app_url}/tts_say/bench.{args.format}"))
+                else:
+                    runs.append(await download(client, f"{app_url}/render/briefing.{args.format}"))
+            results[mode] = (
+                statistics.median(run[0] for run in runs), statistics.median(run[1] for run in runs),
+                (tts_requests(app_url) - requests_before) / args.plays, runs[-1][2],
+            )
+
+        # Seek into the middle of the file and resume from there
+        audio = results["render"][3]
+        middle = len(audio) // 2
+        ranged = await client.get(f"{app_url}/render/briefing.{args.format}", headers={"Range": f"bytes={middle}-{middle + 9999}"})
+        tail = await client.get(f"{app_url}/render/briefing.{args.format}", headers={"Range": f"bytes={middle}-"})
+        range_ok = (
+            ranged.status_code == 206 and ranged.content == audio[middle:middle + 10000]
+            and tail.status_code == 206 and tail.content == audio[middle:]
+        )
+        return render_seconds, results, range_ok, len(audio)
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--format", choices=["wav", "pcm", "flac", "mp3", "opus"], default="flac")
+    parser.add_argument("--engine", choices=["piper", "openai", "elevenlabs"], default="piper")
+    parser.add_argument("--sentences", type=int, default=20, help="length of the announcement, in sentences")
+    parser.add_argument("--plays", type=int, default=3)
+    parser.add_argument("--tts-latency", type=float, default=0.1, help="seconds the stub TTS takes to start answering")
+    parser.add_argument("--tts-kbps", type=float, default=1536.0)
+    parser.add_argument("--seconds-per-char", type=float, default=0.06)
+    parser.add_argument("--llm-port", type=int, default=18151)
+    parser.add_argument("--tts-port", type=int, default=18152)
+    parser.add_argument("--app-port", type=int, default=18150)
+    args = parser.parse_args()
+    # Stand-in settings shared with bench_load, the LLM is not used
+    args.tokens_per_second, args.first_token_delay, args.story_repeat, args.tool_calls = 50.0, 0.3, 1, 0
+
+    logging.getLogger().setLevel("WARNING")
+    sentences = [sentence + "." for sentence in ANNOUNCEMENT.split(". ")]
+    text = " ".join(sentences[i % len(sentences)].rstrip(".") + f" number {i}." for i in range(args.sentences))
+    fakes = multiprocessing.Process(target=serve_fakes, args=(args,), daemon=True)
+    fakes.start()
+    app_url = f"http://127.0.0.1:{args.app_port}"
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            cfg = app_config(args)
+            cfg["render"]["disk_path"] = tmp
+            app = subprocess.Popen(
+                [sys.executable, "-m", "uvicorn", "tools.benchmarks.bench_workers:app", "--port", str(args.app_port), "--log-level", "warning"],
+                env={**os.environ, CONFIG_ENV: json.dumps(cfg)},
+            )
+            try:
+                wait_until_up(app_url)
+                render_seconds, results, range_ok, size = asyncio.run(bench(app_url, text, args))
+            finally:
+                app.terminate()
+                app.wait()
+    finally:
+        fakes.terminate()
+
+    print(f"{len(text)} characters, rendered to {size} bytes of {args.format} in {render_seconds:.2f}s, Range requests OK: {range_ok}")
+    print(f"{'mode':<8} {'first KB p50 s':>15} {'whole file p50 s':>17} {'tts requests/play':>18}")
+    for mode, (first, whole, requests, _) in results.items():
+        print(f"{mode:<8} {first:>15.3f} {whole:>17.3f} {requests:>18.1f}")
+
+if __name__ == "__main__":
+    main_cli()
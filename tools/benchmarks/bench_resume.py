@@ -0,0 +1,97 @@
+"""
+Checks that a device whose connection drops mid-answer can open /play again and hear the rest of it.
+
+Starts a fake OpenAI-compatible server, a stub Wyoming (Piper) server and the TTMG app, plays a whole answer once
+as the reference, then plays it again and hangs up after `--drop-after` bytes. The pipeline keeps running
+while the device is away. It then reconnects:
+- "resume offset": /play again with ?offset= at the bytes it got, which must add up to the reference exactly,
+- "resume": /play again without an offset, which gets a new header and the audio from where the stream stopped,
+  less what was still in flight when the connection dropped,
+- "ask again": what a device has to do without resumable streams, send the prompt again.
+Reports the time to the first KB and to the end after reconnecting, the bytes resumed, the LLM requests made after reconnecting,
+the LLM tokens and TTS characters of the whole turn, the bytes the device never got and whether the rest is right.
+
+Usage (from the repo root):
+    python -m tools.benchmarks.bench_resume
+    python -m tools.benchmarks.bench_resume --format mp3 --drop-after 32768
+"""
+import argparse
+import asyncio
+import time
+
+import httpx
+
+import main
+from tools.benchmarks.bench_disconnect import STORY
+from tools.benchmarks.bench_load import FIRST_AUDIO_BYTES
+from tools.benchmarks.bench_llm_concurrency import bench_config
+from tools.benchmarks.fake_servers import ServerThread, WyomingThread, fake_openai_app
+
+async def play(url: str, max_bytes: int = None):
+    """Plays an URL, up to `max_bytes`. Returns (seconds to the first KB, seconds to the end, the audio, the offset of a resumed stream or None)."""
+    start = time.perf_counter()
+    first, audio = None, b""
+    async with httpx.AsyncClient(timeout=60) as client:
+        async with client.stream("GET", url) as response:
+            response.raise_for_status()
+            offset = int(response.headers["X-TTMG-Offset"]) if "X-TTMG-Offset" in response.headers else None
+            async for chunk in response.aiter_bytes():
+                audio += chunk
+                if first is None and len(audio) >= FIRST_AUDIO_BYTES:
+                    first = time.perf_counter() - start
+                if max_bytes and len(audio) >= max_bytes:
+                    return first, time.perf_counter() - start, audio[:max_bytes], offset
+    return first, time.perf_counter() - start, audio, offset
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--format", choices=["wav", "pcm", "flac", "mp3", "opus"], default="flac")
+    parser.add_argument("--drop-after", type=int, default=65536, help="bytes received before the connection drops")
+    parser.add_argument("--gap", type=float, default=0.5, help="seconds between the drop and the reconnect")
+    parser.add_argument("--llm-port", type=int, default=18161)
+    parser.add_argument("--app-port", type=int, default=18160)
+    parser.add_argument("--piper-port", type=int, default=18162)
+    args = parser.parse_args()
+
+    main.logger.setLevel("WARNING")
+    llm_app = fake_openai_app(text=STORY, tokens_per_second=50.0, first_token_delay=0.1)
+    llm_stats = llm_app.state.stats
+
+    with ServerThread(llm_app, args.llm_port) as llm, WyomingThread(args.piper_port) as piper:
+        main.config = bench_config(llm.url)
+        main.config["main"]["tts_engine"] = "piper"
+        main.config["piper"].update({"host": "127.0.0.1", "port": str(args.piper_port)})
+        with ServerThread(main.app, args.app_port) as app:
+            prompt_url = f"{app.url}/play/bench.{args.format}?prompt=Tell+me+a+story"
+            resume_url = f"{app.url}/play/bench.{args.format}"
+            _, _, reference, _ = asyncio.run(play(prompt_url))
+            print(f"Full answer: {len(reference)} bytes of {args.format}, dropped after {args.drop_after} bytes")
+            print(f"{'mode':<14} {'first KB s':>11} {'to the end s':>13} {'resumed bytes':>14} {'llm requests':>13} {'tokens':>7} {'tts chars':>10} {'lost bytes':>11} {'correct':>8}")
+            for mode in ("resume offset", "resume", "ask again"):
+                main.config["resumable"]["enabled"] = mode != "ask again"
+                tokens, chars = llm_stats["tokens_sent"], piper.stats["characters"]
+                _, _, before, _ = asyncio.run(play(prompt_url, args.drop_after))
+                time.sleep(args.gap)
+                requests, lost, resumed = llm_stats["requests"], 0, 0
+                if mode == "ask again":
+                    first, end, rest, _ = asyncio.run(play(prompt_url))
+                    correct = rest == reference
+                else:
+                    first, end, rest, offset = asyncio.run(play(resume_url if mode == "resume" else f"{resume_url}?offset={len(before)}"))
+                    if offset is None:
+                        # Nothing was left to resume, the app answered as a new /play
+                        correct, lost = "-", len(reference) - len(before)
+                    elif mode == "resume offset":
+                        resumed = len(rest)
+                        correct = before + rest == reference
+                    else:
+                        # A new header, then the audio from the start of the chunk the stream stopped in
+                        header_size = len(rest) - (len(reference) - offset)
+                        resumed, lost = len(rest) - header_size, offset - len(before)
+                        correct = rest[:header_size] == reference[:header_size] and rest[header_size:] == reference[offset:]
+                requests, tokens, chars = llm_stats["requests"] - requests, llm_stats["tokens_sent"] - tokens, piper.stats["characters"] - chars
+                first = f"{first:.3f}" if first is not None else "-"
+                print(f"{mode:<14} {first:>11} {end:>13.3f} {resumed:>14} {requests:>13} {tokens:>7} {chars:>10} {lost:>11} {str(correct):>8}")
+
+if __name__ == "__main__":
+    main_cli()
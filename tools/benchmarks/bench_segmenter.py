@@ -0,0 +1,75 @@
+"""
+Micro-benchmark for sentence segmentation cost per streamed token.
+
+Feeds synthetic responses of growing length token by token and reports the average cost per token for:
+  - legacy: a new ICU BreakIterator and a full re-scan of the carried-over buffer on every token
+  - segmenter: SentenceSegmenter with a cached iterator and incremental scanning
+
+The "run-on" workload is a single sentence that never ends, which is the worst case for re-scanning.
+
+Usage (from the repo root):
+    python -m tools.benchmarks.bench_segmenter
+"""
+import argparse
+import time
+
+import icu
+
+from helpers.sentence_parser import SentenceSegmenter, pre_process_text, post_process_text
+
+SENTENCE = "Mr. Smith asked the house to turn on the lights in the kitchen, and it did so right away. "
+RUN_ON = "and then the house turned on another light "
+
+def tokens(text: str):
+    """Splits text into word-sized tokens, roughly like an LLM would stream them."""
+    return [" " + word for word in text.split()]
+
+def legacy(stream: list):
+    """The old approach: re-segment the whole carried-over buffer with a new iterator on every token."""
+    buffer = ""
+    for token in stream:
+        buffer += pre_process_text(token)
+        bi = icu.BreakIterator.createSentenceInstance(icu.Locale("en_US"))
+        bi.setText(buffer)
+        start = bi.first()
+        sentences = []
+        for end in bi:
+            sentences.append(buffer[start:end])
+            start = end
+        if not (buffer and buffer[-1] in {'.', '?', '!'}) and sentences:
+            buffer = sentences[-1]
+            sentences = sentences[:-1]
+        else:
+            buffer = ""
+        [post_process_text(s.strip()) for s in sentences]
+
+def segmenter(stream: list):
+    s = SentenceSegmenter()
+    for token in stream:
+        s.push(token)
+        s.sentences()
+
+def per_token_us(fn, stream: list, repeat: int):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn(stream)
+    return (time.perf_counter() - start) / (repeat * len(stream)) * 1e6
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--lengths", type=int, nargs="+", default=[100, 400, 1600, 6400], help="response lengths in tokens")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'workload':<10} {'tokens':>7} {'legacy us/token':>16} {'segmenter us/token':>19}")
+    for workload, text in (("sentences", SENTENCE), ("run-on", RUN_ON)):
+        base = tokens(text.strip())
+        for length in args.lengths:
+            stream = (base * (length // len(base) + 1))[:length]
+            print(
+                f"{workload:<10} {length:>7} {per_token_us(legacy, stream, args.repeat):>16.2f} "
+                f"{per_token_us(segmenter, stream, args.repeat):>19.2f}"
+            )
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,93 @@
+"""
+Replays recorded LLM token streams through stream_sentence_generator and compares
+the fixed and adaptive segmentation modes.
+
+For every stream it reports the time to the first sentence (in the recorded timeline,
+i.e. when the token that completed it arrived), the number of units and their length distribution.
+
+Usage (from the repo root):
+    python -m tools.benchmarks.bench_sentence_replay
+    python -m tools.benchmarks.bench_sentence_replay --record my_stream --prompt "Tell me a joke"
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+
+from helpers.sentence_parser import stream_sentence_generator
+
+DATA_PATH = "tools/benchmarks/data/token_streams.json"
+
+MODES = {
+    "fixed": {"adaptive": False},
+    "adaptive": {"adaptive": True},
+}
+
+async def replay(tokens: list, clock: dict):
+    """Yields recorded tokens, moving the virtual clock to each token's arrival time."""
+    for arrived_ms, token in tokens:
+        clock["now"] = arrived_ms
+        yield token
+
+async def segment(tokens: list, params: dict):
+    """Returns (time_to_first_sentence_ms, units, cpu_ms) for one replayed stream."""
+    clock = {"now": 0}
+    first = None
+    units = []
+    start = time.process_time()
+    async for sentence in stream_sentence_generator(replay(tokens, clock), **params):
+        if first is None:
+            first = clock["now"]
+        units.append(sentence)
+    return first, units, (time.process_time() - start) * 1000
+
+async def record(name: str, prompt: str):
+    """Records a token stream from the LLM in configuration.json and appends it to the data file."""
+    import main
+    cfg = main.load_config()
+    client = main.create_llm_client(cfg)
+    start = time.perf_counter()
+    tokens = []
+    completion = await client.chat.completions.create(
+        model=cfg["main"]["llm_model"],
+        messages=[{"role": "system", "content": cfg["main"]["llm_system_prompt"]}, {"role": "user", "content": prompt}],
+        stream=True,
+    )
+    async for chunk in completion:
+        if chunk.choices and chunk.choices[0].delta.content:
+            tokens.append([round((time.perf_counter() - start) * 1000), chunk.choices[0].delta.content])
+    await client.close()
+
+    with open(DATA_PATH, "r") as f:
+        streams = json.load(f)
+    streams.append({"name": name, "tokens": tokens})
+    with open(DATA_PATH, "w") as f:
+        f.write("[\n" + ",\n".join(json.dumps(s) for s in streams) + "\n]\n")
+    print(f"Recorded {len(tokens)} tokens as '{name}'")
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--record", metavar="NAME", help="record a new stream from the configured LLM instead")
+    parser.add_argument("--prompt", default="Tell me a short story about Home Assistant.")
+    args = parser.parse_args()
+
+    if args.record:
+        asyncio.run(record(args.record, args.prompt))
+        return
+
+    with open(DATA_PATH, "r") as f:
+        streams = json.load(f)
+
+    print(f"{'stream':<14} {'mode':<9} {'ttfs ms':>8} {'units':>6} {'min':>5} {'p50':>5} {'max':>5} {'<15ch':>6} {'cpu ms':>7}")
+    for stream in streams:
+        for mode, params in MODES.items():
+            first, units, cpu_ms = asyncio.run(segment(stream["tokens"], params))
+            lengths = [len(u) for u in units]
+            print(
+                f"{stream['name']:<14} {mode:<9} {first:>8} {len(units):>6} {min(lengths):>5} "
+                f"{int(statistics.median(lengths)):>5} {max(lengths):>5} {sum(l < 15 for l in lengths):>6} {cpu_ms:>7.2f}"
+            )
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,86 @@
+"""
+Compares sentence-by-sentence TTS with the text streaming mode for the engines that support it
+(ElevenLabs websocket input stream, Google streaming synthesis), against local stand-in servers.
+
+A fake LLM token stream (words at `--tokens-per-second` after `--first-token-delay`) is either cut into
+sentences and synthesized by the TTS pipeline (the default mode), or sent straight into one text streaming
+session. Reports the time to the first and the last audio chunk, how many TTS requests/sessions were
+made, and checks that the whole text reached the stand-in server.
+
+Usage (from the repo root):
+    python -m tools.benchmarks.bench_text_streaming
+"""
+import argparse
+import asyncio
+import json
+import logging
+import time
+
+from google.cloud.texttospeech_v1.services.text_to_speech.transports import TextToSpeechGrpcAsyncIOTransport
+import grpc
+
+from helpers.sentence_parser import stream_sentence_generator
+from helpers.tts_pipeline import tts_pipeline
+from helpers.tts_streaming import ElevenLabsTTSEngine, GoogleTTSEngine
+from tools.benchmarks.fake_servers import DEFAULT_STORY, ServerThread, StubGoogleTTS, fake_tts_app
+
+async def fake_tokens(text: str, tokens_per_second: float, first_token_delay: float):
+    """Yields the words of `text` like an LLM stream."""
+    await asyncio.sleep(first_token_delay)
+    for i, word in enumerate(text.split(" ")):
+        yield word if i == 0 else " " + word
+        await asyncio.sleep(1 / tokens_per_second)
+
+async def run(engine_name: str, text_streaming: bool, stub, stub_url: str, args):
+    """Returns (first audio s, last audio s)."""
+    with open("defaults.json") as f:
+        cfg = json.load(f)
+    cfg["main"]["tts_engine"] = engine_name
+    logger = logging.getLogger()
+    if engine_name == "google_cloud":
+        engine = GoogleTTSEngine(cfg["google_cloud"], transport=TextToSpeechGrpcAsyncIOTransport(channel=grpc.aio.insecure_channel(stub.address)))
+    else:
+        engine = ElevenLabsTTSEngine({**cfg["elevenlabs"], "api_key": "bench", "base_url": stub_url})
+
+    tokens = fake_tokens(DEFAULT_STORY, args.tokens_per_second, args.first_token_delay)
+    if text_streaming:
+        audio_chunks = engine.stream_text(tokens, logger)
+    else:
+        sentences = (sentence async for sentence in stream_sentence_generator(tokens, **cfg["sentence_parser"]) if sentence.strip() != ".")
+        audio_chunks = tts_pipeline(sentences, cfg, logger, lambda sentence, cfg, logger: engine.stream(sentence, logger))
+
+    start = time.perf_counter()
+    first = None
+    try:
+        async for audio_chunk in audio_chunks:
+            if audio_chunk and first is None:
+                first = time.perf_counter() - start
+    finally:
+        await engine.close()
+    return first, time.perf_counter() - start
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tokens-per-second", type=float, default=50.0)
+    parser.add_argument("--first-token-delay", type=float, default=0.3)
+    parser.add_argument("--latency", type=float, default=0.15, help="seconds the stand-in servers take to start generating audio")
+    parser.add_argument("--http-port", type=int, default=18060)
+    parser.add_argument("--grpc-port", type=int, default=18061)
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel("WARNING")
+    with StubGoogleTTS(args.grpc_port, latency=args.latency) as google, ServerThread(fake_tts_app(latency=args.latency), args.http_port) as http:
+        elevenlabs = http.server.config.app.state
+        print(f"{'engine':<13} {'mode':<15} {'first audio s':>14} {'last audio s':>13} {'requests':>9} {'text intact':>12}")
+        for engine_name, stats, texts in (("google_cloud", google.stats, google.texts), ("elevenlabs", elevenlabs.stats, elevenlabs.texts)):
+            for text_streaming in (False, True):
+                requests = stats["requests"] + stats["text_sessions"]
+                first, last = asyncio.run(run(engine_name, text_streaming, google, http.url, args))
+                intact = " ".join(texts[-1].split()) == DEFAULT_STORY if text_streaming else "-"
+                print(
+                    f"{engine_name:<13} {'text streaming' if text_streaming else 'sentences':<15} {first:>14.2f} {last:>13.2f} "
+                    f"{stats['requests'] + stats['text_sessions'] - requests:>9} {str(intact):>12}"
+                )
+
+if __name__ == "__main__":
+    main_cli()
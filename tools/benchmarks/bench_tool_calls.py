@@ -0,0 +1,107 @@
+"""
+Compares the classic /preload tool-call handshake with streamed tool calls.
+
+A fake LLM answers the first request with several tool calls, streamed in fragments, and the second one
+(with the tool results) with text. Home Assistant is simulated: it runs each tool call (each tool takes
+its own time, see --tool-seconds) and sends the results back, either all at once via /write_history
+after /preload returns (classic), or one by one as each tool call arrives (streamed).
+Reports when the first and the last tool call reached Home Assistant and when the audio started,
+and checks that the tool calls arrive intact, also when the LLM interleaves their fragments.
+
+Usage (from the repo root):
+    python -m tools.benchmarks.bench_tool_calls
+    python -m tools.benchmarks.bench_tool_calls --tool-seconds 0.8 0.1 0.1
+"""
+import argparse
+import asyncio
+import json
+import time
+
+import httpx
+
+import main
+from tools.benchmarks.bench_llm_concurrency import bench_config
+from tools.benchmarks.bench_preload import PRELOAD
+from tools.benchmarks.fake_servers import ServerThread, WyomingThread, fake_openai_app
+
+TOOL_CALLS = [
+    ("get_weather", {"location": "Amsterdam", "unit": "celsius", "days": 1}),
+    ("light_turn_on", {"entity_id": "light.kitchen", "brightness_pct": 80}),
+    ("climate_set_temperature", {"entity_id": "climate.living_room", "temperature": 21.5}),
+]
+
+async def run_tool(client: httpx.AsyncClient, app_url: str, client_id: str, tool_call: dict, seconds: float, streamed: bool):
+    """Runs a tool call like Home Assistant would. In the streamed mode, also sends its result."""
+    await asyncio.sleep(seconds)
+    result = {"tool_call_id": tool_call["id"], "content": json.dumps({"success": True})}
+    if streamed:
+        await client.post(f"{app_url}/write_history/{client_id}", json={"tool_result": result})
+    return {"role": "tool", **result}
+
+async def first_audio(client: httpx.AsyncClient, url: str, start: float):
+    async with client.stream("GET", url) as response:
+        received = 0
+        async for chunk in response.aiter_bytes():
+            received += len(chunk)
+            if received >= 8192:
+                return time.perf_counter() - start
+
+async def interaction(app_url: str, client_id: str, streamed: bool, tool_seconds: list):
+    """Returns (first tool call at, last tool call at, first audio at, tool calls) in seconds from /preload."""
+    async with httpx.AsyncClient(timeout=60) as client:
+        start = time.perf_counter()
+        audio = asyncio.create_task(first_audio(client, f"{app_url}/play/{client_id}.flac", start))
+        received, tools, first_at = [], [], None
+        if streamed:
+            async with client.stream("POST", f"{app_url}/preload/{client_id}", json={**PRELOAD, "stream_tool_calls": True}) as response:
+                async for line in response.aiter_lines():
+                    event = json.loads(line)
+                    if "tool_call" in event:
+                        first_at = first_at or time.perf_counter() - start
+                        seconds = tool_seconds[len(received) % len(tool_seconds)]
+                        received.append(event["tool_call"])
+                        tools.append(asyncio.create_task(run_tool(client, app_url, client_id, event["tool_call"], seconds, True)))
+            last_at = time.perf_counter() - start
+            await asyncio.gather(*tools)
+        else:
+            response = (await client.post(f"{app_url}/preload/{client_id}", json=PRELOAD)).json()
+            first_at = last_at = time.perf_counter() - start
+            received = response["tool_calls"]
+            results = await asyncio.gather(*[
+                run_tool(client, app_url, client_id, tool_call, tool_seconds[i % len(tool_seconds)], False) for i, tool_call in enumerate(received)
+            ])
+            messages = (await client.get(f"{app_url}/history/{client_id}")).json()["messages"]
+            await client.post(f"{app_url}/write_history/{client_id}", json={"messages": messages + results})
+        return first_at, last_at, await audio, received
+
+def check(tool_calls: list):
+    """Checks that the tool calls match what the fake LLM sent."""
+    return [(call["function"]["name"], json.loads(call["function"]["arguments"])) for call in tool_calls] == TOOL_CALLS
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tool-seconds", type=float, nargs="+", default=[0.8, 0.1, 0.1], help="time each tool call takes")
+    parser.add_argument("--llm-port", type=int, default=18041)
+    parser.add_argument("--piper-port", type=int, default=18042)
+    parser.add_argument("--app-port", type=int, default=18040)
+    args = parser.parse_args()
+
+    main.logger.setLevel("WARNING")
+    print(f"{'fragments':<12} {'mode':<9} {'first tool s':>13} {'last tool s':>12} {'first audio s':>14} {'intact':>7}")
+    for port_offset, interleave in enumerate((False, True)):
+        llm_app = fake_openai_app(first_token_delay=0.3, tool_calls=TOOL_CALLS, interleave_tool_calls=interleave)
+        with ServerThread(llm_app, args.llm_port + 10 * port_offset) as llm, WyomingThread(args.piper_port + 10 * port_offset):
+            main.config = bench_config(llm.url)
+            main.config["main"]["tts_engine"] = "piper"
+            main.config["piper"].update({"host": "127.0.0.1", "port": str(args.piper_port + 10 * port_offset)})
+            with ServerThread(main.app, args.app_port + 10 * port_offset) as app:
+                for streamed in (False, True):
+                    client_id = f"bench-{interleave}-{streamed}"
+                    first_at, last_at, audio_at, tool_calls = asyncio.run(interaction(app.url, client_id, streamed, args.tool_seconds))
+                    print(
+                        f"{'interleaved' if interleave else 'sequential':<12} {'streamed' if streamed else 'classic':<9} "
+                        f"{first_at:>13.2f} {last_at:>12.2f} {audio_at:>14.2f} {str(check(tool_calls)):>7}"
+                    )
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,143 @@
+"""
+Measures per-sentence latency and event-loop blocking of the Google, OpenAI and ElevenLabs TTS clients
+against local stub servers.
+
+Compares the long-lived async engines from helpers/tts_streaming.py ("pooled") with the clients the
+helpers used before ("per-sentence"): a new blocking Google client and ElevenLabs client for every
+sentence, and the blocking module-level OpenAI client. The old Google helper also re-read the credentials
+file for every sentence; the stub can't check real credentials, so that part of the cost is not included.
+
+Reports time to the first and the last audio chunk when sentences are synthesized one at a time,
+the wall time and the longest event-loop stall when `--concurrency` sentences run at once,
+and how many connections the stub servers saw.
+
+Usage (from the repo root):
+    python -m tools.benchmarks.bench_tts_clients --sentences 20 --concurrency 8
+"""
+import argparse
+import asyncio
+import logging
+import statistics
+import time
+
+from elevenlabs.client import ElevenLabs
+from google.cloud import texttospeech
+from google.cloud.texttospeech_v1.services.text_to_speech.transports import TextToSpeechGrpcAsyncIOTransport, TextToSpeechGrpcTransport
+import grpc
+import openai
+
+from helpers.tts_streaming import ElevenLabsTTSEngine, GoogleTTSEngine, OpenAITTSEngine
+from tools.benchmarks.fake_servers import ServerThread, StubGoogleTTS, fake_tts_app
+
+SENTENCE = "Turning on the kitchen lights now."
+GOOGLE_CFG = {"name": "en-US-Chirp-HD-F", "language_code": "en-US", "gender": "FEMALE", "text_streaming": False, "sample_rate": 24000}
+
+async def legacy_google(address: str):
+    """Like the old helper: a new blocking client for every sentence."""
+    client = texttospeech.TextToSpeechClient(transport=TextToSpeechGrpcTransport(channel=grpc.insecure_channel(address)))
+    response = client.synthesize_speech(
+        input=texttospeech.SynthesisInput(text=SENTENCE),
+        voice=texttospeech.VoiceSelectionParams(name=GOOGLE_CFG["name"], language_code=GOOGLE_CFG["language_code"], ssml_gender=texttospeech.SsmlVoiceGender.FEMALE),
+        audio_config=texttospeech.AudioConfig(audio_encoding=texttospeech.AudioEncoding.MP3),
+    )
+    yield response.audio_content
+    client.transport.close()
+
+def legacy_openai(client: openai.OpenAI):
+    async def stream():
+        """Like the old helper: the blocking shared client, the whole audio is loaded before the first chunk."""
+        response = client.audio.speech.create(model="tts-1", voice="nova", input=SENTENCE, response_format="mp3")
+        for audio_chunk in response.iter_bytes(1024):
+            yield audio_chunk
+    return stream
+
+async def legacy_elevenlabs(url: str):
+    """Like the old helper: a new blocking client for every sentence."""
+    client = ElevenLabs(api_key="bench", base_url=url)
+    for audio_chunk in client.text_to_speech.convert_as_stream(text=SENTENCE, voice_id="bench", model_id="bench"):
+        yield audio_chunk
+
+async def timed(stream):
+    """Returns (seconds to the first chunk, seconds to the last chunk)."""
+    start = time.perf_counter()
+    first = None
+    async for audio_chunk in stream:
+        if first is None and audio_chunk:
+            first = time.perf_counter() - start
+    return first, time.perf_counter() - start
+
+async def run(new_stream, sentences: int, concurrency: int):
+    """
+    Runs the sentences one at a time, then `concurrency` at once while a heartbeat measures
+    how long the event loop is stalled. Returns (first chunk p50, last chunk p50, concurrent wall time, longest stall).
+    """
+    sequential = [await timed(new_stream()) for _ in range(sentences)]
+
+    stall = 0.0
+    running = True
+
+    async def heartbeat():
+        nonlocal stall
+        while running:
+            start = time.perf_counter()
+            await asyncio.sleep(0.005)
+            stall = max(stall, time.perf_counter() - start - 0.005)
+
+    beat = asyncio.create_task(heartbeat())
+    await asyncio.sleep(0)
+    start = time.perf_counter()
+    await asyncio.gather(*[timed(new_stream()) for _ in range(concurrency)])
+    wall = time.perf_counter() - start
+    running = False
+    await beat
+    return statistics.median(t[0] for t in sequential), statistics.median(t[1] for t in sequential), wall, stall
+
+async def bench_engine(engine: str, pooled: bool, google: StubGoogleTTS, http_url: str, sentences: int, concurrency: int):
+    logger = logging.getLogger()
+    if engine == "google_cloud":
+        if pooled:
+            client = GoogleTTSEngine(GOOGLE_CFG, transport=TextToSpeechGrpcAsyncIOTransport(channel=grpc.aio.insecure_channel(google.address)))
+        else:
+            return await run(lambda: legacy_google(google.address), sentences, concurrency)
+    elif engine == "openai":
+        if pooled:
+            client = OpenAITTSEngine({"model": "tts-1", "voice": "nova", "base_url": f"{http_url}/v1", "max_connections": 10}, "bench")
+        else:
+            legacy_client = openai.OpenAI(api_key="bench", base_url=f"{http_url}/v1")
+            try:
+                return await run(legacy_openai(legacy_client), sentences, concurrency)
+            finally:
+                legacy_client.close()
+    else:
+        if pooled:
+            client = ElevenLabsTTSEngine({"model": "bench", "voice": "bench", "api_key": "bench", "base_url": http_url, "max_connections": 10, "chunk_length_schedule": [50], "sample_rate": 24000})
+        else:
+            return await run(lambda: legacy_elevenlabs(http_url), sentences, concurrency)
+    try:
+        return await run(lambda: client.stream(SENTENCE, logger), sentences, concurrency)
+    finally:
+        await client.close()
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sentences", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds the stub servers take to start answering")
+    parser.add_argument("--http-port", type=int, default=18050)
+    parser.add_argument("--grpc-port", type=int, default=18051)
+    args = parser.parse_args()
+
+    with StubGoogleTTS(args.grpc_port, latency=args.latency) as google, ServerThread(fake_tts_app(latency=args.latency), args.http_port) as http:
+        print(f"{'engine':<13} {'mode':<13} {'first chunk ms p50':>18} {'last chunk ms p50':>18} {'concurrent s':>13} {'max stall ms':>13} {'connections':>12}")
+        for engine in ("google_cloud", "openai", "elevenlabs"):
+            stats = google.stats if engine == "google_cloud" else http.server.config.app.state.stats
+            for pooled in (False, True):
+                connections = stats["connections"]
+                first, last, wall, stall = asyncio.run(bench_engine(engine, pooled, google, http.url, args.sentences, args.concurrency))
+                print(
+                    f"{engine:<13} {'pooled' if pooled else 'per-sentence':<13} {first * 1000:>18.2f} {last * 1000:>18.2f} "
+                    f"{wall:>13.2f} {stall * 1000:>13.1f} {stats['connections'] - connections:>12}"
+                )
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,115 @@
+"""
+Measures /play throughput with several uvicorn worker processes that share the SQLite session store.
+
+Starts a fake OpenAI-compatible server and a stub Wyoming (Piper) server in their own processes,
+then for each worker count runs the TTMG app with `uvicorn --workers N` and keeps
+`--concurrency` FLAC streams going for `--duration` seconds. Reports completed streams
+and audio per second. Throughput can only scale up to the number of CPU cores.
+
+Usage (from the repo root):
+    python -m tools.benchmarks.bench_workers --workers 1 2 4
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+import main
+from tools.benchmarks.bench_llm_concurrency import bench_config
+from tools.benchmarks.fake_servers import ServerThread, WyomingThread, fake_openai_app
+
+# Worker processes get their config from this environment variable, see the bottom of this file
+CONFIG_ENV = "TTMG_BENCH_CONFIG"
+
+def serve_fakes(llm_port: int, piper_port: int, tokens_per_second: float):
+    """Runs the fake LLM and the stub Piper server until the process is terminated."""
+    with ServerThread(fake_openai_app(tokens_per_second=tokens_per_second, first_token_delay=0.05), llm_port), WyomingThread(piper_port):
+        while True:
+            time.sleep(3600)
+
+def wait_until_up(url: str, timeout: float = 30):
+    start = time.monotonic()
+    while time.monotonic() - start < timeout:
+        try:
+            httpx.get(url + "/debug/sessions", timeout=1)
+            return
+        except httpx.HTTPError:
+            time.sleep(0.1)
+    raise RuntimeError(f"{url} did not start")
+
+async def load(url: str, concurrency: int, duration: float):
+    """Keeps `concurrency` streams going for `duration` seconds. Returns (completed streams, audio bytes)."""
+    completed = 0
+    received = 0
+    deadline = time.monotonic() + duration
+
+    async def client_loop(i: int):
+        nonlocal completed, received
+        async with httpx.AsyncClient(timeout=60) as client:
+            while time.monotonic() < deadline:
+                async with client.stream("GET", f"{url}/play/bench-{i}.flac?prompt=Tell+me+a+story") as response:
+                    async for chunk in response.aiter_bytes():
+                        received += len(chunk)
+                completed += 1
+
+    await asyncio.gather(*[client_loop(i) for i in range(concurrency)])
+    return completed, received
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--tokens-per-second", type=float, default=500.0)
+    parser.add_argument("--llm-port", type=int, default=18021)
+    parser.add_argument("--piper-port", type=int, default=18022)
+    parser.add_argument("--app-port", type=int, default=18020)
+    args = parser.parse_args()
+
+    main.logger.setLevel("WARNING")
+    fakes = multiprocessing.Process(target=serve_fakes, args=(args.llm_port, args.piper_port, args.tokens_per_second), daemon=True)
+    fakes.start()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        cfg = bench_config(f"http://127.0.0.1:{args.llm_port}")
+        cfg["main"]["tts_engine"] = "piper"
+        cfg["piper"].update({"host": "127.0.0.1", "port": str(args.piper_port)})
+        cfg["session_store"].update({"backend": "sqlite", "sqlite_path": os.path.join(tmp, "sessions.sqlite3")})
+        env = {**os.environ, CONFIG_ENV: json.dumps(cfg)}
+        app_url = f"http://127.0.0.1:{args.app_port}"
+
+        print(f"CPU cores: {os.cpu_count()}")
+        print(f"{'workers':>7} {'streams':>8} {'streams/s':>10} {'audio MB/s':>11} {'speedup':>8}")
+        baseline = None
+        for workers in args.workers:
+            app = subprocess.Popen(
+                [sys.executable, "-m", "uvicorn", "tools.benchmarks.bench_workers:app", "--port", str(args.app_port),
+                 "--workers", str(workers), "--log-level", "warning"],
+                env=env,
+            )
+            try:
+                wait_until_up(app_url)
+                completed, received = asyncio.run(load(app_url, args.concurrency, args.duration))
+            finally:
+                app.terminate()
+                app.wait()
+            rate = completed / args.duration
+            baseline = baseline or rate
+            print(f"{workers:>7} {completed:>8} {rate:>10.2f} {received / args.duration / 1e6:>11.2f} {rate / baseline:>8.2f}")
+
+    fakes.terminate()
+
+if CONFIG_ENV in os.environ:
+    main.config = json.loads(os.environ[CONFIG_ENV])
+    main.logger.setLevel("WARNING")
+app = main.app
+
+if __name__ == "__main__":
+    main_cli()
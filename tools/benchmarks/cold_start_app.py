@@ -0,0 +1,12 @@
+"""
+The TTMG app for bench_cold_start.py, configured from the environment like in bench_workers.py.
+It does not import the stand-in servers (and the TTS SDKs they use), so the memory of the app is measured as is.
+"""
+import json
+import os
+
+import main
+
+main.config = json.loads(os.environ["TTMG_BENCH_CONFIG"])
+main.logger.setLevel("WARNING")
+app = main.app
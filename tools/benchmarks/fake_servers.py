@@ -0,0 +1,355 @@
+import asyncio
+import base64
+from concurrent import futures
+from functools import lru_cache, partial
+import json
+import math
+import random
+import struct
+import threading
+import time
+
+from fastapi import FastAPI, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import Response, StreamingResponse
+from google.cloud.texttospeech_v1.types import (
+    StreamingSynthesizeRequest, StreamingSynthesizeResponse, SynthesizeSpeechRequest, SynthesizeSpeechResponse,
+)
+import grpc
+import uvicorn
+from wyoming.audio import AudioChunk, AudioStart, AudioStop
+from wyoming.server import AsyncEventHandler, AsyncTcpServer
+from wyoming.tts import Synthesize
+
+DEFAULT_STORY = (
+    "Once upon a time, there was a smart home that could talk. "
+    "Every morning it said hello to the family and turned on the lights in the kitchen. "
+    "One day, Mr. Smith asked it for a story, and it happily obliged. "
+    "The end."
+)
+
+def tool_call_fragments(tool_calls: list, fragment_size: int, interleave: bool):
+    """
+    Splits tool calls [(name, arguments dict)] into streamed `delta.tool_calls` fragments,
+    one call after another, or round-robin between the calls if `interleave` is set.
+    """
+    per_call = []
+    for index, (name, arguments) in enumerate(tool_calls):
+        arguments = json.dumps(arguments)
+        fragments = [{"index": index, "id": f"call_{index}", "type": "function", "function": {"name": name, "arguments": ""}}]
+        fragments += [{"index": index, "function": {"arguments": arguments[i:i + fragment_size]}} for i in range(0, len(arguments), fragment_size)]
+        per_call.append(fragments)
+    if not interleave:
+        return [fragment for fragments in per_call for fragment in fragments]
+    return [fragments[i] for i in range(max(map(len, per_call))) for fragments in per_call if i < len(fragments)]
+
+def fake_openai_app(text: str = DEFAULT_STORY, tokens_per_second: float = 50.0, first_token_delay: float = 0.3,
+                    tool_calls: list = None, interleave_tool_calls: bool = False, fragment_size: int = 8):
+    """
+    Returns an OpenAI-compatible app that streams `text` word by word
+    from /v1/chat/completions at the given rate.
+    With `tool_calls` [(name, arguments dict)], it first answers with these tool calls, streamed in fragments,
+    and with `text` once the request has the tool results.
+    Counts requests, open streams and the tokens it has sent in `app.state.stats`.
+    """
+    app = FastAPI()
+    app.state.stats = {"requests": 0, "streams_open": 0, "tokens_sent": 0}
+
+    def sse(payload: dict):
+        return f"data: {json.dumps(payload)}\n\n"
+
+    def chunk(delta: dict, finish_reason=None):
+        return {
+            "id": "chatcmpl-fake",
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": "fake",
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+        }
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        app.state.stats["requests"] += 1
+        words = text.split(" ")
+        call_tools = tool_calls and not any(message.get("role") == "tool" for message in body["messages"])
+
+        async def stream():
+            app.state.stats["streams_open"] += 1
+            try:
+                await asyncio.sleep(first_token_delay)
+                yield sse(chunk({"role": "assistant", "content": ""}))
+                if call_tools:
+                    for fragment in tool_call_fragments(tool_calls, fragment_size, interleave_tool_calls):
+                        yield sse(chunk({"tool_calls": [fragment]}))
+                        app.state.stats["tokens_sent"] += 1
+                        await asyncio.sleep(1 / tokens_per_second)
+                    yield sse(chunk({}, finish_reason="tool_calls"))
+                    yield "data: [DONE]\n\n"
+                    return
+                for i, word in enumerate(words):
+                    yield sse(chunk({"content": word if i == 0 else " " + word}))
+                    app.state.stats["tokens_sent"] += 1
+                    await asyncio.sleep(1 / tokens_per_second)
+                yield sse(chunk({}, finish_reason="stop"))
+                yield "data: [DONE]\n\n"
+            finally:
+                app.state.stats["streams_open"] -= 1
+
+        return StreamingResponse(stream(), media_type="text/event-stream")
+
+    @app.get("/v1/models")
+    async def models():
+        return {"object": "list", "data": [{"id": "fake", "object": "model", "created": 0, "owned_by": "bench"}]}
+
+    return app
+
+def fake_tts_app(latency: float = 0.05, audio_bytes: int = 16384, chunk_size: int = 1024, seconds_per_chunk: float = 0.005, bytes_per_char: int = 1000,
+                 http_bytes_per_char: int = None, max_concurrent: int = None):
+    """
+    Returns an app with the speech endpoints of OpenAI (/v1/audio/speech) and ElevenLabs
+    (/v1/text-to-speech/{voice_id}/stream). Both answer after `latency` with `audio_bytes` of fake audio
+    (or, with `http_bytes_per_char`, that much of a 24 kHz tone per character of the text),
+    streamed in chunks every `seconds_per_chunk`.
+    Counts requests and client connections (by client address) in `app.state.stats`.
+    Also has the ElevenLabs websocket input stream (/v1/text-to-speech/{voice_id}/stream-input), which keeps
+    the text of each session in `app.state.texts`.
+    Latency spikes and errors can be switched on at any time in `app.state.faults`: with `spike_probability`
+    a request takes `spike_latency` instead, with `failure_probability` it fails with HTTP 500.
+    Like a provider rate limit, requests over `max_concurrent` running at once fail with HTTP 429 (counted as "rate_limited").
+    """
+    app = FastAPI()
+    app.state.stats = {"requests": 0, "connections": 0, "text_sessions": 0, "spikes": 0, "failures": 0, "rate_limited": 0, "running": 0}
+    app.state.texts = []
+    app.state.faults = {"spike_probability": 0.0, "spike_latency": 2.0, "failure_probability": 0.0}
+    faults_random = random.Random(0)
+    clients = set()
+
+    async def speech(request: Request):
+        app.state.stats["requests"] += 1
+        client = tuple(request.scope["client"])
+        if client not in clients:
+            clients.add(client)
+            app.state.stats["connections"] += 1
+
+        stats = app.state.stats
+        if max_concurrent and stats["running"] >= max_concurrent:
+            stats["rate_limited"] += 1
+            return Response(status_code=429, content="stub rate limit")
+        stats["running"] += 1
+
+        faults = app.state.faults
+        if faults_random.random() < faults["failure_probability"]:
+            app.state.stats["failures"] += 1
+            stats["running"] -= 1
+            return Response(status_code=500, content="stub failure")
+        delay = latency
+        if faults_random.random() < faults["spike_probability"]:
+            app.state.stats["spikes"] += 1
+            delay = faults["spike_latency"]
+        size, audio = audio_bytes, b"\xff" * chunk_size
+        if http_bytes_per_char:
+            body = await request.json()
+            size = len(body.get("input") or body.get("text", "")) * http_bytes_per_char
+            audio = tone_chunk(24000)[:chunk_size]
+
+        async def stream():
+            try:
+                await asyncio.sleep(delay)
+                for _ in range(0, size, chunk_size):
+                    yield audio
+                    await asyncio.sleep(seconds_per_chunk)
+            finally:
+                stats["running"] -= 1
+
+        return StreamingResponse(stream(), media_type="audio/mpeg")
+
+    app.post("/v1/audio/speech")(speech)
+    app.post("/v1/text-to-speech/{voice_id}/stream")(speech)
+
+    @app.websocket("/v1/text-to-speech/{voice_id}/stream-input")
+    async def stream_input(websocket: WebSocket, voice_id: str):
+        """
+        Like the ElevenLabs input stream: generates audio (`bytes_per_char` per character, after `latency`)
+        whenever the buffered text reaches the next length in `chunk_length_schedule`, and the rest when the text ends.
+        """
+        await websocket.accept()
+        app.state.stats["text_sessions"] += 1
+        schedule = [120, 160, 250, 290]
+        buffered, received, generated = "", "", 0
+        try:
+            while True:
+                data = json.loads(await websocket.receive_text())
+                if "generation_config" in data:
+                    schedule = data["generation_config"]["chunk_length_schedule"]
+                    continue
+                final = data["text"] == ""
+                buffered += data["text"]
+                received += data["text"]
+                if buffered.strip() and (final or len(buffered) >= schedule[min(generated, len(schedule) - 1)]):
+                    await asyncio.sleep(latency)
+                    audio = b"\xff" * (len(buffered.strip()) * bytes_per_char)
+                    for start in range(0, len(audio), chunk_size):
+                        await websocket.send_text(json.dumps({"audio": base64.b64encode(audio[start:start + chunk_size]).decode(), "isFinal": None}))
+                    buffered = ""
+                    generated += 1
+                if final:
+                    await websocket.send_text(json.dumps({"audio": None, "isFinal": True}))
+                    app.state.texts.append(received)
+                    await websocket.close()
+                    return
+        except WebSocketDisconnect:
+            # The client gave up on this text
+            return
+
+    return app
+
+class StubGoogleTTS:
+    """
+    Runs a stub Google Cloud TTS gRPC server (insecure) in background threads.
+    SynthesizeSpeech answers after `latency` with `audio_bytes` of fake MP3.
+    StreamingSynthesize speaks each sentence as soon as it is complete (`bytes_per_char` of PCM per character,
+    after `latency`) and keeps the text of each session in `texts`.
+    Counts requests, streaming sessions and client connections (by peer address) in `stats`.
+    """
+    def __init__(self, port: int, latency: float = 0.05, audio_bytes: int = 16384, bytes_per_char: int = 1000, host: str = "127.0.0.1"):
+        self.stats = {"requests": 0, "connections": 0, "text_sessions": 0}
+        self.texts = []
+        self.peers = set()
+        self.latency = latency
+        self.audio = b"\xff" * audio_bytes
+        self.bytes_per_char = bytes_per_char
+        self.address = f"{host}:{port}"
+        self.server = grpc.server(futures.ThreadPoolExecutor(max_workers=32))
+        handler = grpc.method_handlers_generic_handler("google.cloud.texttospeech.v1.TextToSpeech", {
+            "SynthesizeSpeech": grpc.unary_unary_rpc_method_handler(
+                self.synthesize_speech,
+                request_deserializer=SynthesizeSpeechRequest.deserialize,
+                response_serializer=SynthesizeSpeechResponse.serialize,
+            ),
+            "StreamingSynthesize": grpc.stream_stream_rpc_method_handler(
+                self.streaming_synthesize,
+                request_deserializer=StreamingSynthesizeRequest.deserialize,
+                response_serializer=StreamingSynthesizeResponse.serialize,
+            ),
+        })
+        self.server.add_generic_rpc_handlers((handler,))
+        self.server.add_insecure_port(self.address)
+
+    def synthesize_speech(self, request, context):
+        self.stats["requests"] += 1
+        if context.peer() not in self.peers:
+            self.peers.add(context.peer())
+            self.stats["connections"] += 1
+        time.sleep(self.latency)
+        return SynthesizeSpeechResponse(audio_content=self.audio)
+
+    def streaming_synthesize(self, requests, context):
+        self.stats["text_sessions"] += 1
+        buffered, received = "", ""
+        for request in requests:
+            buffered += request.input.text
+            received += request.input.text
+            end = max(buffered.rfind(mark) for mark in ".!?") + 1
+            if end and buffered[:end].strip():
+                time.sleep(self.latency)
+                yield StreamingSynthesizeResponse(audio_content=b"\0" * (len(buffered[:end].strip()) * self.bytes_per_char))
+                buffered = buffered[end:]
+        if buffered.strip():
+            time.sleep(self.latency)
+            yield StreamingSynthesizeResponse(audio_content=b"\0" * (len(buffered.strip()) * self.bytes_per_char))
+        self.texts.append(received)
+
+    def __enter__(self):
+        self.server.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.stop(grace=None)
+
+class ServerThread:
+    """
+    Runs an ASGI app with uvicorn in a background thread with its own event loop,
+    so a blocked loop in the app under test can't stall the fakes (and vice versa).
+    Requests that are still open on exit (like a /preload waiting for tool calls) are cancelled after a second.
+    """
+    def __init__(self, app, port: int, host: str = "127.0.0.1"):
+        self.server = uvicorn.Server(uvicorn.Config(app, host=host, port=port, log_level="warning", lifespan="on", timeout_graceful_shutdown=1))
+        self.thread = threading.Thread(target=self.server.run, daemon=True)
+        self.url = f"http://{host}:{port}"
+
+    def __enter__(self):
+        self.thread.start()
+        while not self.server.started:
+            time.sleep(0.01)
+        return self
+
+    def __exit__(self, *exc):
+        self.server.should_exit = True
+        self.thread.join()
+
+@lru_cache
+def tone_chunk(rate: int):
+    """Returns 1024 samples of a 440 Hz sine tone as s16le, so the stub does not spend its time generating audio."""
+    return b"".join(struct.pack("<h", int(8000 * math.sin(2 * math.pi * 440 * i / rate))) for i in range(1024))
+
+class StubWyomingHandler(AsyncEventHandler):
+    """
+    Answers Synthesize events like wyoming-piper: AudioStart, a sine tone in AudioChunks, AudioStop.
+    The connection stays open for the next request.
+    """
+    def __init__(self, reader, writer, stats: dict, rate: int, latency: float, seconds_per_char: float):
+        super().__init__(reader, writer)
+        self.stats = stats
+        self.rate = rate
+        self.latency = latency
+        self.seconds_per_char = seconds_per_char
+        stats["connections"] += 1
+
+    async def handle_event(self, event) -> bool:
+        if not Synthesize.is_type(event.type):
+            return True
+        text = Synthesize.from_event(event).text
+        self.stats["requests"] += 1
+        self.stats["characters"] += len(text)
+        await asyncio.sleep(self.latency)
+        try:
+            await self.write_event(AudioStart(rate=self.rate, width=2, channels=1).event())
+            samples = int(len(text) * self.seconds_per_char * self.rate)
+            tone = tone_chunk(self.rate)
+            for start in range(0, samples, 1024):
+                n = min(1024, samples - start)
+                await self.write_event(AudioChunk(rate=self.rate, width=2, channels=1, audio=tone[:2 * n]).event())
+            await self.write_event(AudioStop().event())
+        except ConnectionError:
+            # The client gave up on this sentence
+            return False
+        return True
+
+async def start_stub_wyoming(port: int, rate: int = 22050, latency: float = 0.02, seconds_per_char: float = 0.06, host: str = "127.0.0.1"):
+    """
+    Starts a stub Wyoming TTS server in the running event loop and returns (server, stats).
+    """
+    stats = {"connections": 0, "requests": 0, "characters": 0}
+    server = AsyncTcpServer(host, port)
+    await server.start(partial(StubWyomingHandler, stats=stats, rate=rate, latency=latency, seconds_per_char=seconds_per_char))
+    return server, stats
+
+class WyomingThread:
+    """
+    Runs a stub Wyoming TTS server in a background thread with its own event loop. See `start_stub_wyoming`.
+    """
+    def __init__(self, port: int, **kwargs):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.port = port
+        self.kwargs = kwargs
+
+    def __enter__(self):
+        self.thread.start()
+        self.server, self.stats = asyncio.run_coroutine_threadsafe(start_stub_wyoming(self.port, **self.kwargs), self.loop).result()
+        return self
+
+    def __exit__(self, *exc):
+        asyncio.run_coroutine_threadsafe(self.server.stop(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()